@@ -0,0 +1,210 @@
+import math
+import numpy as np
+from simulation_utils import model_config
+
+SPREAD_RADIUS = 10.0
+AGENT_SPACING = 20.0
+AGENT_SPEED = 2.0
+STEPS_PER_DAY = 4
+
+
+class AgentPopulation:
+    def __init__(self, n, compartments, initial_counts, width, height, speed, rng):
+        self.compartments = compartments
+        self.width = width
+        self.height = height
+        self.x = rng.uniform(0, width, n)
+        self.y = rng.uniform(0, height, n)
+        self.vx = rng.uniform(-speed, speed, n)
+        self.vy = rng.uniform(-speed, speed, n)
+        self.state = np.repeat(
+            np.arange(len(compartments), dtype=np.int8), initial_counts
+        )
+        rng.shuffle(self.state)
+
+    def index(self, compartment):
+        return self.compartments.index(compartment)
+
+    def move(self, mobile):
+        axes = ((self.x, self.vx, self.width), (self.y, self.vy, self.height))
+        for pos, vel, limit in axes:
+            pos[mobile] += vel[mobile]
+            low = mobile & (pos < 0)
+            high = mobile & (pos > limit)
+            pos[low] = -pos[low]
+            pos[high] = 2 * limit - pos[high]
+            vel[low | high] = -vel[low | high]
+
+    def counts(self):
+        return np.bincount(self.state, minlength=len(self.compartments))
+
+
+def count_neighbours(x, y, targets, sources, radius, nx, ny):
+    # Uniform grid with cell size == radius: every source within `radius` of a
+    # target sits in one of the 3x3 cells around the target's cell.
+    counts = np.zeros(len(targets), dtype=np.int64)
+    if not len(targets) or not len(sources):
+        return counts
+
+    source_cells = (
+        np.minimum((x[sources] / radius).astype(np.int64), nx - 1) * ny
+        + np.minimum((y[sources] / radius).astype(np.int64), ny - 1)
+    )
+    # Cell list: sources sorted by cell plus a dense offset table, so the
+    # range of sources in any cell is starts[c]:starts[c + 1].
+    sorted_sources = sources[np.argsort(source_cells, kind="stable")]
+    starts = np.zeros(nx * ny + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source_cells, minlength=nx * ny), out=starts[1:])
+
+    tx = np.minimum((x[targets] / radius).astype(np.int64), nx - 1)
+    ty = np.minimum((y[targets] / radius).astype(np.int64), ny - 1)
+    target_positions = np.arange(len(targets))
+    r2 = radius * radius
+
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            cx = tx + dx
+            cy = ty + dy
+            valid = (cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny)
+            cells = np.where(valid, cx * ny + cy, 0)
+            lo = starts[cells]
+            pairs = np.where(valid, starts[cells + 1] - lo, 0)
+            total = int(pairs.sum())
+            if not total:
+                continue
+
+            pair_targets = np.repeat(target_positions, pairs)
+            offsets = np.arange(total) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+            pair_sources = sorted_sources[np.repeat(lo, pairs) + offsets]
+            target_ids = targets[pair_targets]
+            d2 = (x[target_ids] - x[pair_sources]) ** 2 + (
+                y[target_ids] - y[pair_sources]
+            ) ** 2
+            counts += np.bincount(pair_targets[d2 < r2], minlength=len(targets))
+
+    return counts
+
+
+def apply_transitions(state, members, hazards, rng):
+    # Competing exits: leave with probability 1 - exp(-sum of hazards), then
+    # pick the destination in proportion to its hazard.
+    rates = np.stack([np.broadcast_to(h, members.shape) for _, h in hazards])
+    total = rates.sum(axis=0)
+    leaving = rng.random(len(members)) < -np.expm1(-total)
+    if not leaving.any():
+        return
+
+    members = members[leaving]
+    rates = rates[:, leaving]
+    if len(hazards) == 1:
+        destinations = np.full(len(members), hazards[0][0], dtype=np.int8)
+    else:
+        cumulative = np.cumsum(rates, axis=0) / rates.sum(axis=0)
+        choice = (rng.random(len(members)) > cumulative).sum(axis=0)
+        destinations = np.array([d for d, _ in hazards], dtype=np.int8)[choice]
+    state[members] = destinations
+
+
+def run_agent_simulation(
+    model="sir",
+    days=100,
+    n=100,
+    initialS=99,
+    initialI=1,
+    seed=None,
+    steps_per_day=STEPS_PER_DAY,
+    radius=SPREAD_RADIUS,
+    speed=AGENT_SPEED,
+    progress=None,
+    **rates,
+):
+    if steps_per_day < 1 or radius <= 0 or n < 1:
+        raise ValueError("n and stepsPerDay must be positive and radius above zero")
+    config = model_config(model, n, initialS, initialI, **rates)
+    spec = config["spec"]
+    compartments = config["compartments"]
+    # Contacts with I are the only route of infection in this engine.
+    if len(spec.infections) != 1 or spec.infections[0][1::2] != (0, compartments.index("I")):
+        raise ValueError(f"Model {model} is not supported by the agent engine")
+    rates = dict(zip(spec.parameters, config["args"][:-1]))
+    beta = rates[spec.parameters[spec.infections[0][0]]]
+
+    initial_infected = min(initialI, n)
+    initial_susceptible = min(initialS, n - initial_infected)
+    initial_counts = np.zeros(len(compartments), dtype=np.int64)
+    initial_counts[0] = initial_susceptible
+    initial_counts[spec.seed] = initial_infected
+    initial_counts[compartments.index("R")] = n - initial_susceptible - initial_infected
+
+    rng = np.random.default_rng(seed)
+    side = math.sqrt(n) * AGENT_SPACING
+    population = AgentPopulation(
+        n, compartments, initial_counts, side, side, speed, rng
+    )
+    nx = ny = max(1, math.ceil(side / radius))
+
+    # beta is scaled by the expected number of agents inside the contact
+    # radius, so it keeps roughly the meaning it has in the ODE models.
+    expected_contacts = math.pi * radius * radius * n / (side * side)
+    dt = 1.0 / steps_per_day
+    contact_hazard = beta * dt / expected_contacts
+
+    S = population.index("S")
+    I = population.index("I")
+    # New infections land in the infection flow's destination: E for
+    # SEIR-like models, else I.
+    infected_into = spec.infections[0][2]
+    isolated = [population.index(c) for c in spec.spec.isolated]
+    transitions = [
+        (
+            population.index(source),
+            [(population.index(dest), rates[param] * dt) for dest, param in options],
+        )
+        for source, options in spec.transitions.items()
+    ]
+
+    history = np.empty((days + 1, len(compartments)), dtype=np.int64)
+    history[0] = population.counts()
+    for day in range(1, days + 1):
+        for _ in range(steps_per_day):
+            state = population.state
+            population.move(~np.isin(state, isolated))
+
+            susceptible = np.flatnonzero(state == S)
+            infectious = np.flatnonzero(state == I)
+            contacts = count_neighbours(
+                population.x, population.y, susceptible, infectious, radius, nx, ny
+            )
+
+            # All transitions are drawn from the state at the start of the step.
+            snapshot = state.copy()
+            for source, hazards in transitions:
+                members = np.flatnonzero(snapshot == source)
+                if source != S and len(members):
+                    apply_transitions(state, members, hazards, rng)
+
+            if len(susceptible):
+                hazards = [(infected_into, contacts * contact_hazard)]
+                hazards += [h for source, hs in transitions if source == S for h in hs]
+                apply_transitions(state, susceptible, hazards, rng)
+
+        history[day] = population.counts()
+        if progress is not None:
+            progress(day / days)
+
+    result = {
+        "time": np.arange(days + 1, dtype=float),
+        **{comp: history[:, i] for i, comp in enumerate(compartments)},
+    }
+    infected = result["I"]
+    result.update(
+        {
+            "agents": n,
+            "seed": seed,
+            "max_infected": int(infected.max()),
+            "peak_day": int(np.argmax(infected)),
+            "final_susceptible": int(result["S"][-1]),
+            "final_recovered": int(result["R"][-1]),
+        }
+    )
+    return result
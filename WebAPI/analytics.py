@@ -0,0 +1,242 @@
+import math
+from collections import namedtuple
+from sqlalchemy import func
+from models import Simulation, SimulationAggregate, db
+from model_registry import get_model
+
+# Fixed-width bins starting at zero; the last bin also holds everything
+# above it. Log-scaled ones bin log10 of the value.
+Bins = namedtuple("Bins", "width count log", defaults=(False,))
+
+# Outcome distributions: moments (bin -1) plus a histogram per metric.
+DISTRIBUTIONS = {
+    "r0": Bins(0.25, 40),
+    "peak_day": Bins(5, 200),
+    "max_infected": Bins(0.1, 100, log=True),
+    "final_size": Bins(0.02, 50),
+}
+# Parameter-vs-outcome scatter, as binned means: for every rate bin, the
+# count, mean and spread of each outcome.
+PARAMETER_BINS = Bins(0.05, 40)
+SCATTER_OUTCOMES = ("peak_fraction", "peak_day", "final_size")
+MOMENTS = -1
+BATCH = 1000
+KEY = ("user_id", "model", "metric", "bin")
+
+
+def bin_index(bins, value):
+    if bins.log:
+        value = math.log10(max(value, 1.0))
+    return min(max(int(value // bins.width), 0), bins.count - 1)
+
+
+def bin_edges(bins, size):
+    edges = [k * bins.width for k in range(size + 1)]
+    return [10**e for e in edges] if bins.log else edges
+
+
+def outcomes(row):
+    # `row` is a dict of Simulation columns (a model instance's or an
+    # import row's, which may leave defaulted columns out).
+    n = row.get("N") or Simulation.__table__.c.N.default.arg
+    values = {
+        "r0": row.get("r0"),
+        "peak_day": row["peak_day"],
+        "max_infected": row["max_infected"],
+        "final_size": (n - row["final_susceptible"]) / n,
+        "peak_fraction": row["max_infected"] / n,
+    }
+    if values["r0"] is None:
+        # As default_r0 will store it.
+        values["r0"] = round(get_model(row["model"]).r0(rates(row).values()), 4)
+    return {
+        name: float(value)
+        for name, value in values.items()
+        if value is not None and math.isfinite(value)
+    }
+
+
+def rates(row):
+    spec = get_model(row["model"])
+    return dict(zip(spec.parameters, spec.rates({**row, **(row.get("extra_params") or {})})))
+
+
+def add_row(deltas, row, sign=1):
+    # Accumulates one simulation's contribution into
+    # {(user_id, model, metric, bin): [count, total, total_sq]}; sign -1
+    # takes it back out.
+    values = outcomes(row)
+
+    def add(metric, index, value):
+        entry = deltas.setdefault((row["user_id"], row["model"], metric, index), [0, 0.0, 0.0])
+        entry[0] += sign
+        entry[1] += sign * value
+        entry[2] += sign * value * value
+
+    add("runs", 0, 0.0)
+    for name, bins in DISTRIBUTIONS.items():
+        if name in values:
+            add(name, MOMENTS, values[name])
+            add(name, bin_index(bins, values[name]), values[name])
+    for parameter, rate in rates(row).items():
+        index = bin_index(PARAMETER_BINS, rate)
+        for outcome in SCATTER_OUTCOMES:
+            if outcome in values:
+                add(f"{parameter}:{outcome}", index, values[outcome])
+    return deltas
+
+
+def simulation_row(simulation):
+    return {c.name: getattr(simulation, c.name) for c in Simulation.__table__.columns}
+
+
+def upsert_statement():
+    # INSERT ... ON CONFLICT DO UPDATE adding to the existing sums, so
+    # concurrent writers never lose an update.
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    table = SimulationAggregate.__table__
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=list(KEY),
+        set_={
+            name: table.c[name] + statement.excluded[name]
+            for name in ("count", "total", "total_sq")
+        },
+    )
+
+
+def apply_deltas(deltas):
+    # Runs in the caller's transaction; it is committed together with the
+    # simulation rows.
+    rows = [
+        dict(zip(KEY, key), count=count, total=total, total_sq=total_sq)
+        for key, (count, total, total_sq) in deltas.items()
+    ]
+    if not rows:
+        return
+    statement = upsert_statement()
+    if statement is not None:
+        for start in range(0, len(rows), BATCH):
+            db.session.execute(statement, rows[start : start + BATCH])
+        return
+    table = SimulationAggregate.__table__
+    for row in rows:
+        updated = db.session.execute(
+            table.update()
+            .where(*[table.c[name] == row[name] for name in KEY])
+            .values(
+                count=table.c.count + row["count"],
+                total=table.c.total + row["total"],
+                total_sq=table.c.total_sq + row["total_sq"],
+            )
+        )
+        if updated.rowcount == 0:
+            db.session.execute(table.insert(), row)
+
+
+def record_simulation(simulation, sign=1):
+    apply_deltas(add_row({}, simulation_row(simulation), sign))
+
+
+def rebuild_analytics(user_id=None):
+    # Recomputes the aggregates from the simulation table, e.g. after the
+    # migration that adds them or a manual cleanup.
+    query = SimulationAggregate.query
+    simulations = db.session.query(*Simulation.__table__.columns)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+        simulations = simulations.filter(Simulation.user_id == user_id)
+    query.delete(synchronize_session=False)
+    deltas = {}
+    count = 0
+    for row in simulations.execution_options(yield_per=BATCH):
+        add_row(deltas, row._asdict())
+        count += 1
+    apply_deltas(deltas)
+    db.session.commit()
+    return count
+
+
+def summary(count, total, total_sq):
+    if count <= 0:
+        return None
+    mean = total / count
+    return {
+        "count": count,
+        "mean": mean,
+        "std": math.sqrt(max(total_sq / count - mean * mean, 0.0)),
+    }
+
+
+def trimmed(rows):
+    # Dense arrays up to the last non-empty bin.
+    size = max((index for index, (count, _, _) in rows.items() if count > 0), default=-1) + 1
+    return size, [rows.get(k, (0, 0.0, 0.0)) for k in range(size)]
+
+
+def user_analytics(user_id, model=None):
+    # Reads only the user's aggregate rows, a bounded number per model, so
+    # the cost does not grow with the length of the history.
+    owned = [SimulationAggregate.user_id == user_id]
+    if model is not None:
+        owned.append(SimulationAggregate.model == model)
+
+    runs = dict(
+        db.session.query(SimulationAggregate.model, SimulationAggregate.count)
+        .filter(*owned, SimulationAggregate.metric == "runs")
+        .all()
+    )
+    grouped = {}
+    for metric, index, count, total, total_sq in (
+        db.session.query(
+            SimulationAggregate.metric,
+            SimulationAggregate.bin,
+            func.sum(SimulationAggregate.count),
+            func.sum(SimulationAggregate.total),
+            func.sum(SimulationAggregate.total_sq),
+        )
+        .filter(*owned, SimulationAggregate.metric != "runs")
+        .group_by(SimulationAggregate.metric, SimulationAggregate.bin)
+    ):
+        grouped.setdefault(metric, {})[index] = (int(count), float(total), float(total_sq))
+
+    distributions = {}
+    for name, bins in DISTRIBUTIONS.items():
+        rows = grouped.get(name, {})
+        moments = rows.pop(MOMENTS, (0, 0.0, 0.0))
+        size, dense = trimmed(rows)
+        distributions[name] = {
+            **(summary(*moments) or {"count": 0, "mean": None, "std": None}),
+            "edges": bin_edges(bins, size),
+            "counts": [count for count, _, _ in dense],
+        }
+
+    scatter = {}
+    for metric, rows in grouped.items():
+        if ":" not in metric:
+            continue
+        size, dense = trimmed(rows)
+        if size == 0:
+            continue
+        parameter, outcome = metric.split(":", 1)
+        stats = [summary(*entry) for entry in dense]
+        scatter.setdefault(parameter, {})[outcome] = {
+            "edges": bin_edges(PARAMETER_BINS, size),
+            "count": [s["count"] if s else 0 for s in stats],
+            "mean": [s["mean"] if s else None for s in stats],
+            "std": [s["std"] if s else None for s in stats],
+        }
+
+    models = {name: count for name, count in runs.items() if count > 0}
+    return {
+        "runs": sum(models.values()),
+        "models": models,
+        "distributions": distributions,
+        "scatter": scatter,
+    }
@@ -7,7 +7,9 @@ from flask_jwt_extended import (
     current_user,
     get_jwt_identity,
 )
-from models import User, TokenBlocklist
+from datetime import datetime, timezone
+from models import User
+from auth_cache import token_revocations
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -61,8 +63,7 @@ def refresh_access():
 @jwt_required(verify_type=False)
 def logout_user():
     jwt = get_jwt()
-    jti = jwt["jti"]
-    token_b = TokenBlocklist(jti=jti)
-    token_b.save()
+    expires_at = datetime.fromtimestamp(jwt["exp"], timezone.utc).replace(tzinfo=None)
+    token_revocations.revoke(jwt["jti"], expires_at)
 
     return jsonify({}), 200
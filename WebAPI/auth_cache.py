@@ -0,0 +1,188 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from models import TokenBlocklist, User, db
+
+
+class UserCache:
+    # email -> (expires_at, column values) for the JWT user loader. Hits are
+    # merged into the request's session with load=False, so no query runs;
+    # the password hash is left out and only loaded if something reads it.
+    def __init__(self, ttl=300, max_entries=10000):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.configure(ttl, max_entries)
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get("USER_CACHE_TTL", self.ttl),
+            app.config.get("USER_CACHE_MAX_ENTRIES", self.max_entries),
+        )
+
+    def configure(self, ttl, max_entries=10000):
+        with self._lock:
+            self.ttl = float(ttl)
+            self.max_entries = int(max_entries)
+            self._entries.clear()
+
+    def get(self, email):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(email)
+                values = entry[1]
+            else:
+                values = None
+
+        if values is not None:
+            user = User(**values)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+
+        user = User.query.filter_by(email=email).one_or_none()
+        if user is not None and self.ttl > 0:
+            with self._lock:
+                self._entries[email] = (now + self.ttl, {"id": user.id, "email": user.email})
+                self._entries.move_to_end(email)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(
+            8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class TokenRevocations:
+    # A Bloom filter over revoked jtis answers "not revoked" without touching
+    # the database; only possible hits are confirmed against the indexed jti
+    # column. Logouts handled by this process are added immediately, rows
+    # written by other processes are picked up at most every `refresh`
+    # seconds, and every `rebuild` seconds the filter is rebuilt from the
+    # table. Expired rows are removed by the purge-blocklist command, not
+    # here, so token checks never write.
+    #
+    # The incremental sync reads rows created since the previous one minus
+    # `margin` seconds: ids and created_at are assigned before commit, so a
+    # slow transaction can become visible after rows with later values.
+    # The margin has to exceed the longest such transaction (and clock skew
+    # between servers).
+    def __init__(self, capacity=100000, refresh=1.0, rebuild=3600.0, margin=60.0):
+        self._lock = threading.Lock()
+        self.configure(capacity, refresh, rebuild, margin)
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get("BLOCKLIST_CAPACITY", self.capacity),
+            app.config.get("BLOCKLIST_REFRESH_SECONDS", self.refresh),
+            app.config.get("BLOCKLIST_REBUILD_SECONDS", self.rebuild),
+            app.config.get("BLOCKLIST_SYNC_MARGIN_SECONDS", self.margin),
+        )
+
+    def configure(self, capacity, refresh=1.0, rebuild=3600.0, margin=60.0):
+        with self._lock:
+            self.capacity = int(capacity)
+            self.refresh = float(refresh)
+            self.rebuild = float(rebuild)
+            self.margin = float(margin)
+            self._filter = None
+            self._synced_at = None
+            self._refreshed_at = 0.0
+            self._built_at = 0.0
+
+    def _build(self, now):
+        # The sync time is taken before the query, so rows written while it
+        # runs are read again by the next incremental sync.
+        synced_at = datetime.utcnow()
+        jtis = [jti for (jti,) in db.session.query(TokenBlocklist.jti) if jti]
+        bloom = BloomFilter(max(self.capacity, 2 * len(jtis)))
+        for jti in jtis:
+            bloom.add(jti)
+        self._filter = bloom
+        self._synced_at = synced_at
+        self._built_at = self._refreshed_at = now
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._filter is None or now - self._built_at >= self.rebuild:
+            self._build(now)
+        elif now - self._refreshed_at >= self.refresh:
+            synced_at = datetime.utcnow()
+            since = self._synced_at - timedelta(seconds=self.margin)
+            rows = db.session.query(TokenBlocklist.jti).filter(
+                TokenBlocklist.created_at >= since
+            )
+            # Rows inside the margin come back on every sync; adding them
+            # once keeps the filter's count meaningful.
+            for (jti,) in rows:
+                if jti and jti not in self._filter:
+                    self._filter.add(jti)
+            self._synced_at = synced_at
+            self._refreshed_at = now
+            if self._filter.count > self._filter.capacity:
+                self._build(now)
+
+    def is_revoked(self, jti):
+        with self._lock:
+            self._sync()
+            if jti not in self._filter:
+                return False
+        return (
+            db.session.query(TokenBlocklist.id)
+            .filter(TokenBlocklist.jti == jti)
+            .first()
+            is not None
+        )
+
+    def revoke(self, jti, expires_at=None):
+        token = TokenBlocklist(jti=jti, expires_at=expires_at)
+        token.save()
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+        return token
+
+
+user_cache = UserCache()
+token_revocations = TokenRevocations()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, user):
+    user_cache.invalidate(user.email)
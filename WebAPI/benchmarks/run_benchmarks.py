@@ -0,0 +1,203 @@
+# Benchmarks for the solver, serialization and HTTP layers.
+#
+#   python benchmarks/run_benchmarks.py --output bench.json
+#   python benchmarks/run_benchmarks.py --compare bench.json --threshold 0.25
+#
+# Every case is timed `repeat` times after a warm-up call; the median is what
+# --compare diffs against, so a run fails only on a consistent slowdown.
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import scipy
+from serialization import dumps, encode_binary
+from simulation_utils import MODEL_PARAMS, run_simulation
+
+DAYS = (100, 1000, 10000, 100000)
+POPULATIONS = (100, 100000, 1000000000)
+HTTP_DAYS = (100, 10000)
+
+
+def initial_state(n):
+    initial_i = max(1, n // 100)
+    return {"n": n, "initialS": n - initial_i, "initialI": initial_i}
+
+
+def solver_cases():
+    for model in MODEL_PARAMS:
+        for days in DAYS:
+            for n in POPULATIONS:
+                params = {"model": model, "days": days, **initial_state(n)}
+                for with_stats in (False, True):
+                    kind = "stats" if with_stats else "raw"
+                    yield (
+                        f"solver.{kind}.{model}.days={days}.n={n}",
+                        lambda p=params, s=with_stats: run_simulation(**p, with_stats=s),
+                    )
+
+
+def serialization_cases():
+    for model in MODEL_PARAMS:
+        for days in DAYS:
+            result = run_simulation(model, days=days)
+            yield (
+                f"serialize.json.{model}.days={days}",
+                lambda r=result: dumps(r),
+            )
+            yield (
+                f"serialize.binary.{model}.days={days}",
+                lambda r=result: encode_binary(r),
+            )
+
+
+def http_cases():
+    from app import create_app
+    from models import db
+
+    database = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    database.close()
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database.name}",
+            "SIMULATION_CACHE_MAX_BYTES": 0,
+        }
+    )
+    with app.app_context():
+        db.create_all()
+
+    client = app.test_client()
+    tokens = client.post(
+        "/auth/register", json={"email": "bench@example.com", "password": "bench"}
+    ).get_json()
+    headers = {"Authorization": f"Bearer {tokens['access']}"}
+
+    def call(path, payload):
+        response = client.post(path, json=payload, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+
+    for model in MODEL_PARAMS:
+        for days in HTTP_DAYS:
+            payload = {"model": model, "days": days, **initial_state(100000)}
+            for path in ("/simulation", "/simulation/view"):
+                yield (
+                    f"http{path.replace('/', '.')}.{model}.days={days}",
+                    lambda p=path, d=payload: call(p, d),
+                )
+
+
+SUITES = {
+    "solver": solver_cases,
+    "serialize": serialization_cases,
+    "http": http_cases,
+}
+
+
+def measure(func, repeat, min_time):
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1000:
+            break
+        number *= 2
+
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = current["median"] / previous["median"]
+        marker = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(f"{name:60s} {previous['median']:.6f}s -> {current['median']:.6f}s ({ratio:.2f}x){marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Epidemica benchmarks")
+    parser.add_argument("--suite", choices=sorted(SUITES), action="append")
+    parser.add_argument("--filter", help="regular expression matched against case names")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="baseline results file to diff against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    options = parser.parse_args()
+
+    pattern = re.compile(options.filter) if options.filter else None
+    results = {}
+    for suite in options.suite or SUITES:
+        for name, func in SUITES[suite]():
+            if pattern and not pattern.search(name):
+                continue
+            results[name] = measure(func, options.repeat, options.min_time)
+            print(f"{name:60s} {results[name]['median']:.6f}s", flush=True)
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {options.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import numpy as np
+from model_registry import get_model
+from models import SimulationTrajectory
+from simulation_cache import cache_key, cached_run_simulation, simulation_cache
+from simulation_utils import run_simulation_batch
+
+
+def cached_trajectory(params):
+    # Any cached run of the same parameters will do: a /view result or the
+    # (possibly resampled) one kept from a POST.
+    for with_stats in (False, True):
+        result = simulation_cache.get(cache_key(params, with_stats))
+        if result is not None:
+            return result
+    return None
+
+
+def load_trajectories(simulations, compartments=None, solver_stats=None):
+    # {id: (columns, source)}, taking each trajectory from the cheapest
+    # place: stored blobs (one query for all of them), then the simulation
+    # cache, then a recompute. Plain runs are recomputed together through
+    # run_simulation_batch, one stacked solve per (model, days) group;
+    # structured and intervention runs go through run_simulation one by one.
+    wanted = compartments + ["time"] if compartments else None
+    stored = SimulationTrajectory.load_many([s.id for s in simulations], wanted)
+    trajectories = {}
+    batch = []
+    for simulation in simulations:
+        if simulation.id in stored:
+            trajectories[simulation.id] = (stored[simulation.id], "stored")
+            continue
+        params = simulation.run_params()
+        result = cached_trajectory(params)
+        if result is not None:
+            trajectories[simulation.id] = (result, "cached")
+        elif params.get("structure") is not None or params.get("interventions") is not None:
+            result = cached_run_simulation(**params, with_stats=False)
+            trajectories[simulation.id] = (result, "computed")
+        else:
+            batch.append((simulation.id, params))
+
+    if batch:
+        solved = run_simulation_batch(
+            [params for _, params in batch], with_stats=False, solver_stats=solver_stats
+        )
+        for group in solved["results"]:
+            names = [name for name in group if isinstance(group[name], np.ndarray) and group[name].ndim == 2]
+            for row, index in enumerate(group["indices"]):
+                columns = {"time": group["time"], **{name: group[name][row] for name in names}}
+                trajectories[batch[index][0]] = (columns, "computed")
+    return trajectories
+
+
+def shared_grid(simulations, points=None):
+    # One grid from day 0 to the longest run (daily by default); shorter runs
+    # are NaN past their own end.
+    days = max(s.days for s in simulations)
+    return np.linspace(0, days, points or days + 1)
+
+
+def resample(columns, grid, compartments):
+    time = np.asarray(columns["time"], dtype=float)
+    inside = (grid >= time[0]) & (grid <= time[-1])
+    return {
+        name: np.where(inside, np.interp(grid, time, np.asarray(columns[name], dtype=float)), np.nan)
+        for name in compartments
+    }
+
+
+def threshold_times(grid, values, threshold):
+    # First time each row reaches the threshold, linearly interpolated
+    # between grid points; NaN when it never does.
+    reached = np.nan_to_num(values, nan=-np.inf) >= threshold
+    first = reached.argmax(axis=1)
+    hit = reached.any(axis=1)
+    previous = np.maximum(first - 1, 0)
+    rows = np.arange(len(values))
+    before, after = values[rows, previous], values[rows, first]
+    span = np.where(after > before, after - before, 1.0)
+    fraction = np.where(first > 0, np.clip((threshold - before) / span, 0, 1), 0.0)
+    times = grid[previous] + fraction * (grid[first] - grid[previous])
+    return np.where(hit, times, np.nan)
+
+
+def compare_metrics(grid, values, reference=0, threshold=None):
+    # values: (K, P) for one compartment. Differences are taken against the
+    # reference row over the part of the grid both runs cover.
+    defined = ~np.isnan(values)
+    filled = np.where(defined, values, -np.inf)
+    peak = filled.argmax(axis=1)
+    rows = np.arange(len(values))
+    peak_time = np.where(defined.any(axis=1), grid[peak], np.nan)
+    peak_value = np.where(defined.any(axis=1), values[rows, peak], np.nan)
+
+    both = defined & defined[reference]
+    gap = np.where(both, np.abs(values - values[reference]), 0.0)
+    # Trapezoids only over intervals where both ends are defined.
+    segment = both[:, 1:] & both[:, :-1]
+    area = np.sum(segment * 0.5 * (gap[:, 1:] + gap[:, :-1]) * np.diff(grid), axis=1)
+    metrics = {
+        "peak_time": peak_time,
+        "peak_value": peak_value,
+        "peak_shift": peak_time - peak_time[reference],
+        "area_between": area,
+        "max_difference": np.where(both.any(axis=1), gap.max(axis=1), np.nan),
+    }
+    if threshold is not None:
+        reached = threshold_times(grid, values, threshold)
+        metrics["time_to_threshold"] = reached
+        metrics["threshold_shift"] = reached - reached[reference]
+    return metrics
+
+
+def nan_to_none(values):
+    # NaN marks "not covered"; JSON gets null for it.
+    values = np.asarray(values, dtype=float)
+    if not np.isnan(values).any():
+        return values
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def compare_trajectories(
+    simulations,
+    compartments=None,
+    points=None,
+    threshold=None,
+    reference=0,
+    solver_stats=None,
+):
+    # Aligned trajectories on a shared grid and difference metrics against
+    # simulations[reference], for every compartment all runs' models have.
+    # Cached results also hold scalar stats, so the model decides what is a
+    # trajectory.
+    loaded = load_trajectories(simulations, compartments, solver_stats)
+    shared = [set(get_model(s.model).compartments) for s in simulations]
+    common = [
+        name
+        for name in get_model(simulations[0].model).compartments
+        if all(name in names and name in loaded[s.id][0] for s, names in zip(simulations, shared))
+    ]
+    if compartments:
+        missing = [name for name in compartments if name not in common]
+        if missing:
+            raise ValueError(f"Not every simulation has {', '.join(missing)}")
+        common = list(compartments)
+
+    grid = shared_grid(simulations, points)
+    series = [resample(loaded[s.id][0], grid, common) for s in simulations]
+    stacked = {name: np.stack([s[name] for s in series]) for name in common}
+    metrics = {
+        name: compare_metrics(grid, values, reference, threshold)
+        for name, values in stacked.items()
+    }
+    return {
+        "time": grid,
+        "reference": simulations[reference].id,
+        "sources": {s.id: loaded[s.id][1] for s in simulations},
+        "series": {name: nan_to_none(values) for name, values in stacked.items()},
+        "metrics": {
+            name: {key: nan_to_none(value) for key, value in values.items()}
+            for name, values in metrics.items()
+        },
+    }
@@ -0,0 +1,25 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+class ComputePool:
+    # One process pool shared by the CPU-bound endpoints (ensembles, fits,
+    # sensitivity analysis), separate from the job queue's pool so that
+    # synchronous requests are not stuck behind queued jobs.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.workers = os.cpu_count() or 1
+
+    def init_app(self, app):
+        self.workers = app.config.get("COMPUTE_WORKERS") or os.cpu_count() or 1
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+
+compute_pool = ComputePool()
@@ -0,0 +1,85 @@
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+# Fewest points each method can reduce to: the two endpoints plus one
+# bucket (LTTB) or one min/max pair.
+MIN_POINTS = {"lttb": 3, "minmax": 4}
+
+
+def bucket_edges(n, n_buckets):
+    # Interior points 1..n-2 split into n_buckets contiguous ranges; the first
+    # and last samples are always kept on their own.
+    return np.linspace(1, n - 1, n_buckets + 1).astype(int)
+
+
+def lttb_indices(x, y, max_points):
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+
+    edges = bucket_edges(n, max_points - 2)
+    indices = np.empty(max_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+
+    # The bucket holding the global maximum keeps it, so the peak survives.
+    peak = int(np.argmax(y))
+    if 0 < peak < n - 1:
+        indices[np.searchsorted(edges, peak, side="right")] = peak
+    return indices
+
+
+def minmax_indices(y, max_points):
+    n = len(y)
+    n_buckets = (max_points - 2) // 2
+    if max_points >= n:
+        return np.arange(n)
+
+    edges = bucket_edges(n, n_buckets)
+    picked = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        picked.append(start + int(np.argmin(y[start:end])))
+        picked.append(start + int(np.argmax(y[start:end])))
+    return np.unique(picked)
+
+
+def check_max_points(max_points, method="lttb"):
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    if max_points < MIN_POINTS[method]:
+        raise ValueError(f"maxPoints must be at least {MIN_POINTS[method]} for {method}")
+
+
+def downsample(result, max_points, method="lttb", key="I"):
+    check_max_points(max_points, method)
+    t = result["time"]
+    if method == "lttb":
+        indices = lttb_indices(t, result[key], max_points)
+    else:
+        indices = minmax_indices(result[key], max_points)
+
+    return take_points(result, indices)
+
+
+def take_points(result, indices):
+    t = result["time"]
+    return {
+        name: values[indices]
+        if isinstance(values, np.ndarray) and values.shape == t.shape
+        else values
+        for name, values in result.items()
+    }
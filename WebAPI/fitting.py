@@ -0,0 +1,295 @@
+import time
+from concurrent.futures import as_completed
+import numpy as np
+from scipy import stats
+from scipy.integrate import odeint
+from scipy.optimize import least_squares
+from simulation_utils import MODEL_PARAMS, params_config
+from solvers import JACOBIANS, KERNELS
+
+DEFAULT_BOUNDS = (1e-6, 10.0)
+DEFAULT_STARTS = 8
+CONFIDENCE = 0.95
+
+
+class FitProblem:
+    # Least squares of one model output against observations, in log-rate
+    # space. Gradients come from the forward sensitivity equations
+    #   dS/dt = J_y S + df/dp,
+    # solved alongside the state. Every term of the model RHS carries exactly
+    # one rate parameter, so df/dp_k is the RHS itself evaluated with p = e_k,
+    # exact and with no finite differences.
+    def __init__(self, model, params, fit, times, observed, target="I"):
+        config = params_config(params)
+        compartments = config["compartments"]
+        if target != "incidence" and target not in compartments:
+            raise ValueError(f"Model {model} has no compartment {target}")
+        unknown = [name for name in fit if name not in MODEL_PARAMS[model]]
+        if unknown or not fit:
+            raise ValueError(
+                f"Parameters to fit must be among {', '.join(MODEL_PARAMS[model])}"
+            )
+
+        self.times = np.asarray(times, dtype=float)
+        self.observed = np.asarray(observed, dtype=float)
+        if self.times.shape != self.observed.shape or self.times.ndim != 1:
+            raise ValueError("times and observed must be equal-length series")
+        if np.any(np.diff(self.times) <= 0) or self.times[0] < 0:
+            raise ValueError("times must be increasing and non-negative")
+        if target == "incidence" and self.times[0] <= 0:
+            raise ValueError("incidence times must start after day 0")
+
+        self.kernel = KERNELS[config["func"]]
+        self.jacobian = JACOBIANS[config["func"]]
+        self.base = np.array(config["args"][:-1], dtype=float)
+        self.N = float(config["args"][-1])
+        self.names = list(MODEL_PARAMS[model])
+        self.fit = list(fit)
+        self.fit_index = [self.names.index(name) for name in fit]
+        self.n = len(compartments)
+        self.infections = config["spec"].infections
+        # Cumulative infections ride along as an extra state, so incidence
+        # (and its sensitivities) is just a difference of that state.
+        self.target = self.n if target == "incidence" else compartments.index(target)
+        self.incidence = target == "incidence"
+        self.units = []
+        for index in self.fit_index:
+            unit = np.zeros(len(self.names))
+            unit[index] = 1.0
+            self.units.append(unit)
+
+        self.grid = np.union1d([0.0], self.times)
+        self.points = np.searchsorted(self.grid, self.times)
+        self.x0 = np.zeros((self.n + 1) * (1 + len(fit)))
+        self.x0[: self.n] = config["y0"]
+        self.solver_nfev = 0
+        self._cache = (None, None, None)
+
+    def rates(self, theta):
+        rates = self.base.copy()
+        rates[self.fit_index] = np.exp(theta)
+        return rates
+
+    def rhs(self, x, t, rates):
+        n, q = self.n, len(self.fit_index)
+        y = x[:n]
+        out = np.empty_like(x)
+        self.kernel(y, out[:n], *rates, self.N)
+        out[n] = self.incidence_rate(y, rates)
+
+        jac = self.state_jacobian(y, t, rates)
+
+        forcing = np.zeros((n + 1, q))
+        column = np.empty(n)
+        for j, unit in enumerate(self.units):
+            self.kernel(y, column, *unit, self.N)
+            forcing[:n, j] = column
+            forcing[n, j] = self.incidence_rate(y, unit)
+
+        sensitivities = x[n + 1 :].reshape(n + 1, q)
+        out[n + 1 :] = (jac @ sensitivities + forcing).ravel()
+        return out
+
+    def incidence_rate(self, y, rates):
+        return sum(
+            rates[p] * y[source] * y[catalyst]
+            for p, source, _, catalyst in self.infections
+        ) / self.N
+
+    def state_jacobian(self, y, t, rates):
+        n = self.n
+        jac = np.zeros((n + 1, n + 1))
+        jac[:n, :n] = self.jacobian(y, t, *rates, self.N)
+        for p, source, _, catalyst in self.infections:
+            jac[n, source] += rates[p] * y[catalyst] / self.N
+            jac[n, catalyst] += rates[p] * y[source] / self.N
+        return jac
+
+    def augmented_jacobian(self, x, t, rates):
+        # Block diagonal: the state Jacobian for the state and, via kron, for
+        # every sensitivity column. The second-order coupling of the
+        # sensitivities to the state is left out; odeint's error control is
+        # on the RHS, so the approximation costs at most a few extra
+        # iterations.
+        jac = self.state_jacobian(x[: self.n], t, rates)
+        size = len(x)
+        full = np.zeros((size, size))
+        full[: self.n + 1, : self.n + 1] = jac
+        full[self.n + 1 :, self.n + 1 :] = np.kron(jac, np.eye(len(self.fit_index)))
+        return full
+
+    def solve(self, theta):
+        if self._cache[0] is not None and np.array_equal(self._cache[0], theta):
+            return self._cache[1], self._cache[2]
+
+        rates = self.rates(theta)
+        result, info = odeint(
+            self.rhs,
+            self.x0,
+            self.grid,
+            args=(rates,),
+            Dfun=self.augmented_jacobian,
+            full_output=True,
+        )
+        self.solver_nfev += int(info["nfe"][-1]) if len(self.grid) > 1 else 0
+        n, q = self.n, len(self.fit_index)
+        values = result[:, self.target]
+        sensitivities = result[:, n + 1 :].reshape(len(self.grid), n + 1, q)[
+            :, self.target, :
+        ]
+        if self.incidence:
+            prediction = values[self.points] - values[self.points - 1]
+            gradient = sensitivities[self.points] - sensitivities[self.points - 1]
+        else:
+            prediction = values[self.points]
+            gradient = sensitivities[self.points]
+        # d/dtheta = d/dp * p for log-parameters.
+        gradient = gradient * rates[self.fit_index]
+        self._cache = (np.array(theta), prediction, gradient)
+        return prediction, gradient
+
+    def residuals(self, theta):
+        return self.solve(theta)[0] - self.observed
+
+    def residual_jacobian(self, theta):
+        return self.solve(theta)[1]
+
+
+def fit_start(spec, theta0, bounds):
+    started = time.perf_counter()
+    problem = FitProblem(**spec)
+    try:
+        solution = least_squares(
+            problem.residuals,
+            theta0,
+            jac=problem.residual_jacobian,
+            bounds=bounds,
+            x_scale="jac",
+        )
+    except (ValueError, np.linalg.LinAlgError) as e:
+        return {"success": False, "message": str(e)}
+    return {
+        "success": bool(solution.success),
+        "message": solution.message,
+        "theta": solution.x,
+        "cost": float(2 * solution.cost),
+        "jacobian": solution.jac,
+        "nfev": int(solution.nfev),
+        "njev": int(solution.njev or 0),
+        "solver_nfev": problem.solver_nfev,
+        "wall_time": time.perf_counter() - started,
+        "start": np.exp(theta0),
+    }
+
+
+def confidence_intervals(best, observations, level=CONFIDENCE):
+    # Gauss-Newton covariance of the log-rates, s^2 (J^T J)^-1, mapped back
+    # through exp so the intervals stay positive.
+    jacobian = best["jacobian"]
+    dof = max(observations - jacobian.shape[1], 1)
+    variance = best["cost"] / dof
+    covariance = variance * np.linalg.pinv(jacobian.T @ jacobian)
+    errors = np.sqrt(np.clip(np.diag(covariance), 0, None))
+    quantile = stats.t.ppf(0.5 + level / 2, dof)
+    return (
+        np.exp(best["theta"] - quantile * errors),
+        np.exp(best["theta"] + quantile * errors),
+        errors,
+    )
+
+
+def fit_parameters(
+    params,
+    fit,
+    times,
+    observed,
+    target="I",
+    bounds=None,
+    starts=DEFAULT_STARTS,
+    seed=None,
+    executor=None,
+    progress=None,
+):
+    spec = {
+        "model": params["model"],
+        "params": params,
+        "fit": fit,
+        "times": times,
+        "observed": observed,
+        "target": target,
+    }
+    problem = FitProblem(**spec)
+    bounds = bounds or {}
+    lower = np.array([bounds.get(name, DEFAULT_BOUNDS)[0] for name in fit], dtype=float)
+    upper = np.array([bounds.get(name, DEFAULT_BOUNDS)[1] for name in fit], dtype=float)
+    if np.any(lower <= 0) or np.any(lower >= upper):
+        raise ValueError("Bounds must be positive with lower below upper")
+    lower, upper = np.log(lower), np.log(upper)
+
+    # The first start is the caller's guess; the rest are drawn log-uniformly
+    # inside the bounds.
+    rng = np.random.default_rng(seed)
+    guess = np.clip(np.log(problem.base[problem.fit_index]), lower, upper)
+    initial = [guess] + [rng.uniform(lower, upper) for _ in range(max(starts, 1) - 1)]
+
+    started = time.perf_counter()
+    runs = []
+    if executor is None:
+        for theta0 in initial:
+            runs.append(fit_start(spec, theta0, (lower, upper)))
+            if progress is not None:
+                progress(len(runs) / len(initial))
+    else:
+        futures = [
+            executor.submit(fit_start, spec, theta0, (lower, upper))
+            for theta0 in initial
+        ]
+        for future in as_completed(futures):
+            runs.append(future.result())
+            if progress is not None:
+                progress(len(runs) / len(initial))
+    wall_time = time.perf_counter() - started
+
+    finished = [run for run in runs if "theta" in run]
+    if not finished:
+        raise ValueError(f"Fit failed: {runs[0]['message']}")
+    best = min(finished, key=lambda run: run["cost"])
+    low, high, errors = confidence_intervals(best, len(problem.observed))
+    fitted = np.exp(best["theta"])
+    prediction, _ = problem.solve(best["theta"])
+
+    return {
+        "parameters": dict(zip(fit, fitted.tolist())),
+        "confidence_intervals": {
+            name: [float(a), float(b)] for name, a, b in zip(fit, low, high)
+        },
+        "log_standard_errors": dict(zip(fit, errors.tolist())),
+        "confidence_level": CONFIDENCE,
+        "sse": best["cost"],
+        "rmse": float(np.sqrt(best["cost"] / len(problem.observed))),
+        "target": target,
+        "times": problem.times,
+        "observed": problem.observed,
+        "fitted": prediction,
+        "starts": [
+            {
+                "start": dict(zip(fit, run["start"].tolist())),
+                "parameters": dict(zip(fit, np.exp(run["theta"]).tolist())),
+                "sse": run["cost"],
+                "success": run["success"],
+                "nfev": run["nfev"],
+                "njev": run["njev"],
+                "solver_nfev": run["solver_nfev"],
+                "wall_time": run["wall_time"],
+            }
+            for run in finished
+        ],
+        "stats": {
+            "starts": len(runs),
+            "converged": sum(run["success"] for run in finished),
+            "nfev": sum(run["nfev"] for run in finished),
+            "njev": sum(run["njev"] for run in finished),
+            "solver_nfev": sum(run["solver_nfev"] for run in finished),
+            "wall_time": wall_time,
+        },
+    }
@@ -0,0 +1,355 @@
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+import numpy as np
+from sqlalchemy import insert, select
+from analytics import add_row, apply_deltas
+from metapopulation import parse_structure
+from models import Simulation, SimulationTrajectory, db, generate_guid
+from serialization import dumps
+from simulation_utils import MODEL_PARAMS
+from trajectory_codec import ENCODING, decode_series, encode_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ("ndjson", "csv", "parquet")
+EXPORT_BATCH = 1000
+IMPORT_BATCH = 500
+# Parquet uploads are spooled to disk past this size.
+IMPORT_SPOOL = 8 * 1024 * 1024
+COPY_CHUNK = 64 * 1024
+
+EXPORT_COLUMNS = [
+    c for c in Simulation.__table__.columns if c.name != "user_id"
+]
+JSON_COLUMNS = [c.name for c in EXPORT_COLUMNS if isinstance(c.type, db.JSON)]
+# Nested JSON that has no natural Parquet type; it is written as JSON text.
+TEXT_COLUMNS = ("structure", "interventions", "events")
+
+
+def float_map(value):
+    # extra_params: {name: rate}; Parquet hands maps back as pairs.
+    return {str(name): float(rate) for name, rate in dict(value).items()}
+
+
+def json_field(value):
+    # CSV and Parquet exports carry nested JSON as text.
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def structure_field(value):
+    return parse_structure(json_field(value))
+
+
+CONVERTERS = {
+    "extra_params": float_map,
+    "structure": structure_field,
+    "interventions": json_field,
+    "events": json_field,
+}
+IMPORT_FIELDS = {
+    c.name: CONVERTERS.get(c.name, c.type.python_type)
+    for c in EXPORT_COLUMNS
+    if c.name not in ("id", "created_at")
+}
+REQUIRED_FIELDS = (
+    "model",
+    "beta",
+    "gamma",
+    "days",
+    "max_infected",
+    "peak_day",
+    "final_susceptible",
+    "final_recovered",
+)
+
+
+def export_batches(user_id, trajectories=False):
+    # Server-side cursor: rows arrive EXPORT_BATCH at a time and each batch
+    # is dropped once encoded, so memory does not grow with the history.
+    statement = (
+        select(*EXPORT_COLUMNS, Simulation.hit.label("hit"))
+        .where(Simulation.user_id == user_id)
+        .order_by(Simulation.created_at, Simulation.id)
+        .execution_options(yield_per=EXPORT_BATCH)
+    )
+    for partition in db.session.execute(statement).mappings().partitions():
+        rows = [dict(row) for row in partition]
+        for row in rows:
+            row["created_at"] = row["created_at"].isoformat() if row["created_at"] else None
+            row["hit"] = float(row["hit"]) if row["hit"] is not None else None
+        if trajectories:
+            attach_trajectories(rows)
+        yield rows
+
+
+def attach_trajectories(rows):
+    by_id = {row["id"]: row for row in rows}
+    stored = db.session.execute(
+        select(
+            SimulationTrajectory.simulation_id,
+            SimulationTrajectory.compartment,
+            SimulationTrajectory.points,
+            SimulationTrajectory.data,
+        )
+        .where(SimulationTrajectory.simulation_id.in_(list(by_id)))
+        .order_by(SimulationTrajectory.id)
+    )
+    for row in rows:
+        row["trajectory"] = None
+    for simulation_id, compartment, points, data in stored:
+        row = by_id[simulation_id]
+        if row["trajectory"] is None:
+            row["trajectory"] = {}
+        row["trajectory"][compartment] = decode_series(data, points)
+
+
+def export_ndjson(batches):
+    for rows in batches:
+        yield b"".join(dumps(row) + b"\n" for row in rows)
+
+
+def export_csv(batches):
+    names = [c.name for c in EXPORT_COLUMNS] + ["hit"]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=names, extrasaction="ignore")
+    writer.writeheader()
+    for rows in batches:
+        for row in rows:
+            for name in JSON_COLUMNS:
+                if row[name] is not None:
+                    row[name] = json.dumps(row[name])
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink:
+    # Write-only file object for ParquetWriter; each row group is handed out
+    # as soon as it is written instead of building the file in memory.
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema(trajectories):
+    types = {
+        "String": pa.string(),
+        "Integer": pa.int64(),
+        "Float": pa.float64(),
+        "DateTime": pa.string(),
+        "JSON": pa.map_(pa.string(), pa.float64()),
+    }
+    fields = [
+        pa.field(
+            c.name,
+            pa.string() if c.name in TEXT_COLUMNS else types[type(c.type).__name__],
+        )
+        for c in EXPORT_COLUMNS
+    ]
+    fields.append(pa.field("hit", pa.float64()))
+    if trajectories:
+        fields.append(pa.field("trajectory", pa.map_(pa.string(), pa.list_(pa.float32()))))
+    return pa.schema(fields)
+
+
+def export_parquet(batches, trajectories=False):
+    schema = parquet_schema(trajectories)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for rows in batches:
+        for row in rows:
+            for name in TEXT_COLUMNS:
+                if row[name] is not None:
+                    row[name] = json.dumps(row[name])
+        if trajectories:
+            for row in rows:
+                if row["trajectory"] is not None:
+                    row["trajectory"] = [
+                        (name, values.tolist()) for name, values in row["trajectory"].items()
+                    ]
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_history(user_id, fmt="ndjson", trajectories=False):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == "parquet" and pa is None:
+        raise ValueError("Parquet export requires pyarrow")
+    if fmt == "csv" and trajectories:
+        raise ValueError("Trajectories can only be exported as NDJSON or Parquet")
+
+    batches = export_batches(user_id, trajectories)
+    if fmt == "csv":
+        return export_csv(batches)
+    if fmt == "parquet":
+        return export_parquet(batches, trajectories)
+    return export_ndjson(batches)
+
+
+def parse_ndjson(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line:
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                raise ValueError(f"Line {number}: invalid JSON")
+
+
+def parse_csv(lines):
+    # Rows as export_csv writes them: empty cells are missing values and the
+    # JSON columns hold JSON text.
+    for number, row in enumerate(csv.DictReader(lines), 1):
+        record = {name: value for name, value in row.items() if name and value != ""}
+        for name in JSON_COLUMNS:
+            if name in record:
+                try:
+                    record[name] = json.loads(record[name])
+                except ValueError:
+                    raise ValueError(f"Row {number}: invalid JSON in {name}")
+        yield number, record
+
+
+def spool(stream, max_bytes):
+    # Parquet keeps its metadata at the end of the file, so the upload cannot
+    # be parsed as it arrives; it is copied to a temporary file (held in
+    # memory only up to IMPORT_SPOOL bytes) instead.
+    spooled = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL)
+    size = 0
+    while True:
+        chunk = stream.read(COPY_CHUNK)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            spooled.close()
+            raise ValueError(f"Parquet uploads are limited to {max_bytes // 2**20} MB")
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def parse_parquet(stream, max_bytes):
+    if pa is None:
+        raise ValueError("Parquet import requires pyarrow")
+    number = 0
+    with spool(stream, max_bytes) as spooled:
+        for batch in pq.ParquetFile(spooled).iter_batches(IMPORT_BATCH):
+            for record in batch.to_pylist():
+                number += 1
+                if isinstance(record.get("trajectory"), list):
+                    record["trajectory"] = dict(record["trajectory"])
+                yield number, record
+
+
+def import_row(record, number, user_id):
+    missing = [name for name in REQUIRED_FIELDS if record.get(name) is None]
+    if missing:
+        raise ValueError(f"Row {number}: missing {', '.join(missing)}")
+    if record["model"] not in MODEL_PARAMS:
+        raise ValueError(f"Row {number}: unknown model {record['model']}")
+
+    try:
+        row = {
+            name: convert(record[name])
+            for name, convert in IMPORT_FIELDS.items()
+            if record.get(name) is not None
+        }
+    except (TypeError, ValueError):
+        raise ValueError(f"Row {number}: invalid value")
+    row["id"] = generate_guid()
+    row["user_id"] = user_id
+    row["created_at"] = (
+        datetime.fromisoformat(record["created_at"])
+        if record.get("created_at")
+        else datetime.utcnow()
+    )
+
+    trajectory_rows = []
+    if record.get("trajectory"):
+        columns = {
+            name: np.asarray(values, dtype=float)
+            for name, values in record["trajectory"].items()
+        }
+        trajectory_rows = [
+            {
+                "simulation_id": row["id"],
+                "compartment": name,
+                "points": points,
+                "encoding": ENCODING,
+                "data": blob,
+            }
+            for name, points, blob in encode_columns(columns)
+        ]
+    return row, trajectory_rows
+
+
+def import_history(records, user_id):
+    # Rows are inserted IMPORT_BATCH at a time with executemany-style
+    # INSERTs and committed once at the end, so a bad row rolls back the
+    # whole import. The dashboard aggregates are accumulated over the whole
+    # import and written once, in the same transaction.
+    simulations, trajectories = [], []
+    deltas = {}
+    imported = 0
+
+    def flush():
+        if simulations:
+            db.session.execute(insert(Simulation), simulations)
+            for row in simulations:
+                add_row(deltas, row)
+        if trajectories:
+            db.session.execute(insert(SimulationTrajectory), trajectories)
+        simulations.clear()
+        trajectories.clear()
+
+    try:
+        for number, record in records:
+            if not isinstance(record, dict):
+                raise ValueError(f"Row {number}: expected an object")
+            row, trajectory_rows = import_row(record, number, user_id)
+            simulations.append(row)
+            trajectories.extend(trajectory_rows)
+            imported += 1
+            if len(simulations) >= IMPORT_BATCH:
+                flush()
+        flush()
+        apply_deltas(deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return imported
@@ -0,0 +1,358 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from simulation_utils import MODEL_PARAMS
+from solvers import SOLVERS
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+PROFILE_HEADER = "X-Profile"
+PROFILE_LIMIT = 60
+# Solver stats labels that are not model names.
+AGGREGATE_MODELS = ("batch", "compare")
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = format_labels(self.labels + ("le",), label_values + (f"{bound:g}",))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, label_values, value=1):
+        self.series[label_values] = self.series.get(label_values, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (
+        str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for v in values
+    )
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+@contextmanager
+def phase(name):
+    # Accumulates wall time per named phase of the current request; outside a
+    # request (jobs, scripts) it only runs the block.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            phases = g.setdefault("phases", {})
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def solver_stats(model, solver="odeint"):
+    # A dict for simulate_raw/run_simulation to fill with nfev/steps; it is
+    # folded into the solver counters when the request finishes.
+    # They are registered before the request is validated, so unknown models
+    # and solvers are folded together as in request_model().
+    stats = {}
+    if has_request_context():
+        if model not in MODEL_PARAMS and model not in AGGREGATE_MODELS:
+            model = "other"
+        if solver not in SOLVERS:
+            solver = "other"
+        g.setdefault("solver_stats", []).append((model, solver, stats))
+    return stats
+
+
+def request_model():
+    data = request.get_json(silent=True) if request.is_json else None
+    model = data.get("model") if isinstance(data, dict) else None
+    if model is None:
+        return ""
+    # Unknown values are folded together to keep the label set bounded.
+    return model if model in MODEL_PARAMS else "other"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Histogram(
+            "epidemica_request_duration_seconds",
+            "Request latency by route and model.",
+            ("method", "route", "model", "status"),
+        )
+        self.phases = Histogram(
+            "epidemica_phase_duration_seconds",
+            "Time spent per request phase.",
+            ("route", "phase"),
+        )
+        self.nfev = Counter(
+            "epidemica_solver_function_evaluations_total",
+            "Right-hand side evaluations made by the ODE solver.",
+            ("model", "solver"),
+        )
+        self.steps = Counter(
+            "epidemica_solver_steps_total",
+            "Integration steps taken by the ODE solver.",
+            ("model", "solver"),
+        )
+        self.solves = Counter(
+            "epidemica_solver_runs_total",
+            "Solver runs, split by whether the result came from the cache.",
+            ("model", "solver", "cached"),
+        )
+        self.db_queries = Histogram(
+            "epidemica_db_queries_per_request",
+            "SQL statements executed per request.",
+            ("route",),
+            COUNT_BUCKETS,
+        )
+        self.db_checkouts = Histogram(
+            "epidemica_db_checkouts_per_request",
+            "Pool connections checked out per request.",
+            ("route",),
+            COUNT_BUCKETS,
+        )
+        self.db_held = Histogram(
+            "epidemica_db_connection_held_seconds",
+            "Time a request kept pool connections checked out.",
+            ("route",),
+        )
+        self.db_connections = Counter(
+            "epidemica_db_connections_opened_total",
+            "New database connections opened by the pool.",
+            (),
+        )
+        self.admins = set()
+        self.gauges = []
+
+    def init_app(self, app):
+        self.admins = {
+            email.strip()
+            for email in app.config.get("ADMIN_EMAILS", "").split(",")
+            if email.strip()
+        }
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def add_gauges(self, collect):
+        # `collect` returns [(name, help, value)] at scrape time.
+        self.gauges.append(collect)
+
+    def before_request(self):
+        g.request_started = time.perf_counter()
+        if request.is_json:
+            with phase("parse"):
+                request.get_json(silent=True)
+        if request.headers.get(PROFILE_HEADER) and self.is_admin():
+            g.profiler = start_profiler(request.headers[PROFILE_HEADER])
+
+    def after_request(self, response):
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            response = profile_response(profiler, response)
+
+        started = g.pop("request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        phases = g.get("phases", {})
+        usage = connection_usage() if "db" in g else None
+
+        with self._lock:
+            self.requests.observe(
+                (request.method, route, request_model(), str(response.status_code)),
+                elapsed,
+            )
+            for name, seconds in phases.items():
+                self.phases.observe((route, name), seconds)
+            if usage is not None:
+                queries, checkouts, held = usage
+                self.db_queries.observe((route,), queries)
+                self.db_checkouts.observe((route,), checkouts)
+                self.db_held.observe((route,), held)
+            for model, solver, stats in g.get("solver_stats", []):
+                cached = "true" if stats.get("cached") else "false"
+                self.solves.inc((model, solver, cached))
+                self.nfev.inc((model, solver), stats.get("nfev", 0))
+                self.steps.inc((model, solver), stats.get("steps", 0))
+
+        timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items()]
+        if usage is not None:
+            timings.append(f'db;dur={usage[2] * 1000:.2f};desc="queries={usage[0]}"')
+        timings.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(timings)
+        return response
+
+    def is_admin(self):
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            return False
+        return get_jwt_identity() in self.admins
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for metric in (
+                self.requests,
+                self.phases,
+                self.nfev,
+                self.steps,
+                self.solves,
+                self.db_queries,
+                self.db_checkouts,
+                self.db_held,
+                self.db_connections,
+            ):
+                lines.extend(metric.render())
+        for collect in self.gauges:
+            for name, help_text, value in collect():
+                lines.extend(
+                    [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+                )
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        # Metrics are per process; with several workers each one is scraped
+        # (or aggregated) separately.
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+def start_profiler(kind):
+    # "X-Profile: pyinstrument" uses pyinstrument when it is installed; any
+    # other value gets cProfile.
+    if kind == "pyinstrument" and Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def profile_response(profiler, response):
+    # The profile replaces the body; the original status is kept in a header.
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(
+            PROFILE_LIMIT
+        )
+        profiled = Response(output.getvalue(), mimetype="text/plain")
+    else:
+        profiler.stop()
+        profiled = Response(profiler.output_html(), mimetype="text/html")
+    profiled.headers["X-Profiled-Status"] = str(response.status_code)
+    return profiled
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    if has_request_context():
+        phases = g.setdefault("phases", {})
+        phases["sql"] = phases.get("sql", 0.0) + time.perf_counter() - started
+        request_db()["queries"] += 1
+
+
+def request_db():
+    # Per-request connection usage: statements, checkouts, and checkout
+    # times of the connections still held ({record id: start}).
+    if "db" not in g:
+        g.db = {"queries": 0, "checkouts": 0, "held": 0.0, "open": {}}
+    return g.db
+
+
+def connection_usage():
+    # Connections still checked out when the response is sent (sessions
+    # that did not commit) are returned at teardown; count them up to now.
+    usage = g.db
+    now = time.perf_counter()
+    held = usage["held"] + sum(now - started for started in usage["open"].values())
+    return usage["queries"], usage["checkouts"], held
+
+
+@event.listens_for(Pool, "connect")
+def _pool_connect(dbapi_connection, connection_record):
+    with metrics._lock:
+        metrics.db_connections.inc(())
+
+
+@event.listens_for(Pool, "checkout")
+def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    if has_request_context():
+        usage = request_db()
+        usage["checkouts"] += 1
+        usage["open"][id(connection_record)] = time.perf_counter()
+
+
+@event.listens_for(Pool, "checkin")
+def _pool_checkin(dbapi_connection, connection_record):
+    if has_request_context() and "db" in g:
+        started = g.db["open"].pop(id(connection_record), None)
+        if started is not None:
+            g.db["held"] += time.perf_counter() - started
+
+
+metrics = Metrics()
@@ -0,0 +1,268 @@
+import numpy as np
+from scipy.integrate import LSODA
+from scipy.optimize import brentq
+from model_registry import PARAMETERS, get_model
+from solvers import JACOBIANS, record_stats
+
+KINDS = ("step", "linear")
+DIRECTIONS = ("above", "below")
+MAX_SCHEDULES = 32
+MAX_EVENTS = 32
+MAX_KNOTS = 1000
+# odeint's default tolerances, so a run whose schedules never change a rate
+# matches the plain one.
+RTOL = 1.49012e-8
+ATOL = 1.49012e-8
+
+
+def parameter_name(spec, name):
+    # Rates may be named as in the model or by their request key (vRate).
+    for parameter in spec.spec.parameters:
+        if name in (parameter.name, PARAMETERS[parameter.name].key):
+            return parameter.name
+    raise ValueError(f"Model {spec.name} has no parameter {name}")
+
+
+def parse_rates(spec, values, name):
+    if not isinstance(values, dict):
+        raise ValueError(f"{name} must map parameters to numbers")
+    rates = {}
+    for key, value in values.items():
+        parameter = parameter_name(spec, key)
+        try:
+            rates[parameter] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must map parameters to numbers")
+    if any(not np.isfinite(value) or value < 0 for value in rates.values()):
+        raise ValueError(f"{name} must be finite and non-negative")
+    return rates
+
+
+def parse_interventions(interventions, model):
+    # Validates schedules and threshold events and returns them in canonical
+    # form (model parameter names, plain lists), which is cached and stored.
+    #   schedules: [{"parameter": "beta", "kind": "step" | "linear",
+    #                "times": [...], "values": [...]}]
+    #   events: [{"compartment": "I", "above": 100, "scale": {"beta": 0.6},
+    #             "set": {...}, "name": "lockdown"}]
+    # A step schedule holds values[i] from times[i] on (the base rate before
+    # times[0]); a linear one interpolates between its knots and holds the
+    # end values outside them. Each event fires once, the first time the
+    # compartment crosses its threshold in the given direction; a condition
+    # that already holds at the start has to stop holding first.
+    spec = get_model(model)
+    if not isinstance(interventions, dict):
+        raise ValueError("interventions must be an object")
+    schedules = interventions.get("schedules") or []
+    events = interventions.get("events") or []
+    if len(schedules) > MAX_SCHEDULES or len(events) > MAX_EVENTS:
+        raise ValueError(
+            f"Interventions are limited to {MAX_SCHEDULES} schedules and {MAX_EVENTS} events"
+        )
+
+    parsed_schedules = []
+    for schedule in schedules:
+        if not isinstance(schedule, dict):
+            raise ValueError("Every schedule must be an object")
+        kind = schedule.get("kind", "step")
+        if kind not in KINDS:
+            raise ValueError(f"Schedule kind must be one of {', '.join(KINDS)}")
+        try:
+            times = np.asarray(schedule.get("times"), dtype=float)
+            values = np.asarray(schedule.get("values"), dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError("Schedule times and values must be numeric lists")
+        if times.ndim != 1 or times.shape != values.shape or not 0 < len(times) <= MAX_KNOTS:
+            raise ValueError(f"Schedules need 1 to {MAX_KNOTS} times with one value each")
+        if times[0] < 0 or np.any(np.diff(times) <= 0) or not np.all(np.isfinite(times)):
+            raise ValueError("Schedule times must be increasing and non-negative")
+        if not np.all(np.isfinite(values)) or np.any(values < 0):
+            raise ValueError("Schedule values must be finite and non-negative")
+        parsed_schedules.append(
+            {
+                "parameter": parameter_name(spec, schedule.get("parameter")),
+                "kind": kind,
+                "times": times.tolist(),
+                "values": values.tolist(),
+            }
+        )
+    scheduled = [s["parameter"] for s in parsed_schedules]
+    if len(set(scheduled)) != len(scheduled):
+        raise ValueError("Each parameter can have only one schedule")
+
+    parsed_events = []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            raise ValueError("Every event must be an object")
+        if event.get("compartment") not in spec.compartments:
+            raise ValueError(f"Model {spec.name} has no compartment {event.get('compartment')}")
+        directions = [d for d in DIRECTIONS if event.get(d) is not None]
+        if len(directions) != 1:
+            raise ValueError("Events need exactly one of above or below")
+        try:
+            threshold = float(event[directions[0]])
+        except (TypeError, ValueError):
+            raise ValueError("Event thresholds must be numbers")
+        scale = parse_rates(spec, event.get("scale") or {}, "scale")
+        assigned = parse_rates(spec, event.get("set") or {}, "set")
+        if not scale and not assigned:
+            raise ValueError("Events need a scale or set action")
+        parsed_events.append(
+            {
+                "name": str(event.get("name") or f"event {index}"),
+                "compartment": event["compartment"],
+                directions[0]: threshold,
+                "scale": scale,
+                "set": assigned,
+            }
+        )
+    return {"schedules": parsed_schedules, "events": parsed_events}
+
+
+class RateSchedule:
+    # All schedules tabulated once over the union of their knots: on every
+    # segment each rate is value + slope * (t - start), so a lookup in the
+    # RHS is one searchsorted and one fused multiply-add over the rate
+    # vector, with no per-call interpolation.
+    def __init__(self, spec, base, schedules):
+        names = [p.name for p in spec.spec.parameters]
+        knots = [t for s in schedules for t in s["times"]]
+        self.breaks = np.unique(np.concatenate([[0.0], knots]))
+        self.values = np.tile(np.asarray(base, dtype=float), (len(self.breaks), 1))
+        self.slopes = np.zeros_like(self.values)
+        for schedule in schedules:
+            p = names.index(schedule["parameter"])
+            times = np.asarray(schedule["times"])
+            values = np.asarray(schedule["values"])
+            if schedule["kind"] == "step":
+                index = np.searchsorted(times, self.breaks, side="right") - 1
+                self.values[:, p] = np.where(index >= 0, values[index], base[p])
+            else:
+                self.values[:, p] = np.interp(self.breaks, times, values)
+                # The last segment runs past every knot, so it stays flat.
+                self.slopes[:-1, p] = np.diff(self.values[:, p]) / np.diff(self.breaks)
+
+    def __call__(self, t):
+        k = np.searchsorted(self.breaks, t, side="right") - 1
+        return self.values[k] + self.slopes[k] * (t - self.breaks[k])
+
+
+class EventState:
+    # Event actions accumulate: scales multiply the scheduled rates, sets
+    # replace them for the rest of the run. An event is armed once its
+    # condition has been seen not to hold, and fires when it then does.
+    def __init__(self, spec, events, y0):
+        self.names = [p.name for p in spec.spec.parameters]
+        self.compartments = spec.compartments
+        self.pending = list(enumerate(events))
+        self.armed = set()
+        self.scale = np.ones(len(self.names))
+        self.override = np.full(len(self.names), np.nan)
+        self.fired = []
+        self.arm(y0)
+
+    def rates(self, scheduled):
+        return np.where(np.isnan(self.override), scheduled * self.scale, self.override)
+
+    def distance(self, event, y):
+        # Positive once the event's condition holds.
+        value = y[self.compartments.index(event["compartment"])]
+        if "above" in event:
+            return value - event["above"]
+        return event["below"] - value
+
+    def fire(self, index, event, t):
+        for name, factor in event["scale"].items():
+            self.scale[self.names.index(name)] *= factor
+        for name, value in event["set"].items():
+            self.override[self.names.index(name)] = value
+        self.pending.remove((index, event))
+        self.fired.append({"event": index, "name": event["name"], "time": float(t)})
+
+    def arm(self, y):
+        for index, event in self.pending:
+            if self.distance(event, y) < 0:
+                self.armed.add(index)
+
+    def fire_simultaneous(self, y, t):
+        # Armed events that crossed at the same instant as the one that
+        # stopped the solver.
+        for index, event in list(self.pending):
+            if index in self.armed and self.distance(event, y) >= 0:
+                self.fire(index, event, t)
+
+    def first_crossing(self, dense, t_old, t_new, y_new):
+        # Earliest root in (t_old, t_new] among the armed events whose
+        # condition holds at the end of the step; it did not hold at its
+        # start, or they would have fired then.
+        first = None
+        for index, event in self.pending:
+            if index not in self.armed or self.distance(event, y_new) < 0:
+                continue
+            distance = lambda s: self.distance(event, dense(s))
+            root = t_old if distance(t_old) >= 0 else brentq(distance, t_old, t_new)
+            if first is None or root < first[0]:
+                first = (root, index, event)
+        return first
+
+
+def integrate_interventions(
+    model, y0, t, rates, n, interventions, progress=None, stats=None
+):
+    # One LSODA integration over the whole grid. Schedules only change the
+    # rates the RHS sees, so the solver is never stopped for them; it is
+    # restarted only where an event fires, since the RHS jumps there.
+    # Returns the (T, n_comp) states and the fired events.
+    spec = get_model(model)
+    schedule = RateSchedule(spec, rates, interventions["schedules"])
+    state = EventState(spec, interventions["events"], y0)
+    jacobian = JACOBIANS.get(spec.model)
+
+    def fun(time, y):
+        return spec.model(y, time, *state.rates(schedule(time)), n)
+
+    def jac(time, y):
+        return jacobian(y, time, *state.rates(schedule(time)), n)
+
+    y = np.asarray(y0, dtype=float)
+    out = np.empty((len(t), len(y)))
+    out[0] = y
+    filled = 1
+    start = t[0]
+    steps = nfev = njev = 0
+    while filled < len(t):
+        solver = LSODA(
+            fun,
+            start,
+            y,
+            t[-1],
+            rtol=RTOL,
+            atol=ATOL,
+            jac=jac if jacobian is not None else None,
+        )
+        while solver.status == "running":
+            solver.step()
+            if solver.status == "failed":
+                raise ValueError("Integration with interventions failed")
+            steps += 1
+            dense = solver.dense_output()
+            crossing = state.first_crossing(dense, solver.t_old, solver.t, solver.y)
+            end = crossing[0] if crossing else solver.t
+            reached = np.searchsorted(t, end, side="right")
+            out[filled:reached] = dense(t[filled:reached]).T
+            filled = reached
+            if progress is not None:
+                progress(filled / len(t))
+            if crossing:
+                start, y = end, dense(end)
+                state.fire(crossing[1], crossing[2], end)
+                state.fire_simultaneous(y, end)
+                state.arm(y)
+                break
+            state.arm(solver.y)
+        nfev += solver.nfev
+        njev += solver.njev
+        if solver.status == "finished":
+            break
+    record_stats(stats, nfev, steps, njev)
+    return out, state.fired
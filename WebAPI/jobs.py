@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from agent_simulation import run_agent_simulation
+from simulation_utils import run_simulation
+from stochastic import run_ensemble
+from fitting import fit_parameters
+from sensitivity import run_sensitivity
+from reports import render_report, render_reports
+
+ACTIVE_STATUSES = ("queued", "running")
+DEFAULT_STORE = "epidemica_jobs.db"
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class UserLimitReached(Exception):
+    pass
+
+
+@contextmanager
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def init_store(path):
+    with connect(path) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, kind TEXT NOT NULL, "
+            "status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, "
+            "params TEXT NOT NULL, result BLOB, error TEXT, simulation_id TEXT, "
+            "cancel_requested INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, owner INTEGER)"
+        )
+        # Stores created before jobs recorded the web process that owns them.
+        columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            connection.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_jobs_user_status ON jobs (user_id, status)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status)")
+
+
+def update_job(path, job_id, **fields):
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with connect(path) as connection:
+        connection.execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id)
+        )
+
+
+def process_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def simulation_job(params, progress):
+    return run_simulation(**params, progress=progress)
+
+
+def agent_job(params, progress):
+    return run_agent_simulation(**params, progress=progress)
+
+
+def ensemble_job(params, progress):
+    # Already inside a pool process, so the replicate blocks run inline.
+    options = dict(params)
+    model_params = options.pop("params")
+    return run_ensemble(model_params, **options, progress=progress)
+
+
+def fit_job(params, progress):
+    options = dict(params)
+    model_params = options.pop("params")
+    return fit_parameters(model_params, **options, progress=progress)
+
+
+def sensitivity_job(params, progress):
+    options = dict(params)
+    model_params = options.pop("params")
+    return run_sensitivity(model_params, **options, progress=progress)
+
+
+def report_job(params, progress):
+    return render_report(params)
+
+
+def reports_job(params, progress):
+    return render_reports(params["payloads"], progress)
+
+
+JOB_KINDS = {
+    "simulation": simulation_job,
+    "agents": agent_job,
+    "ensemble": ensemble_job,
+    "fit": fit_job,
+    "sensitivity": sensitivity_job,
+    "report": report_job,
+    "reports": reports_job,
+}
+
+
+def run_job(path, job_id, kind, params):
+    # Runs inside a pool process: status, progress and the result all go
+    # through the shared SQLite store rather than back over the pipe.
+    with connect(path) as connection:
+        row = connection.execute(
+            "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if row["cancel_requested"]:
+        update_job(path, job_id, status="cancelled", finished_at=time.time())
+        return None
+
+    update_job(path, job_id, status="running", started_at=time.time())
+
+    def progress(fraction):
+        with connect(path) as connection:
+            connection.execute(
+                "UPDATE jobs SET progress = ? WHERE id = ?", (fraction, job_id)
+            )
+            row = connection.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row["cancel_requested"]:
+            raise JobCancelled()
+
+    try:
+        result = JOB_KINDS[kind](params, progress)
+    except JobCancelled:
+        update_job(path, job_id, status="cancelled", finished_at=time.time())
+        return None
+    except Exception as e:
+        update_job(
+            path, job_id, status="failed", error=str(e), finished_at=time.time()
+        )
+        return None
+
+    update_job(
+        path,
+        job_id,
+        status="done",
+        progress=1.0,
+        result=pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+        finished_at=time.time(),
+    )
+    return result
+
+
+class JobQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {}
+        self.path = None
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get("JOB_STORE_PATH")
+            or os.path.join(tempfile.gettempdir(), DEFAULT_STORE),
+            app.config.get("JOB_WORKERS"),
+            app.config.get("JOB_QUEUE_SIZE", 32),
+            app.config.get("JOB_USER_LIMIT", 4),
+        )
+        self.fail_orphans()
+
+    def configure(self, path, workers=None, queue_size=32, user_limit=4):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = int(queue_size)
+        self.user_limit = int(user_limit)
+        init_store(path)
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def fail_orphans(self):
+        # Every job row records the web process (owner) whose pool runs it
+        # and whose callback saves its result. Active jobs of an owner that
+        # is gone (a crashed, killed or recycled worker, or a previous
+        # deployment) will never finish, and would count against the user
+        # limit forever. This process's own active jobs are orphans too when
+        # they have no future here (a reused pid).
+        with self._lock:
+            self._fail_orphans()
+
+    def _fail_orphans(self):
+        pid = os.getpid()
+        live = {job_id for job_id, f in self._futures.items() if not f.done()}
+        with connect(self.path) as connection:
+            rows = connection.execute(
+                "SELECT id, owner FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES
+            ).fetchall()
+            alive = {}
+            orphans = []
+            for row in rows:
+                owner = row["owner"]
+                if owner == pid:
+                    if row["id"] not in live:
+                        orphans.append(row["id"])
+                    continue
+                if owner not in alive:
+                    alive[owner] = process_alive(owner)
+                if not alive[owner]:
+                    orphans.append(row["id"])
+            if orphans:
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                    f"WHERE status IN (?, ?) AND id IN ({', '.join('?' * len(orphans))})",
+                    ("Interrupted by a server restart", time.time(), *ACTIVE_STATUSES, *orphans),
+                )
+
+    def fail_owner(self, pid):
+        # For gunicorn's child_exit hook, in the master: the exited worker's
+        # pool went down with it.
+        with connect(self.path) as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                "WHERE owner = ? AND status IN (?, ?)",
+                ("Interrupted: the web worker exited", time.time(), pid, *ACTIVE_STATUSES),
+            )
+
+    def shutdown(self):
+        # For gunicorn's worker_exit hook: jobs the pool has not started are
+        # dropped rather than run while the worker exits (child_exit then
+        # fails them), so the exit does not wait on them.
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def submit(self, user_id, kind, params, on_done=None):
+        with self._lock:
+            self._futures = {k: f for k, f in self._futures.items() if not f.done()}
+            self._fail_orphans()
+            # The store is shared by every web worker, so the limits hold
+            # for the whole server, not per worker.
+            if self.queued_count() >= self.queue_size:
+                raise QueueFull()
+            if self.active_count(user_id) >= self.user_limit:
+                raise UserLimitReached()
+
+            job_id = str(uuid.uuid4())
+            with connect(self.path) as connection:
+                connection.execute(
+                    "INSERT INTO jobs (id, user_id, kind, status, params, created_at, owner) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, user_id, kind, json.dumps(params), time.time(), os.getpid()),
+                )
+            future = self._pool().submit(run_job, self.path, job_id, kind, params)
+            self._futures[job_id] = future
+
+        def callback(f):
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                # The pool itself failed (e.g. a worker was killed), so
+                # run_job never got to record it.
+                update_job(
+                    self.path,
+                    job_id,
+                    status="failed",
+                    error=str(f.exception()),
+                    finished_at=time.time(),
+                )
+                return
+            if on_done is None or f.result() is None:
+                return
+            try:
+                on_done(job_id, f.result())
+            except Exception as e:
+                logger.exception("Job %s: saving the result failed", job_id)
+                update_job(self.path, job_id, status="failed", error=str(e))
+
+        future.add_done_callback(callback)
+        return job_id
+
+    def queued_count(self):
+        with connect(self.path) as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+            ).fetchone()[0]
+
+    def active_count(self, user_id):
+        # Jobs of owners that are gone do not count, even before
+        # fail_orphans has marked them.
+        with connect(self.path) as connection:
+            owners = connection.execute(
+                "SELECT owner, COUNT(*) FROM jobs WHERE user_id = ? AND status IN (?, ?) "
+                "GROUP BY owner",
+                (user_id, *ACTIVE_STATUSES),
+            ).fetchall()
+        pid = os.getpid()
+        return sum(
+            count for owner, count in owners if owner == pid or process_alive(owner)
+        )
+
+    def get(self, job_id, user_id):
+        with connect(self.path) as connection:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE id = ? AND user_id = ?", (job_id, user_id)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = pickle.loads(job["result"]) if job["result"] else None
+        del job["cancel_requested"]
+        return job
+
+    def cancel(self, job_id, user_id):
+        job = self.get(job_id, user_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+
+        update_job(self.path, job_id, cancel_requested=1)
+        future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            update_job(self.path, job_id, status="cancelled", finished_at=time.time())
+        return self.get(job_id, user_id)
+
+    def set_simulation(self, job_id, simulation_id):
+        update_job(self.path, job_id, simulation_id=simulation_id)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,312 @@
+import numpy as np
+from scipy import sparse
+from scipy.integrate import BDF
+from scipy.sparse.linalg import ArpackNoConvergence, eigs
+from model_registry import get_model
+from solvers import RK4_SUBSTEPS, record_stats
+
+# LSODA (behind odeint) only takes dense or banded Jacobians, so structured
+# models are integrated with BDF, which factorises a sparse one directly.
+RTOL = 1e-6
+ATOL = 1e-6
+# Next-generation matrices up to this size get a dense eigensolve; larger
+# ones use ARPACK for the dominant eigenvalue only.
+DENSE_EIGEN_LIMIT = 500
+
+
+def parse_matrix(value, shape, name):
+    try:
+        matrix = np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a numeric matrix")
+    if matrix.shape != shape:
+        raise ValueError(f"{name} must be a {shape[0]}x{shape[1]} matrix")
+    if not np.all(np.isfinite(matrix)) or np.any(matrix < 0):
+        raise ValueError(f"{name} must be finite and non-negative")
+    return matrix
+
+
+def parse_mobility(value, regions):
+    # Dense M x M, or sparse triplets {"rows", "cols", "values"}: the fraction
+    # of their time residents of a region spend in another one. The rest of
+    # the time they are at home, so diagonal entries are derived, not read.
+    if value is None:
+        rows = cols = np.zeros(0, dtype=int)
+        values = np.zeros(0)
+    elif isinstance(value, dict):
+        try:
+            rows = np.asarray(value.get("rows", []), dtype=int)
+            cols = np.asarray(value.get("cols", []), dtype=int)
+            values = np.asarray(value.get("values", []), dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError("mobility must hold integer rows/cols and numeric values")
+        if not rows.shape == cols.shape == values.shape or rows.ndim != 1:
+            raise ValueError("mobility rows, cols and values must be equal-length lists")
+        if np.any(rows < 0) or np.any(rows >= regions) or np.any(cols < 0) or np.any(cols >= regions):
+            raise ValueError("mobility indices must refer to regions")
+        if not np.all(np.isfinite(values)) or np.any(values < 0):
+            raise ValueError("mobility must be finite and non-negative")
+    else:
+        dense = parse_matrix(value, (regions, regions), "mobility")
+        rows, cols = np.nonzero(dense)
+        values = dense[rows, cols]
+
+    away = rows != cols
+    matrix = sparse.coo_matrix(
+        (values[away], (rows[away], cols[away])), shape=(regions, regions)
+    ).tocsr()
+    matrix.eliminate_zeros()
+    if np.any(matrix.sum(axis=1).A1 > 1 + 1e-9):
+        raise ValueError("mobility fractions of a region must sum to at most 1")
+    return matrix.tocoo()
+
+
+def parse_structure(structure, initial_infected=1):
+    # Validates an age x region structure and returns it in canonical form
+    # (plain lists, sparse mobility), which is what is cached and stored.
+    if not isinstance(structure, dict):
+        raise ValueError("structure must be an object")
+    try:
+        population = np.asarray(structure.get("population"), dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError("population must be a regions x age groups matrix")
+    if population.ndim != 2 or 0 in population.shape:
+        raise ValueError("population must be a regions x age groups matrix")
+    regions, ages = population.shape
+    population = parse_matrix(population, (regions, ages), "population")
+    if population.sum() <= 0:
+        raise ValueError("population must not be empty")
+
+    if structure.get("contacts") is None:
+        if ages > 1:
+            raise ValueError("contacts are required with several age groups")
+        contacts = np.ones((1, 1))
+    else:
+        contacts = parse_matrix(structure["contacts"], (ages, ages), "contacts")
+
+    if structure.get("initialInfected") is None:
+        # Spread over every group in proportion to its size.
+        infected = population * (initial_infected / population.sum())
+    else:
+        infected = parse_matrix(structure["initialInfected"], (regions, ages), "initialInfected")
+    if np.any(infected > population):
+        raise ValueError("initialInfected cannot exceed the population of a group")
+
+    labels = {}
+    for key, size in (("regions", regions), ("ageGroups", ages)):
+        names = structure.get(key) or [str(i) for i in range(size)]
+        if len(names) != size:
+            raise ValueError(f"{key} must name all {size} entries")
+        labels[key] = [str(name) for name in names]
+
+    mobility = parse_mobility(structure.get("mobility"), regions)
+    return {
+        "population": population.tolist(),
+        "contacts": contacts.tolist(),
+        "mobility": {
+            "rows": mobility.row.tolist(),
+            "cols": mobility.col.tolist(),
+            "values": mobility.data.tolist(),
+        },
+        "initialInfected": infected.tolist(),
+        **labels,
+    }
+
+
+class StructuredModel:
+    # A registered model replicated over M regions x K age groups. The state
+    # is compartment-major, (n_comp, M, K) flattened. Residents of region i
+    # spend a fraction P[i, j] of their time in region j and mix there by age
+    # through the contact matrix C, so the force of infection on group (i, a)
+    # from a catalyst compartment X is
+    #   lambda = P ((P^T X) / N_eff) C^T,   N_eff = P^T N.
+    # That is linear in X, so the RHS is a few sparse and small dense
+    # products. With one region, one age group and C = [[1]] it reduces to
+    # the base model.
+    def __init__(self, model, structure):
+        self.spec = get_model(model)
+        self.structure = structure
+        self.population = np.asarray(structure["population"], dtype=float)
+        self.infected = np.asarray(structure["initialInfected"], dtype=float)
+        self.contacts = np.asarray(structure["contacts"], dtype=float)
+        self.regions, self.ages = self.population.shape
+        self.groups = self.regions * self.ages
+        self.size = len(self.spec.compartments) * self.groups
+
+        mobility = structure["mobility"]
+        away = sparse.csr_matrix(
+            (mobility["values"], (mobility["rows"], mobility["cols"])),
+            shape=(self.regions, self.regions),
+        )
+        home = sparse.diags(1 - away.sum(axis=1).A1)
+        self.mobility = (away + home).tocsr()
+        self.mobility_t = self.mobility.T.tocsr()
+        effective = self.mobility_t @ self.population
+        self.inverse_effective = np.divide(
+            1.0, effective, out=np.zeros_like(effective), where=effective > 0
+        )
+        self.coupling = self.coupling_matrix()
+        # Region-diagonal blocks of the coupling: the sparsity pattern of the
+        # Newton Jacobian (see jacobian_function).
+        local = self.coupling.tocoo()
+        keep = local.row // self.ages == local.col // self.ages
+        self.local_coupling = sparse.coo_matrix(
+            (local.data[keep], (local.row[keep], local.col[keep])), shape=local.shape
+        )
+
+    def coupling_matrix(self):
+        # lambda.ravel() = coupling @ X.ravel(), assembled once per run:
+        # coupling[(i, a), (k, b)] = C[a, b] * sum_j P[i, j] P[k, j] / N_eff[j, b].
+        coupling = sparse.csr_matrix((self.groups, self.groups))
+        for b in range(self.ages):
+            mixing = (
+                self.mobility @ sparse.diags(self.inverse_effective[:, b]) @ self.mobility_t
+            )
+            column = np.zeros((self.ages, self.ages))
+            column[:, b] = self.contacts[:, b]
+            coupling = coupling + sparse.kron(mixing, column, format="csr")
+        return coupling.tocsr()
+
+    def force(self, x):
+        return self.mobility @ ((self.mobility_t @ x) * self.inverse_effective) @ self.contacts.T
+
+    def y0(self):
+        y = np.zeros((len(self.spec.compartments), self.regions, self.ages))
+        y[0] = self.population - self.infected
+        y[self.spec.seed] += self.infected
+        return y.ravel()
+
+    def rhs(self, y, rates):
+        y = y.reshape(-1, self.regions, self.ages)
+        out = np.zeros_like(y)
+        forces = {}
+        for p, s, d, c in self.spec.flows:
+            if c >= 0:
+                if c not in forces:
+                    forces[c] = self.force(y[c])
+                flow = rates[p] * y[s] * forces[c]
+            else:
+                flow = rates[p] * y[s]
+            out[s] -= flow
+            out[d] += flow
+        return out.ravel()
+
+    def jacobian_function(self, rates):
+        # The sparsity pattern is fixed for the run: linear flows give
+        # constant diagonal blocks, each infection flow a diagonal block in
+        # the susceptible column and the coupling pattern in the catalyst
+        # column. Only the values are recomputed per call.
+        # Cross-region terms of the coupling (those of order of the mobility
+        # fractions) are left out: kron(P P^T, C) fills in badly under LU,
+        # while the region-local pattern factorises without fill. With
+        # strong mobility BDF may take more corrector iterations or smaller
+        # steps; the states it returns still meet RTOL/ATOL.
+        G = self.groups
+        diagonal = np.arange(G)
+        coupling = self.local_coupling
+        rows, cols, constant = [], [], []
+        for p, s, d, c in self.spec.flows:
+            if c < 0:
+                for target, sign in ((s, -1.0), (d, 1.0)):
+                    rows.append(target * G + diagonal)
+                    cols.append(s * G + diagonal)
+                    constant.append(np.full(G, sign * rates[p]))
+        infections = [flow for flow in self.spec.flows if flow[3] >= 0]
+        for _, s, d, c in infections:
+            for target in (s, d):
+                rows += [target * G + diagonal, target * G + coupling.row]
+                cols += [s * G + diagonal, c * G + coupling.col]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=int)
+
+        def jacobian(t, y):
+            y = y.reshape(-1, G)
+            values = list(constant)
+            for p, s, _, c in infections:
+                along = rates[p] * (self.coupling @ y[c])
+                across = rates[p] * y[s][coupling.row] * coupling.data
+                values += [-along, -across, along, across]
+            return sparse.csc_matrix(
+                (np.concatenate(values), (rows, cols)), shape=(self.size, self.size)
+            )
+
+        return jacobian
+
+    def integrate(self, rates, t, solver="odeint", progress=None, stats=None):
+        # (T, size) states on the grid t.
+        y = self.y0()
+        out = np.empty((len(t), self.size))
+        out[0] = y
+        if len(t) < 2:
+            return out
+        if solver == "rk4":
+            steps = 0
+            for i in range(1, len(t)):
+                h = (t[i] - t[i - 1]) / RK4_SUBSTEPS
+                for _ in range(RK4_SUBSTEPS):
+                    k1 = self.rhs(y, rates)
+                    k2 = self.rhs(y + 0.5 * h * k1, rates)
+                    k3 = self.rhs(y + 0.5 * h * k2, rates)
+                    k4 = self.rhs(y + h * k3, rates)
+                    y = y + h / 6.0 * (k1 + 2 * (k2 + k3) + k4)
+                    steps += 1
+                out[i] = y
+                if progress is not None:
+                    progress(i / (len(t) - 1))
+            record_stats(stats, 4 * steps, steps)
+            return out
+        if solver != "odeint":
+            raise ValueError(f"Unknown solver: {solver}")
+
+        integrator = BDF(
+            lambda time, state: self.rhs(state, rates),
+            t[0],
+            y,
+            t[-1],
+            rtol=RTOL,
+            atol=ATOL,
+            jac=self.jacobian_function(rates),
+        )
+        steps = 0
+        filled = 1
+        while filled < len(t):
+            integrator.step()
+            if integrator.status == "failed":
+                raise ValueError("Structured model integration failed")
+            steps += 1
+            reached = np.searchsorted(t, integrator.t, side="right")
+            if reached > filled:
+                out[filled:reached] = integrator.dense_output()(t[filled:reached]).T
+                filled = reached
+                if progress is not None:
+                    progress(filled / len(t))
+        record_stats(stats, integrator.nfev, steps, integrator.njev)
+        return out
+
+    def r0(self, rates):
+        # Spectral radius of the structured next-generation matrix. Transfers
+        # act within a group, so V is V_base (x) I and every infection flow
+        # contributes (E_dc V_base^-1) (x) rate * diag(N) coupling to F V^-1.
+        size, new_infections, transfers = self.spec.next_generation
+        V = np.zeros((size, size))
+        for row, column, p, sign in transfers:
+            V[row, column] += sign * rates[p]
+        if abs(np.linalg.det(V)) < 1e-300:
+            return float("inf")
+        inverse = np.linalg.inv(V)
+        transmission = sparse.diags(self.population.ravel()) @ self.coupling
+        ngm = sparse.csr_matrix((size * self.groups, size * self.groups))
+        for row, column, p in new_infections:
+            block = np.zeros((size, size))
+            block[row] = inverse[column]
+            ngm = ngm + sparse.kron(block, rates[p] * transmission, format="csr")
+
+        if ngm.shape[0] <= DENSE_EIGEN_LIMIT:
+            return float(np.abs(np.linalg.eigvals(ngm.toarray())).max())
+        try:
+            values = eigs(ngm, k=1, which="LM", return_eigenvectors=False)
+        except ArpackNoConvergence as e:
+            values = e.eigenvalues
+            if not len(values):
+                raise ValueError("R0 eigenvalue solve did not converge")
+        return float(np.abs(values).max())
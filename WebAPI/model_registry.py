@@ -0,0 +1,271 @@
+import linecache
+from collections import namedtuple
+import numpy as np
+from solvers import JACOBIANS, KERNELS, njit
+
+# A flow moves individuals from `source` to `dest` at `rate * source`, or at
+# `rate * source * catalyst / N` for mass-action terms such as infection.
+Flow = namedtuple("Flow", "source dest rate catalyst", defaults=(None,))
+# `key` is the name the parameter has in request bodies, e.g. vRate.
+Parameter = namedtuple("Parameter", "name default key", defaults=(None,))
+
+MODELS = {}
+MODEL_PARAMS = {}
+PARAMETERS = {}
+REQUIRED_COMPARTMENTS = ("S", "I", "R")
+# Stored in non-null columns of every saved simulation.
+REQUIRED_PARAMETERS = ("beta", "gamma")
+
+
+class ModelSpec:
+    # Declarative description of a compartmental model. Every flow carries
+    # exactly one rate parameter, which is what the fitting code relies on.
+    def __init__(
+        self,
+        name,
+        compartments,
+        parameters,
+        flows,
+        seed=None,
+        isolated=(),
+        final_outputs=None,
+    ):
+        self.name = name
+        self.compartments = list(compartments)
+        self.parameters = [
+            p if isinstance(p, Parameter) else Parameter(*p) for p in parameters
+        ]
+        self.flows = [f if isinstance(f, Flow) else Flow(*f) for f in flows]
+        # Compartment that receives the initially infected individuals.
+        self.seed = seed or self.compartments[1]
+        # Compartments that take no part in contacts in the agent engine.
+        self.isolated = tuple(isolated)
+        # Extra outputs reported as the final size of a compartment, e.g.
+        # {"final_vaccinated": "V"}.
+        self.final_outputs = dict(final_outputs or {})
+        self.validate()
+
+    def validate(self):
+        names = [p.name for p in self.parameters]
+        missing = [c for c in REQUIRED_COMPARTMENTS if c not in self.compartments]
+        if missing:
+            raise ValueError(f"{self.name}: missing compartments {', '.join(missing)}")
+        missing = [p for p in REQUIRED_PARAMETERS if p not in names]
+        if missing:
+            raise ValueError(f"{self.name}: missing parameters {', '.join(missing)}")
+        if len(self.name) > 20:
+            raise ValueError(f"{self.name}: model names are limited to 20 characters")
+        if len(set(self.compartments)) != len(self.compartments) or len(set(names)) != len(names):
+            raise ValueError(f"{self.name}: duplicate compartment or parameter")
+        compartments = set(self.compartments)
+        for flow in self.flows:
+            ends = {flow.source, flow.dest, flow.catalyst or flow.source}
+            if not ends <= compartments or flow.rate not in names:
+                raise ValueError(f"{self.name}: invalid flow {flow}")
+        if not {self.seed, *self.final_outputs.values()} <= compartments:
+            raise ValueError(f"{self.name}: unknown seed or output compartment")
+        if not any(flow.catalyst for flow in self.flows):
+            raise ValueError(f"{self.name}: needs at least one infection flow")
+
+
+class CompiledModel:
+    # Generated once per spec: an odeint-style RHS returning a list, an
+    # in-place kernel for the rk4 and batch paths, and an analytic Jacobian,
+    # all plain Python source specialised to the model's flows, so they run
+    # (and numba-compile) exactly like hand-written ones.
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec.name
+        self.compartments = spec.compartments
+        self.parameters = [p.name for p in spec.parameters]
+        index = {c: i for i, c in enumerate(spec.compartments)}
+        rate = {name: i for i, name in enumerate(self.parameters)}
+        # (parameter, source, dest, catalyst) as indices; catalyst is -1 for
+        # linear flows.
+        self.flows = [
+            (
+                rate[f.rate],
+                index[f.source],
+                index[f.dest],
+                index[f.catalyst] if f.catalyst else -1,
+            )
+            for f in spec.flows
+        ]
+        self.infections = [flow for flow in self.flows if flow[3] >= 0]
+        self.transitions = {}
+        for f in spec.flows:
+            if f.catalyst is None:
+                self.transitions.setdefault(f.source, []).append((f.dest, f.rate))
+        self.seed = index[spec.seed]
+
+        source = self.source()
+        filename = f"<model {self.name}>"
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        namespace = {}
+        exec(compile(source, filename, "exec"), namespace)
+        self.model = namespace["model"]
+        self.kernel = namespace["kernel"]
+        self.jacobian = namespace["jacobian"]
+        self.next_generation = self.next_generation_structure()
+
+    def flow_terms(self):
+        terms = []
+        for p, s, _, c in self.flows:
+            name = self.parameters[p]
+            if c >= 0:
+                terms.append(f"{name} * y[{s}] * y[{c}] / N")
+            else:
+                terms.append(f"{name} * y[{s}]")
+        return terms
+
+    def source(self):
+        n = len(self.compartments)
+        arguments = ", ".join(self.parameters + ["N"])
+        flows = [f"    f{k} = {term}" for k, term in enumerate(self.flow_terms())]
+        balance = [[] for _ in range(n)]
+        jacobian = [[[] for _ in range(n)] for _ in range(n)]
+        for k, (p, s, d, c) in enumerate(self.flows):
+            balance[s].append(f"- f{k}")
+            balance[d].append(f"+ f{k}")
+            name = self.parameters[p]
+            if c >= 0:
+                partials = [(s, f"{name} * y[{c}] / N"), (c, f"{name} * y[{s}] / N")]
+            else:
+                partials = [(s, name)]
+            for column, partial in partials:
+                jacobian[s][column].append(f"- {partial}")
+                jacobian[d][column].append(f"+ {partial}")
+        # Untouched compartments still get a row of the right shape in
+        # batched kernels.
+        balance = [
+            signed_sum(parts) if parts else f"0.0 * y[{i}]"
+            for i, parts in enumerate(balance)
+        ]
+
+        lines = [f"def model(y, t, {arguments}):", *flows]
+        lines.append("    return [" + ", ".join(balance) + "]")
+        lines += ["", "", f"def kernel(y, out, {arguments}):", *flows]
+        lines += [f"    out[{i}] = {expression}" for i, expression in enumerate(balance)]
+        lines += ["", "", f"def jacobian(y, t, {arguments}):", "    return ["]
+        lines += [
+            "        [" + ", ".join(signed_sum(parts) or "0.0" for parts in row) + "],"
+            for row in jacobian
+        ]
+        lines.append("    ]")
+        return "\n".join(lines) + "\n"
+
+    def next_generation_structure(self):
+        # Infected states: reachable from an infection's destination and
+        # able to reach a transmitting (catalyst) compartment, without going
+        # back through a susceptible one (waning immunity, R -> S, is not
+        # part of an infection). Compartments such as Q or H that never
+        # transmit again do not change R0.
+        susceptible = {s for _, s, _, _ in self.infections}
+        forward = {}
+        backward = {}
+        for _, s, d, _ in self.flows:
+            if s not in susceptible and d not in susceptible:
+                forward.setdefault(s, set()).add(d)
+                backward.setdefault(d, set()).add(s)
+
+        def closure(start, edges):
+            seen, stack = set(start), list(start)
+            while stack:
+                for nxt in edges.get(stack.pop(), ()):
+                    if nxt not in seen:
+                        seen.add(nxt)
+                        stack.append(nxt)
+            return seen
+
+        reachable = closure({d for _, _, d, _ in self.infections}, forward)
+        transmitting = closure({c for _, _, _, c in self.infections}, backward)
+        infected = sorted(reachable & transmitting)
+        position = {c: i for i, c in enumerate(infected)}
+
+        # At the disease-free equilibrium S = N, so a mass-action flow
+        # contributes its rate to F[dest, catalyst].
+        new_infections = [
+            (position[d], position[c], p)
+            for p, _, d, c in self.infections
+            if d in position and c in position
+        ]
+        transfers = []
+        for p, s, d, c in self.flows:
+            if c >= 0 or s not in position:
+                continue
+            transfers.append((position[s], position[s], p, 1.0))
+            if d in position:
+                transfers.append((position[d], position[s], p, -1.0))
+        return len(infected), new_infections, transfers
+
+    def r0(self, rates):
+        # Spectral radius of the next-generation matrix F V^-1. `rates` are
+        # scalars or equal-length arrays (one entry per scenario).
+        size, new_infections, transfers = self.next_generation
+        rates = np.broadcast_arrays(*[np.asarray(r, dtype=float) for r in rates])
+        shape = rates[0].shape
+        F = np.zeros(shape + (size, size))
+        V = np.zeros(shape + (size, size))
+        for row, column, p in new_infections:
+            F[..., row, column] += rates[p]
+        for row, column, p, sign in transfers:
+            V[..., row, column] += sign * rates[p]
+
+        singular = np.abs(np.linalg.det(V)) < 1e-300
+        V[singular] = np.eye(size)
+        # F V^-1 = (V^-T F^T)^T, without forming the inverse.
+        ngm = np.swapaxes(
+            np.linalg.solve(np.swapaxes(V, -1, -2), np.swapaxes(F, -1, -2)), -1, -2
+        )
+        radius = np.abs(np.linalg.eigvals(ngm)).max(axis=-1)
+        radius = np.where(singular, np.inf, radius)
+        return float(radius) if radius.ndim == 0 else radius
+
+    def extra_outputs(self, compartments):
+        if not self.spec.final_outputs:
+            return {}
+        return {
+            name: np.take(compartments[compartment], -1, axis=-1)
+            for name, compartment in self.spec.final_outputs.items()
+        }
+
+    def rates(self, params):
+        # Positional rate arguments, in declaration order, from a dict that
+        # may leave some out (or hold None for them).
+        return tuple(
+            p.default if params.get(p.name) is None else float(params[p.name])
+            for p in self.spec.parameters
+        )
+
+
+def signed_sum(parts):
+    # ["+ a", "- b"] -> "a - b"; ["- a"] -> "-a"; [] -> "".
+    expression = " ".join(parts)
+    if expression.startswith("+ "):
+        return expression[2:]
+    return "-" + expression[2:] if expression else ""
+
+
+def register(spec):
+    if spec.name in MODELS:
+        raise ValueError(f"Model {spec.name} is already registered")
+    for parameter in spec.parameters:
+        known = PARAMETERS.get(parameter.name)
+        if known is not None and known.default != parameter.default:
+            raise ValueError(f"{parameter.name}: conflicting default values")
+    compiled = CompiledModel(spec)
+    for parameter in spec.parameters:
+        PARAMETERS.setdefault(
+            parameter.name, parameter._replace(key=parameter.key or parameter.name)
+        )
+    MODELS[spec.name] = compiled
+    MODEL_PARAMS[spec.name] = tuple(compiled.parameters)
+    KERNELS[compiled.model] = njit(compiled.kernel) if njit is not None else compiled.kernel
+    JACOBIANS[compiled.model] = compiled.jacobian
+    return compiled
+
+
+def get_model(name):
+    if name not in MODELS:
+        raise ValueError(f"Unknown model: {name}")
+    return MODELS[name]
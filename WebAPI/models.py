@@ -1,9 +1,13 @@
 import uuid
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Numeric, cast, func
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import backref, deferred, relationship, undefer
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from trajectory_codec import ENCODING, decode_series, encode_columns
+import sir_models  # registers the built-in models
+from model_registry import get_model
 
 db = SQLAlchemy()
 
@@ -12,6 +16,15 @@ def generate_guid():
     return str(uuid.uuid4())
 
 
+def default_r0(context):
+    # Rows inserted without an r0 (bulk imports, scripts) get it from their
+    # own parameters.
+    params = context.get_current_parameters()
+    spec = get_model(params["model"])
+    rates = spec.rates({**params, **(params.get("extra_params") or {})})
+    return round(spec.r0(rates), 4)
+
+
 class Simulation(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=generate_guid)
     model = db.Column(db.String(20), nullable=False)
@@ -25,42 +38,151 @@ class Simulation(db.Model):
     v_rate = db.Column(db.Float)  # SEIRV
     h_rate = db.Column(db.Float)  # SEIHR
     mu = db.Column(db.Float)  # SEIHR, SEIQR
+    # Rates of registered models that have no column of their own.
+    extra_params = db.Column(db.JSON)
+    # Regions x age groups structure (see metapopulation.parse_structure);
+    # N, initialS and initialI then hold its totals.
+    structure = db.Column(db.JSON)
+    # Rate schedules and threshold events (see
+    # interventions.parse_interventions), and the events that fired:
+    # [{"event", "name", "time"}].
+    interventions = db.Column(db.JSON)
+    events = db.Column(db.JSON)
     days = db.Column(db.Integer, nullable=False)
 
     max_infected = db.Column(db.Float, nullable=False)
     peak_day = db.Column(db.Integer, nullable=False)
     final_susceptible = db.Column(db.Float, nullable=False)
     final_recovered = db.Column(db.Float, nullable=False)
+    # Stored at save time from the model's next-generation matrix, so no
+    # per-model formula is needed here or in SQL.
+    r0 = db.Column(db.Float, default=default_r0)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
     user = relationship("User", backref="simulations")
 
-    @hybrid_property
-    def r0(self):
-        if self.model == 'seiqr':
-        # SEIQR: R0 = β/(γ+δ)
-            return round(self.beta / (self.gamma + self.delta), 4)
-        elif self.model == 'seihr':
-        # SEIHR: R0 = β/(γ+η)
-            return round(self.beta / (self.gamma + self.h_rate), 4)
-        return round(self.beta / self.gamma, 4)
-    
+    # Keyset pagination of a user's history walks this index in order.
+    __table_args__ = (
+        db.Index("ix_simulation_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
     @hybrid_property
     def hit(self):
         return round((self.r0 - 1) / self.r0, 4)
 
+    @hit.expression
+    def hit(cls):
+        return func.round(cast((cls.r0 - 1) / cls.r0, Numeric), 4)
+
+    def run_params(self):
+        # Parameters a model ignores are stored as NULL; fall back to the
+        # run_simulation defaults so the result is identical.
+        params = {
+            "model": self.model,
+            "beta": self.beta,
+            "gamma": self.gamma,
+            "sigma": self.sigma,
+            "delta": self.delta,
+            "v_rate": self.v_rate,
+            "h_rate": self.h_rate,
+            "mu": self.mu,
+            "days": self.days,
+            "n": self.N,
+            "initialS": self.initialS,
+            "initialI": self.initialI,
+            "structure": self.structure,
+            "interventions": self.interventions,
+            **(self.extra_params or {}),
+        }
+        return {k: v for k, v in params.items() if v is not None}
+
     def to_dict(self):
         data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        data["r0"] = self.r0
         data["hit"] = self.hit
         data["created_at"] = self.created_at.isoformat() if self.created_at else None
         return data
 
 
+class SimulationTrajectory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    simulation_id = db.Column(
+        db.String(36),
+        db.ForeignKey("simulation.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    compartment = db.Column(db.String(10), nullable=False)
+    points = db.Column(db.Integer, nullable=False)
+    encoding = db.Column(db.String(20), nullable=False, default=ENCODING)
+    data = deferred(db.Column(db.LargeBinary, nullable=False))
+
+    simulation = relationship(
+        "Simulation",
+        backref=backref("trajectories", cascade="all, delete-orphan", lazy="dynamic"),
+    )
+
+    @property
+    def values(self):
+        # The blob is only fetched and decoded when a column is asked for.
+        if not hasattr(self, "_values"):
+            self._values = decode_series(self.data, self.points)
+        return self._values
+
+    @classmethod
+    def from_result(cls, result):
+        return [
+            cls(compartment=name, points=points, data=blob)
+            for name, points, blob in encode_columns(result)
+        ]
+
+    @classmethod
+    def load(cls, simulation_id, compartments=None):
+        # `data` is deferred for listings; here every row's blob is decoded,
+        # so it is loaded with the rows instead of one query per row.
+        query = cls.query.options(undefer(cls.data)).filter_by(simulation_id=simulation_id)
+        if compartments:
+            query = query.filter(cls.compartment.in_(compartments))
+        rows = query.order_by(cls.id).all()
+        if not rows:
+            return None
+        return {row.compartment: row.values for row in rows}
+
+    @classmethod
+    def load_many(cls, simulation_ids, compartments=None):
+        # {simulation_id: {compartment: values}} in a single query; runs
+        # without stored trajectories are left out.
+        query = cls.query.options(undefer(cls.data)).filter(
+            cls.simulation_id.in_(simulation_ids)
+        )
+        if compartments:
+            query = query.filter(cls.compartment.in_(compartments))
+        loaded = {}
+        for row in query.order_by(cls.id):
+            loaded.setdefault(row.simulation_id, {})[row.compartment] = row.values
+        return loaded
+
+
+class SimulationAggregate(db.Model):
+    # Per-user, per-model running sums behind the history dashboards (see
+    # analytics.py). A row is one bin of one metric: its count and the sum
+    # and sum of squares of the value it tracks. Rows are updated in the
+    # same transaction that inserts or deletes a simulation, so reads never
+    # touch the simulation table.
+    user_id = db.Column(
+        db.String(36), db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+    model = db.Column(db.String(20), primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)
+    bin = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    total_sq = db.Column(db.Float, nullable=False, default=0.0)
+
+
 class User(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=generate_guid)
-    email = db.Column(db.String, nullable=False)
+    email = db.Column(db.String, nullable=False, index=True)
     password = db.Column(db.Text)
 
     def __repr__(self):
@@ -87,8 +209,9 @@ class User(db.Model):
 
 class TokenBlocklist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    jti = db.Column(db.String, nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, index=True)
 
     def __repr__(self):
         return f"<Token {self.jti}>"
@@ -96,3 +219,13 @@ class TokenBlocklist(db.Model):
     def save(self):
         db.session.add(self)
         db.session.commit()
+
+    @classmethod
+    def purge_expired(cls, now=None):
+        # Tokens past their own expiry are rejected by the JWT check anyway,
+        # so their blocklist rows are no longer needed.
+        deleted = cls.query.filter(
+            cls.expires_at < (now or datetime.utcnow())
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
@@ -0,0 +1,248 @@
+import io
+import math
+import zipfile
+from datetime import datetime
+import numpy as np
+from downsampling import downsample
+from model_registry import get_model
+from simulation_utils import run_simulation
+
+try:
+    from reportlab.graphics.charts.legends import Legend
+    from reportlab.graphics.charts.lineplots import LinePlot
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+except ImportError:
+    A4 = None
+
+# Part of every cache key: bump it whenever the layout changes so stale
+# PDFs are not served.
+TEMPLATE_VERSION = 1
+# Points per compartment in the chart; enough for a page-wide line and
+# cheap to draw however long the run is.
+CHART_POINTS = 400
+TABLE_ROWS = 60
+LINE_COLORS = ("#3182ce", "#e53e3e", "#38a169", "#d69e2e", "#805ad5", "#dd6b20")
+STATISTICS = (
+    ("r0", "R0"),
+    ("hit", "Herd immunity threshold"),
+    ("peak_day", "Peak day"),
+    ("max_infected", "Max infected"),
+    ("final_susceptible", "Final susceptible"),
+    ("final_recovered", "Final recovered"),
+)
+
+
+def report_key(simulation_id):
+    return f"report:{TEMPLATE_VERSION}:{simulation_id}"
+
+
+def report_payload(simulation):
+    # Everything the renderer needs, as plain JSON for the job store. The
+    # worker solves the run again (saved runs are deterministic) rather than
+    # shipping the trajectory through the store.
+    if A4 is None:
+        raise ValueError("PDF reports require reportlab")
+    return {"simulation": simulation.to_dict(), "params": simulation.run_params()}
+
+
+def render_report(payload):
+    # Runs in a job process; returns the PDF bytes.
+    trajectory = run_simulation(**payload["params"], with_stats=False)
+    time = np.asarray(trajectory["time"], dtype=float)
+    columns = {
+        name: np.asarray(values, dtype=float)
+        for name, values in trajectory.items()
+        if name in get_model(payload["simulation"]["model"]).compartments
+    }
+    return build_pdf(payload["simulation"], time, columns)
+
+
+def render_reports(payloads, progress=None):
+    # {simulation id: PDF}; one after the other, as the job already has a
+    # process of its own.
+    reports = {}
+    for index, payload in enumerate(payloads):
+        reports[payload["simulation"]["id"]] = render_report(payload)
+        if progress is not None:
+            progress((index + 1) / len(payloads))
+    return reports
+
+
+def report_archive(reports):
+    # One ZIP from [(model, simulation id, PDF)].
+    buffer = io.BytesIO()
+    # PDFs are compressed already.
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for model, simulation_id, pdf in reports:
+            archive.writestr(report_filename(model, simulation_id), pdf)
+    return buffer.getvalue()
+
+
+def report_filename(model, simulation_id=None):
+    suffix = f"-{simulation_id}" if simulation_id else ""
+    return f"{model.upper()}-simulation-report{suffix}.pdf"
+
+
+def format_number(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.4g}" if abs(value) < 1000 else f"{value:,.2f}"
+    return f"{value:,.0f}"
+
+
+def key_value_table(rows):
+    table = Table([[label, format_number(value)] for label, value in rows], colWidths=[7 * cm, 6 * cm])
+    table.setStyle(
+        TableStyle(
+            [
+                ("FONTSIZE", (0, 0), (-1, -1), 9),
+                ("TEXTCOLOR", (0, 0), (0, -1), colors.HexColor("#4a5568")),
+                ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#e2e8f0")),
+            ]
+        )
+    )
+    return table
+
+
+def chart(time, columns, days):
+    # Vector line chart over LTTB-decimated series, so its size does not
+    # depend on the length of the trajectory.
+    if len(time) > CHART_POINTS:
+        decimated = downsample({"time": time, **columns}, CHART_POINTS)
+        time = decimated.pop("time")
+        columns = decimated
+    drawing = Drawing(17 * cm, 8 * cm)
+    plot = LinePlot()
+    plot.x, plot.y = 1.5 * cm, 1 * cm
+    plot.width, plot.height = 12 * cm, 6.5 * cm
+    plot.data = [list(zip(time.tolist(), values.tolist())) for values in columns.values()]
+    for index in range(len(columns)):
+        plot.lines[index].strokeColor = colors.HexColor(LINE_COLORS[index % len(LINE_COLORS)])
+        plot.lines[index].strokeWidth = 1.2
+    plot.xValueAxis.valueMin = 0
+    plot.xValueAxis.valueMax = days
+    plot.yValueAxis.valueMin = 0
+    plot.yValueAxis.labelTextFormat = lambda value: f"{value:,.0f}"
+    for axis in (plot.xValueAxis, plot.yValueAxis):
+        axis.labels.fontName = "Helvetica"
+        axis.labels.fontSize = 7
+    drawing.add(plot)
+
+    legend = Legend()
+    legend.x, legend.y = 14.2 * cm, 7 * cm
+    legend.fontName = "Helvetica"
+    legend.fontSize = 8
+    legend.columnMaximum = len(columns)
+    legend.colorNamePairs = [
+        (colors.HexColor(LINE_COLORS[index % len(LINE_COLORS)]), name)
+        for index, name in enumerate(columns)
+    ]
+    drawing.add(legend)
+    return drawing
+
+
+def data_table(time, columns, days):
+    # Values at evenly spaced days (every 5th, or coarser for long runs),
+    # interpolated from the full-resolution trajectory.
+    step = max(5, math.ceil(days / TABLE_ROWS))
+    sampled = np.arange(0, days + 1, step)
+    rows = [["Day", *columns]]
+    values = [np.interp(sampled, time, series) for series in columns.values()]
+    for index, day in enumerate(sampled):
+        rows.append([str(day), *[f"{v[index]:,.0f}" for v in values]])
+    table = Table(rows, repeatRows=1)
+    table.setStyle(
+        TableStyle(
+            [
+                ("FONTSIZE", (0, 0), (-1, -1), 8),
+                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#edf2f7")),
+                ("ALIGN", (0, 0), (-1, -1), "RIGHT"),
+                ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#e2e8f0")),
+            ]
+        )
+    )
+    return table
+
+
+def summary_lines(simulation):
+    n = simulation["N"] or 1
+    r0 = simulation["r0"]
+    timing = "late" if simulation["peak_day"] > simulation["days"] / 2 else "early"
+    return [
+        f"Infections peak {timing} in the run, on day {simulation['peak_day']}.",
+        f"At most {simulation['max_infected']:,.2f} people are infected at once "
+        f"({simulation['max_infected'] / n * 100:.2f}% of the population).",
+        f"By the end of the period {simulation['final_recovered']:,.2f} people have recovered "
+        f"({simulation['final_recovered'] / n * 100:.2f}% of the population).",
+        f"The basic reproduction number R0 = {r0:.2f}, which "
+        + ("indicates epidemic spread." if r0 > 1 else "is not enough for an epidemic."),
+        f"Herd immunity threshold HIT = {simulation['hit']:.2f}.",
+    ]
+
+
+def build_pdf(simulation, time, columns):
+    styles = getSampleStyleSheet()
+    spec = get_model(simulation["model"])
+    rates = spec.rates({**simulation, **(simulation.get("extra_params") or {})})
+    created = simulation.get("created_at")
+    created = datetime.fromisoformat(created).strftime("%Y-%m-%d %H:%M") if created else "-"
+
+    story = [
+        Paragraph(f"{spec.name.upper()} simulation", styles["Title"]),
+        Paragraph(f"Created: {created}", styles["Normal"]),
+        Spacer(1, 0.4 * cm),
+        Paragraph("Model parameters", styles["Heading2"]),
+        key_value_table(
+            [
+                *zip(spec.parameters, rates),
+                ("days", simulation["days"]),
+                ("N", simulation["N"]),
+                ("initialS", simulation["initialS"]),
+                ("initialI", simulation["initialI"]),
+            ]
+        ),
+        Paragraph("Simulation chart", styles["Heading2"]),
+        chart(time, columns, simulation["days"]),
+        Paragraph("Statistics", styles["Heading2"]),
+        key_value_table([(label, simulation.get(name)) for name, label in STATISTICS]),
+    ]
+    structure = simulation.get("structure")
+    if structure:
+        story += [
+            Paragraph("Population structure", styles["Heading2"]),
+            Paragraph(
+                f"{len(structure['regions'])} region(s) x {len(structure['ageGroups'])} age group(s).",
+                styles["Normal"],
+            ),
+        ]
+    if simulation.get("events"):
+        story += [
+            Paragraph("Interventions fired", styles["Heading2"]),
+            key_value_table([(e["name"], e["time"]) for e in simulation["events"]]),
+        ]
+    story += [
+        Paragraph("Simulation data (selected days)", styles["Heading2"]),
+        data_table(time, columns, simulation["days"]),
+        Paragraph("Summary", styles["Heading2"]),
+        *[Paragraph(f"&bull; {line}", styles["Normal"]) for line in summary_lines(simulation)],
+    ]
+
+    def footer(canvas, document):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 8)
+        canvas.drawCentredString(A4[0] / 2, 1 * cm, f"© {datetime.utcnow().year} - Epidemica")
+        canvas.restoreState()
+
+    buffer = io.BytesIO()
+    document = SimpleDocTemplate(
+        buffer, pagesize=A4, title=f"{spec.name.upper()} simulation report"
+    )
+    document.build(story, onFirstPage=footer, onLaterPages=footer)
+    return buffer.getvalue()
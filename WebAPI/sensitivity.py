@@ -0,0 +1,236 @@
+import math
+from concurrent.futures import as_completed
+import numpy as np
+from scipy import stats
+from scipy.stats import qmc
+from simulation_utils import MODEL_PARAMS, batch_stats, params_config, simulate_batch
+from solvers import SOLVERS
+
+METHODS = ("sobol", "morris")
+OUTPUTS = ("max_infected", "peak_day", "final_susceptible", "final_recovered")
+CHUNK_SIZE = 256
+# Rows x days of one stacked solve: long horizons get smaller chunks, so a
+# chunk's trajectories stay the size of 256 one-year runs.
+CHUNK_POINTS = CHUNK_SIZE * 365
+DEFAULT_SPREAD = 0.5
+DEFAULT_LEVELS = 4
+BOOTSTRAP_RESAMPLES = 200
+CONFIDENCE = 0.95
+
+
+def parameter_bounds(params, ranges=None):
+    # [low, high] per varied parameter; anything not given explicitly varies
+    # by DEFAULT_SPREAD around its base value.
+    names = MODEL_PARAMS[params["model"]]
+    if ranges:
+        unknown = [name for name in ranges if name not in names]
+        if unknown:
+            raise ValueError(
+                f"Parameters to vary must be among {', '.join(names)}"
+            )
+        names = [name for name in names if name in ranges]
+    bounds = []
+    for name in names:
+        if ranges and name in ranges:
+            low, high = ranges[name]
+        else:
+            low = params[name] * (1 - DEFAULT_SPREAD)
+            high = params[name] * (1 + DEFAULT_SPREAD)
+        if not 0 <= low < high:
+            raise ValueError(f"{name}: bounds must be non-negative with low below high")
+        bounds.append((float(low), float(high)))
+    return list(names), np.array(bounds)
+
+
+def saltelli_design(dims, base_samples, seed=None):
+    # Rows are laid out as A, B, then AB_1..AB_d (A with column i taken from
+    # B): N * (d + 2) points in the unit cube. A and B are the two halves of
+    # one scrambled Sobol' sequence in 2d dimensions.
+    sampler = qmc.Sobol(2 * dims, scramble=True, seed=seed)
+    m = math.ceil(math.log2(max(base_samples, 2)))
+    points = sampler.random_base2(m)[:base_samples]
+    a, b = points[:, :dims], points[:, dims:]
+    blocks = [a, b]
+    for i in range(dims):
+        ab = a.copy()
+        ab[:, i] = b[:, i]
+        blocks.append(ab)
+    return np.concatenate(blocks)
+
+
+def sobol_indices(values, dims, rng, resamples=BOOTSTRAP_RESAMPLES):
+    # First order from Saltelli (2010), total order from Jansen (1999), with
+    # bootstrap confidence half-widths. Outputs are centred first: the
+    # first-order estimator's variance grows with the output mean otherwise.
+    values = values - values.mean()
+    n = len(values) // (dims + 2)
+    fa, fb = values[:n], values[n : 2 * n]
+    fab = values[2 * n :].reshape(dims, n)
+
+    def estimate(rows):
+        a, b, ab = fa[rows], fb[rows], fab[:, rows]
+        variance = np.var(np.concatenate([a, b]))
+        if variance == 0:
+            zeros = np.zeros(dims)
+            return zeros, zeros
+        first = np.mean(b * (ab - a), axis=1) / variance
+        total = 0.5 * np.mean((a - ab) ** 2, axis=1) / variance
+        return first, total
+
+    first, total = estimate(np.arange(n))
+    samples = [estimate(rng.integers(0, n, n)) for _ in range(resamples)]
+    z = stats.norm.ppf(0.5 + CONFIDENCE / 2)
+    return {
+        "S1": first,
+        "S1_conf": z * np.std([s[0] for s in samples], axis=0),
+        "ST": total,
+        "ST_conf": z * np.std([s[1] for s in samples], axis=0),
+    }
+
+
+def morris_design(dims, trajectories, levels=DEFAULT_LEVELS, seed=None):
+    # One-at-a-time trajectories of d + 1 points on a `levels` grid: each
+    # step moves one (randomly ordered) coordinate by +-delta.
+    rng = np.random.default_rng(seed)
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels // 2) / (levels - 1)
+    points = []
+    for _ in range(trajectories):
+        x = rng.choice(grid, dims)
+        directions = rng.choice([-1.0, 1.0], dims)
+        # Start on the side that keeps every step inside the cube.
+        x = np.where(directions < 0, x + delta, x)
+        trajectory = [x.copy()]
+        for i in rng.permutation(dims):
+            x[i] += directions[i] * delta
+            trajectory.append(x.copy())
+        points.extend(trajectory)
+    return np.clip(np.array(points), 0, 1)
+
+
+def morris_indices(design, values, dims, scale):
+    steps = np.diff(design.reshape(-1, dims + 1, dims), axis=1)
+    changes = np.diff(values.reshape(-1, dims + 1), axis=1)
+    moved = np.argmax(np.abs(steps), axis=2)
+    step = np.take_along_axis(steps, moved[..., None], axis=2)[..., 0]
+    effects = np.zeros((len(steps), dims))
+    rows = np.arange(len(steps))[:, None]
+    # Elementary effects in parameter units, so mu* is comparable to a
+    # derivative of the output.
+    effects[rows, moved] = changes / (step * scale[moved])
+    return {
+        "mu": effects.mean(axis=0),
+        "mu_star": np.abs(effects).mean(axis=0),
+        "sigma": effects.std(axis=0, ddof=1) if len(effects) > 1 else np.zeros(dims),
+    }
+
+
+def evaluate_chunk(params, names, samples, outputs, solver="odeint"):
+    # One stacked solve for the whole chunk; only the requested scalar
+    # statistics leave the worker, never the trajectories.
+    config = params_config(params)
+    spec = config["spec"]
+    base = dict(zip(spec.parameters, config["args"][:-1]))
+    varied = dict(zip(names, samples.T))
+    k = len(samples)
+    args = tuple(
+        varied.get(name, np.full(k, base[name])) for name in spec.parameters
+    ) + (np.full(k, float(params["n"])),)
+
+    t = np.linspace(0, params["days"], params["days"])
+    y0 = np.repeat(np.asarray(config["y0"], dtype=float)[None, :], k, axis=0)
+    compartments = simulate_batch(
+        config["func"], y0, t, args, config["compartments"], solver
+    )
+    results = batch_stats(spec, t, args, compartments)
+    return np.column_stack([np.asarray(results[name], dtype=float) for name in outputs])
+
+
+def evaluate_design(params, names, samples, outputs, solver, executor=None, progress=None):
+    size = max(1, min(CHUNK_SIZE, CHUNK_POINTS // max(params["days"], 1)))
+    chunks = [
+        (start, samples[start : start + size]) for start in range(0, len(samples), size)
+    ]
+    values = np.empty((len(samples), len(outputs)))
+    if executor is None:
+        for done, (start, chunk) in enumerate(chunks, 1):
+            values[start : start + len(chunk)] = evaluate_chunk(
+                params, names, chunk, outputs, solver
+            )
+            if progress is not None:
+                progress(done / len(chunks))
+    else:
+        futures = {
+            executor.submit(evaluate_chunk, params, names, chunk, outputs, solver): start
+            for start, chunk in chunks
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            start = futures[future]
+            values[start : start + len(result)] = result
+            if progress is not None:
+                progress(done / len(chunks))
+    return values
+
+
+def design_size(method, dims, samples):
+    return samples * (dims + 2) if method == "sobol" else samples * (dims + 1)
+
+
+def run_sensitivity(
+    params,
+    method="sobol",
+    ranges=None,
+    samples=1024,
+    outputs=OUTPUTS,
+    levels=DEFAULT_LEVELS,
+    seed=None,
+    solver="odeint",
+    executor=None,
+    progress=None,
+):
+    if method not in METHODS:
+        raise ValueError(f"Unknown sensitivity method: {method}")
+    unknown = [name for name in outputs if name not in OUTPUTS]
+    if unknown or not outputs:
+        raise ValueError(f"outputs must be among {', '.join(OUTPUTS)}")
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver: {solver}")
+    if samples < 2:
+        raise ValueError("samples must be at least 2")
+    if method == "morris" and (levels < 2 or levels % 2):
+        raise ValueError("levels must be an even number of at least 2")
+
+    names, bounds = parameter_bounds(params, ranges)
+    dims = len(names)
+    if method == "sobol":
+        unit = saltelli_design(dims, samples, seed)
+    else:
+        unit = morris_design(dims, samples, levels, seed)
+    scale = bounds[:, 1] - bounds[:, 0]
+    design = bounds[:, 0] + unit * scale
+
+    values = evaluate_design(params, names, design, outputs, solver, executor, progress)
+
+    rng = np.random.default_rng(seed)
+    indices = {}
+    for column, output in enumerate(outputs):
+        if method == "sobol":
+            result = sobol_indices(values[:, column], dims, rng)
+        else:
+            result = morris_indices(unit, values[:, column], dims, scale)
+        indices[output] = {
+            name: {key: float(value[i]) for key, value in result.items()}
+            for i, name in enumerate(names)
+        }
+
+    return {
+        "method": method,
+        "parameters": names,
+        "bounds": {name: bounds[i].tolist() for i, name in enumerate(names)},
+        "samples": samples,
+        "evaluations": len(design),
+        "outputs": list(outputs),
+        "indices": indices,
+    }
+
@@ -0,0 +1,159 @@
+import json
+import struct
+import numpy as np
+from flask import Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from instrumentation import phase
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON = "application/json"
+OCTET_STREAM = "application/octet-stream"
+FLOAT32 = "application/vnd.epidemica.float32"
+ARROW = "application/vnd.apache.arrow.stream"
+NDJSON = "application/x-ndjson"
+EVENT_STREAM = "text/event-stream"
+
+BINARY_DTYPES = {OCTET_STREAM: "<f8", FLOAT32: "<f4"}
+
+
+def _default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    # orjson (a requirement) serializes NumPy buffers natively, without a
+    # Python float per element; the stdlib fallback, for installs without
+    # it, goes through tolist().
+    if orjson is not None:
+        return orjson.dumps(
+            obj,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS,
+        )
+    return json.dumps(obj, default=_default, sort_keys=True).encode()
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return dumps(obj).decode()
+        kwargs.setdefault("default", _default)
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(
+            dumps(response_obj(args, kwargs)) + b"\n", mimetype=self.mimetype
+        )
+
+
+def response_obj(args, kwargs):
+    # jsonify()'s arguments: nothing, one value, several values (a list) or
+    # keyword arguments (a dict).
+    if args and kwargs:
+        raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+    if len(args) == 1:
+        return args[0]
+    return list(args) or kwargs or None
+
+
+def split_columns(result):
+    columns = {k: v for k, v in result.items() if isinstance(v, np.ndarray)}
+    scalars = {k: v for k, v in result.items() if k not in columns}
+    return columns, scalars
+
+
+def encode_binary(result, dtype="<f8"):
+    # [uint32 header length][JSON header][zero padding to 8 bytes][columns]
+    # Every column starts on an 8-byte boundary so a browser can wrap it in a
+    # Float64Array/Float32Array view without copying. Returns the pieces as
+    # byte buffers for a response body: columns already in `dtype` are
+    # passed as views of the arrays, not copied.
+    columns, scalars = split_columns(result)
+    names = list(columns)
+    length = len(columns[names[0]]) if names else 0
+    header = dumps(
+        {"dtype": dtype, "length": length, "columns": names, **scalars}
+    )
+    padding = -(4 + len(header)) % 8
+    return [
+        struct.pack("<I", len(header)),
+        header,
+        b"\0" * padding,
+        *(
+            memoryview(np.ascontiguousarray(columns[name], dtype=dtype)).cast("B")
+            for name in names
+        ),
+    ]
+
+
+def encode_arrow(result):
+    columns, scalars = split_columns(result)
+    table = pa.table(columns).replace_schema_metadata(
+        {"simulation": dumps(scalars)}
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def offered_mimetypes():
+    offered = [JSON, OCTET_STREAM, FLOAT32]
+    if pa is not None:
+        offered.append(ARROW)
+    return offered
+
+
+def wants_binary():
+    return request.accept_mimetypes.best_match(offered_mimetypes(), JSON) != JSON
+
+
+def simulation_response(result):
+    mimetype = request.accept_mimetypes.best_match(offered_mimetypes(), JSON)
+    with phase("serialize"):
+        if mimetype in BINARY_DTYPES:
+            return Response(
+                encode_binary(result, BINARY_DTYPES[mimetype]), mimetype=mimetype
+            )
+        if mimetype == ARROW:
+            return Response(encode_arrow(result), mimetype=ARROW)
+        return jsonify(result)
+
+
+def stream_response(chunks):
+    # Chunked NDJSON by default, Server-Sent Events when the client asks for
+    # text/event-stream. Every chunk is encoded and flushed on its own.
+    sse = request.accept_mimetypes.best_match([NDJSON, EVENT_STREAM], NDJSON) == EVENT_STREAM
+
+    def encode(event, payload):
+        if sse:
+            return b"event: " + event.encode() + b"\ndata: " + dumps(payload) + b"\n\n"
+        return dumps(payload) + b"\n"
+
+    def generate():
+        try:
+            for chunk in chunks:
+                yield encode("window", chunk)
+        except Exception as e:
+            yield encode("error", {"error": str(e)})
+            return
+        yield encode("end", {"done": True})
+
+    return Response(
+        generate(),
+        mimetype=EVENT_STREAM if sse else NDJSON,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
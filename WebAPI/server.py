@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+
+# BLAS/OpenMP runtimes read these once, when numpy/scipy (and numba) are
+# first imported, so they are set before anything else is. A solve then
+# stays on one core per worker process instead of every worker starting a
+# thread per core.
+SOLVER_THREADS = os.environ.get("SOLVER_THREADS", "1")
+THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+for name in THREAD_VARIABLES:
+    os.environ.setdefault(name, SOLVER_THREADS)
+
+WORKERS = int(os.environ.get("WEB_WORKERS", 0)) or os.cpu_count() or 1
+# The compute and job pools are per worker process; split the cores between
+# them unless they are sized explicitly.
+os.environ.setdefault("COMPUTE_WORKERS", str(max(1, (os.cpu_count() or 1) // WORKERS)))
+os.environ.setdefault("JOB_WORKERS", os.environ["COMPUTE_WORKERS"])
+
+import numpy as np
+from sqlalchemy import text
+from app import create_app
+from interventions import parse_interventions
+from jobs import job_queue
+from metapopulation import parse_structure
+from models import db
+from simulation_cache import simulation_cache
+from simulation_utils import MODEL_PARAMS, run_simulation, run_simulation_batch
+from solvers import SOLVERS
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+WARM_UP = {"days": 30, "n": 1000, "initialS": 990, "initialI": 10}
+
+
+def check_result(label, result):
+    arrays = [v for v in result.values() if isinstance(v, np.ndarray)]
+    if not arrays or not all(np.all(np.isfinite(a)) for a in arrays):
+        raise RuntimeError(f"Self-check failed: {label} produced non-finite values")
+
+
+def warm_up():
+    # Runs every model through every solver, the batched kernels (which
+    # numba compiles on first use), a structured run and one with
+    # interventions, so the first requests do not pay for imports, JIT
+    # compilation or solver setup, and a broken build fails here instead of
+    # on live traffic.
+    for model in MODEL_PARAMS:
+        for solver in SOLVERS:
+            check_result(f"{model}/{solver}", run_simulation(model, **WARM_UP, solver=solver))
+        for group in run_simulation_batch([{"model": model, **WARM_UP}] * 2, solver="rk4")["results"]:
+            check_result(f"{model}/batch", group)
+    structure = parse_structure({"population": [[500], [500]]}, WARM_UP["initialI"])
+    check_result("structure", run_simulation("sir", **WARM_UP, structure=structure))
+    interventions = parse_interventions(
+        {"schedules": [{"parameter": "beta", "times": [10], "values": [0.2]}]}, "sir"
+    )
+    check_result("interventions", run_simulation("sir", **WARM_UP, interventions=interventions))
+
+
+def self_check(app):
+    started = time.perf_counter()
+    warm_up()
+    with app.app_context():
+        db.session.execute(text("SELECT 1"))
+        db.session.remove()
+        # No connection may be shared with the forked workers.
+        db.engine.dispose()
+    print(f"Self-check passed in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def server_options(app):
+    return {
+        "bind": os.environ.get("WEB_BIND", "0.0.0.0:5000"),
+        "workers": WORKERS,
+        "threads": int(os.environ.get("WEB_THREADS", 1)),
+        "timeout": int(os.environ.get("WEB_TIMEOUT", 120)),
+        "graceful_timeout": int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30)),
+        "keepalive": int(os.environ.get("WEB_KEEPALIVE", 5)),
+        # Workers are recycled after this many requests (0 disables it), with
+        # jitter so they do not all restart at once.
+        "max_requests": int(os.environ.get("WEB_MAX_REQUESTS", 1000)),
+        "max_requests_jitter": int(os.environ.get("WEB_MAX_REQUESTS_JITTER", 100)),
+        # Workers are forked from this process after the imports and the
+        # warm-up, and share those pages copy-on-write.
+        "preload_app": True,
+        "post_fork": lambda server, worker: after_fork(app),
+        # A worker's job pool ends with it: queued jobs are dropped on a
+        # clean exit, and the master fails whatever the worker left active,
+        # however it exited.
+        "worker_exit": lambda server, worker: job_queue.shutdown(),
+        "child_exit": lambda server, worker: job_queue.fail_owner(worker.pid),
+    }
+
+
+def after_fork(app):
+    # The on-disk cache's SQLite handle must not cross a fork.
+    simulation_cache.init_app(app)
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+if BaseApplication is not None:
+
+    class ProductionServer(BaseApplication):
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def main():
+    # Checked before the warm-up; the Werkzeug server is no substitute.
+    if BaseApplication is None:
+        sys.exit("server.py needs gunicorn (pip install gunicorn); use app.py for development")
+    app = create_app()
+    self_check(app)
+    ProductionServer(app, server_options(app)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,244 @@
-from flask import Blueprint, request, jsonify, abort
+import base64
+import io
+from datetime import datetime
+from flask import Blueprint, Response, current_app, request, jsonify, abort, stream_with_context, url_for
 from flask_jwt_extended import jwt_required, current_user
-from models import Simulation, db
-from simulation_utils import run_simulation
+from models import Simulation, SimulationTrajectory, db
+from itertools import product
+from sqlalchemy import func, tuple_
+from math import prod
+import numpy as np
+from simulation_cache import cached_run_simulation, simulation_cache
+from downsampling import check_max_points
+from model_registry import PARAMETERS, get_model
+from metapopulation import parse_structure
+from interventions import parse_interventions
+from comparison import compare_trajectories
+from analytics import record_simulation, user_analytics
+from reports import report_archive, report_filename, report_key, report_payload
+from simulation_utils import (
+    MODEL_PARAMS,
+    STREAM_WINDOW,
+    run_simulation_batch,
+    stream_simulation,
+)
+from agent_simulation import (
+    AGENT_SPEED,
+    SPREAD_RADIUS,
+    STEPS_PER_DAY,
+    run_agent_simulation,
+)
+from stochastic import DEFAULT_QUANTILES, TAU_STEPS_PER_DAY, run_ensemble
+from compute_pool import compute_pool
+from fitting import DEFAULT_STARTS, fit_parameters
+from sensitivity import DEFAULT_LEVELS, OUTPUTS, design_size, run_sensitivity
+from jobs import QueueFull, UserLimitReached, job_queue
+from instrumentation import phase, solver_stats
+from solvers import SOLVERS
+from history_io import export_history, import_history, parse_csv, parse_ndjson, parse_parquet
+from serialization import simulation_response, stream_response, wants_binary
 
 simulation_bp = Blueprint("simulation", __name__)
 
+MAX_BATCH_SIZE = 1000
+MAX_OUTPUT_POINTS = 100000
+MAX_AGENTS = 1000000
+# Agent runs cost about n x days x stepsPerDay agent updates; above the
+# second limit they are always queued as jobs instead of run in the request.
+MAX_AGENT_STEPS = 2 * 10**9
+MAX_SYNC_AGENT_STEPS = 5 * 10**6
+MAX_REPLICATES = 10000
+MAX_ENSEMBLE_DAYS = 1000
+MAX_STEPS_PER_DAY = 100
+# Ensembles larger than this run as jobs: tau-leaping costs about
+# replicates x days x stepsPerDay block updates, Gillespie about
+# replicates x n reactions (roughly 2 seconds each here).
+MAX_SYNC_TAU_STEPS = 2 * 10**6
+MAX_SYNC_GILLESPIE_EVENTS = 5 * 10**5
+MAX_GILLESPIE_POPULATION = 100000
+MAX_FIT_STARTS = 64
+MAX_FIT_POINTS = 10000
+MAX_SENSITIVITY_EVALUATIONS = 200000
+MAX_SENSITIVITY_DAYS = 3650
+# Designs cost about evaluations x days; the first limit is a hard cap, and
+# above the second (about 1.5 seconds here) they run as jobs.
+MAX_SENSITIVITY_WORK = 2 * 10**8
+MAX_SYNC_SENSITIVITY_WORK = 4 * 10**6
+MAX_GROUPS = 10000
+MAX_COMPARE_IDS = 500
+MAX_COMPARE_POINTS = 10000
+MAX_COMPARE_VALUES = 5000000
+MAX_REPORT_BATCH = 100
+MAX_PAGE_SIZE = 100
+IMPORT_BUFFER = 64 * 1024
+MAX_PARQUET_IMPORT_BYTES = 256 * 1024 * 1024
+
+
+def wants_async():
+    # ?async=1 / true / yes; ?async=0 or false runs synchronously.
+    return request.args.get("async", "").lower() in ("1", "true", "yes")
+
+
+def output_params(data):
+    # Output resolution: explicit times (tEval), a fixed step in days
+    # (resolution) or a point budget filled by decimation (maxPoints).
+    params = {}
+    if data.get("tEval") is not None:
+        if len(data["tEval"]) > MAX_OUTPUT_POINTS:
+            raise ValueError(f"tEval is limited to {MAX_OUTPUT_POINTS} points")
+        params["t_eval"] = [float(x) for x in data["tEval"]]
+    elif data.get("resolution") is not None:
+        step = float(data["resolution"])
+        days = int(data.get("days", 100))
+        if step <= 0 or days / step > MAX_OUTPUT_POINTS:
+            raise ValueError(f"resolution must give at most {MAX_OUTPUT_POINTS} points")
+        params["t_eval"] = np.arange(0, days + step / 2, step).tolist()
+    elif data.get("maxPoints") is not None:
+        params["max_points"] = int(data["maxPoints"])
+        params["downsample_method"] = data.get("downsample", "lttb")
+        check_max_points(params["max_points"], params["downsample_method"])
+    return params
+
+
+def simulation_params(data):
+    params = {
+        "model": data.get("model", "sir"),
+        "days": int(data.get("days", 100)),
+        "n": int(data.get("n", 100)),
+        "initialS": int(data.get("initialS", 99)),
+        "initialI": int(data.get("initialI", 1)),
+    }
+    # Every rate any registered model declares, under its request key.
+    for name, parameter in PARAMETERS.items():
+        params[name] = float(data.get(parameter.key, parameter.default))
+    return params
+
+
+def structure_params(data, params):
+    # Optional regions x age groups structure. The totals of its population
+    # stand in for n/initialS/initialI, so saved rows and history stay
+    # comparable with unstructured runs.
+    if data.get("structure") is None:
+        return {}
+    structure = parse_structure(data["structure"], params["initialI"])
+    if len(structure["regions"]) * len(structure["ageGroups"]) > MAX_GROUPS:
+        raise ValueError(f"Structures are limited to {MAX_GROUPS} groups")
+    population = round(float(np.sum(structure["population"])))
+    infected = round(float(np.sum(structure["initialInfected"])))
+    params.update(n=population, initialS=population - infected, initialI=infected)
+    return {"structure": structure}
+
+
+def intervention_params(data, params):
+    # Optional rate schedules and threshold events (see parse_interventions).
+    if data.get("interventions") is None:
+        return {}
+    return {"interventions": parse_interventions(data["interventions"], params["model"])}
+
 
 @simulation_bp.route("", methods=["POST"])
 @jwt_required()
 def post_simulation():
     data = request.get_json()
 
-    model = data.get("model", "sir")
-    beta = float(data.get("beta", 0.3))
-    gamma = float(data.get("gamma", 0.1))
-    sigma = float(data.get("sigma", 0.2))
-    delta = float(data.get("delta", 0.1))
-    v_rate = float(data.get("vRate", 0.05))
-    h_rate = float(data.get("hRate", 0.05))
-    mu = float(data.get("mu", 0.02))
-    days = int(data.get("days", 100))
-    n = int(data.get("n", 100))
-    initialS = int(data.get("initialS", 99))
-    initialI = int(data.get("initialI", 1))
-
-    result = run_simulation(
-        model,
-        beta,
-        gamma,
-        sigma,
-        delta,
-        v_rate,
-        h_rate,
-        mu,
-        days,
-        n,
-        initialS,
-        initialI,
+    params = simulation_params(data)
+    store_trajectory = data.get(
+        "storeTrajectory", current_app.config.get("STORE_TRAJECTORIES")
     )
 
+    try:
+        structure = structure_params(data, params)
+        run_params = {
+            **params,
+            **structure,
+            **intervention_params(data, params),
+            **output_params(data),
+            "solver": data.get("solver", "odeint"),
+        }
+        if wants_async():
+            return submit_simulation_job(run_params, store_trajectory)
+        with phase("solve"):
+            result = cached_run_simulation(
+                **run_params,
+                solver_stats=solver_stats(params["model"], run_params["solver"]),
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    save_simulation(run_params, result, current_user.id, store_trajectory)
+    return simulation_response(result)
+
+
+def save_simulation(params, result, user_id, store_trajectory=False):
+    spec = get_model(params["model"])
+    # Rates the model ignores stay NULL; rates without a column of their own
+    # go to extra_params.
+    rates = dict(zip(spec.parameters, spec.rates(params)))
+    columns = Simulation.__table__.columns
     simulation = Simulation(
-        model=model,
-        N=n,
-        initialS=initialS,
-        initialI=initialI,
-        beta=beta,
-        gamma=gamma,
-        sigma=sigma if model in ["seir", "seihr", "seiqr", "seirv"] else None,
-        delta=delta if model == "seiqr" else None,
-        v_rate=v_rate if model == "seirv" else None,
-        h_rate=h_rate if model == "seihr" else None,
-        mu=mu if (model == "seihr" or model == "seiqr") else None,
-        days=days,
+        model=spec.name,
+        N=params["n"],
+        initialS=params["initialS"],
+        initialI=params["initialI"],
+        **{name: value for name, value in rates.items() if name in columns},
+        extra_params={
+            name: value for name, value in rates.items() if name not in columns
+        }
+        or None,
+        structure=params.get("structure"),
+        interventions=params.get("interventions"),
+        events=result.get("events"),
+        days=params["days"],
         max_infected=float(result["max_infected"]),
         peak_day=int(result["peak_day"]),
         final_susceptible=float(result["final_susceptible"]),
         final_recovered=float(result["final_recovered"]),
-        user_id=current_user.id,
+        r0=float(result["r0"]),
+        user_id=user_id,
     )
+    if store_trajectory:
+        simulation.trajectories = SimulationTrajectory.from_result(result)
 
     db.session.add(simulation)
-    db.session.commit()
-    return jsonify(result)
+    record_simulation(simulation)
+    with phase("commit"):
+        db.session.commit()
+    return simulation
+
+
+def submit_simulation_job(run_params, store_trajectory):
+    if run_params["model"] not in MODEL_PARAMS:
+        raise ValueError(f"Unknown model: {run_params['model']}")
+
+    app = current_app._get_current_object()
+    user_id = current_user.id
+
+    def on_done(job_id, result):
+        with app.app_context():
+            simulation = save_simulation(run_params, result, user_id, store_trajectory)
+            job_queue.set_simulation(job_id, simulation.id)
+
+    return submit_job("simulation", run_params, on_done)
+
+
+# Job kinds whose result is a file; it is downloaded from /jobs/<id>/file
+# rather than embedded in the job's JSON.
+FILE_JOBS = ("report", "reports")
+
+
+def submit_job(kind, params, on_done=None):
+    try:
+        job_id = job_queue.submit(current_user.id, kind, params, on_done)
+    except QueueFull:
+        return (
+            jsonify({"error": "Job queue is full, try again later"}),
+            503,
+            {"Retry-After": "5"},
+        )
+    except UserLimitReached:
+        return jsonify({"error": "Too many running jobs"}), 429
+
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
 
 
 @simulation_bp.route("/view", methods=["POST"])
@@ -69,74 +246,511 @@ def post_simulation():
 def view_simulation():
     data = request.get_json()
 
-    model = data.get("model", "sir")
-    beta = float(data.get("beta", 0.3))
-    gamma = float(data.get("gamma", 0.1))
-    sigma = float(data.get("sigma", 0.2))
-    delta = float(data.get("delta", 0.1))
-    v_rate = float(data.get("vRate", 0.05))
-    h_rate = float(data.get("hRate", 0.05))
-    mu = float(data.get("mu", 0.02))
-    days = int(data.get("days", 100))
-    n = int(data.get("n", 100))
-    initialS = int(data.get("initialS", 99))
-    initialI = int(data.get("initialI", 1))
-
-    result = run_simulation(
-        model,
-        beta,
-        gamma,
-        sigma,
-        delta,
-        v_rate,
-        h_rate,
-        mu,
-        days,
-        n,
-        initialS,
-        initialI,
-        with_stats=False,
-    )
-    return jsonify(result)
+    params = simulation_params(data)
+    solver = data.get("solver", "odeint")
+    try:
+        structure = structure_params(data, params)
+        with phase("solve"):
+            result = cached_run_simulation(
+                **params,
+                **structure,
+                **intervention_params(data, params),
+                **output_params(data),
+                with_stats=False,
+                solver=solver,
+                solver_stats=solver_stats(params["model"], solver),
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return simulation_response(result)
+
+
+@simulation_bp.route("/view/stream", methods=["POST"])
+@jwt_required()
+def stream_view_simulation():
+    data = request.get_json()
 
+    params = simulation_params(data)
+    if params["model"] not in MODEL_PARAMS:
+        return jsonify({"error": f"Unknown model: {params['model']}"}), 400
+    if data.get("structure") is not None or data.get("interventions") is not None:
+        return jsonify({"error": "Structured models and interventions cannot be streamed"}), 400
+    # Checked before the response starts: once it has, errors can only be
+    # reported inside the stream.
+    solver = data.get("solver", "odeint")
+    if solver not in SOLVERS:
+        return jsonify({"error": f"Unknown solver: {solver}"}), 400
+    try:
+        window = int(data.get("window", STREAM_WINDOW))
+    except (TypeError, ValueError):
+        return jsonify({"error": "window must be an integer"}), 400
+    if window < 1:
+        return jsonify({"error": "window must be positive"}), 400
 
-@simulation_bp.route("/history", methods=["GET"])
+    return stream_response(stream_simulation(**params, solver=solver, window=window))
+
+
+@simulation_bp.route("/agents", methods=["POST"])
 @jwt_required()
-def get_history():
-    page = int(request.args.get("page", 1))
-    page_size = int(request.args.get("page_size", 10))
+def agent_simulation():
+    data = request.get_json()
 
-    query = Simulation.query.filter_by(user_id=current_user.id).order_by(
-        Simulation.created_at.desc()
+    params = simulation_params(data)
+    if params["n"] > MAX_AGENTS:
+        return jsonify({"error": f"Agent simulations are limited to {MAX_AGENTS} agents"}), 400
+    if params["model"] not in MODEL_PARAMS:
+        return jsonify({"error": f"Unknown model: {params['model']}"}), 400
+
+    params.update(
+        seed=int(data["seed"]) if data.get("seed") is not None else None,
+        steps_per_day=int(data.get("stepsPerDay", STEPS_PER_DAY)),
+        radius=float(data.get("radius", SPREAD_RADIUS)),
+        speed=float(data.get("speed", AGENT_SPEED)),
     )
-    total = query.count()
-    simulations = query.offset((page - 1) * page_size).limit(page_size).all()
+    steps = params["n"] * params["days"] * params["steps_per_day"]
+    if steps > MAX_AGENT_STEPS:
+        return jsonify(
+            {"error": f"Agent simulations are limited to {MAX_AGENT_STEPS} agent steps (n x days x stepsPerDay)"}
+        ), 400
 
-    return jsonify(
-        {
-            "simulations": [
-                {
-                    "id": s.id,
-                    "model": s.model,
-                    "created_at": s.created_at.isoformat(),
-                    "days": s.days,
-                    "n": s.N,
-                    "final_susceptible": round(s.final_susceptible),
-                    "final_recovered": round(s.final_recovered),
-                    "max_infected": round(s.max_infected),
-                    "peak_day": s.peak_day,
-                    "r0": s.r0,
-                    "hit": s.hit,
-                }
-                for s in simulations
-            ],
-            "total": total,
-            "page": page,
-            "page_size": page_size,
+    if wants_async() or steps > MAX_SYNC_AGENT_STEPS:
+        return submit_job("agents", params)
+
+    try:
+        with phase("solve"):
+            result = run_agent_simulation(**params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return simulation_response(result)
+
+
+@simulation_bp.route("/ensemble", methods=["POST"])
+@jwt_required()
+def ensemble_simulation():
+    data = request.get_json()
+
+    params = simulation_params(data)
+    options = {
+        "replicates": int(data.get("replicates", 100)),
+        "seed": int(data["seed"]) if data.get("seed") is not None else None,
+        "method": data.get("method", "tau"),
+        "steps_per_day": int(data.get("stepsPerDay", TAU_STEPS_PER_DAY)),
+        "quantiles": [float(q) for q in data.get("quantiles", DEFAULT_QUANTILES)],
+    }
+    if options["replicates"] > MAX_REPLICATES:
+        return jsonify({"error": f"Ensembles are limited to {MAX_REPLICATES} replicates"}), 400
+    if params["days"] > MAX_ENSEMBLE_DAYS:
+        return jsonify({"error": f"Ensembles are limited to {MAX_ENSEMBLE_DAYS} days"}), 400
+    if not 1 <= options["steps_per_day"] <= MAX_STEPS_PER_DAY:
+        return jsonify({"error": f"stepsPerDay must be between 1 and {MAX_STEPS_PER_DAY}"}), 400
+    if options["method"] == "gillespie" and params["n"] > MAX_GILLESPIE_POPULATION:
+        return jsonify(
+            {"error": f"Gillespie runs are limited to n <= {MAX_GILLESPIE_POPULATION}, use tau-leaping"}
+        ), 400
+    if params["model"] not in MODEL_PARAMS:
+        return jsonify({"error": f"Unknown model: {params['model']}"}), 400
+
+    if options["method"] == "gillespie":
+        large = options["replicates"] * params["n"] > MAX_SYNC_GILLESPIE_EVENTS
+    else:
+        steps = options["replicates"] * params["days"] * options["steps_per_day"]
+        large = steps > MAX_SYNC_TAU_STEPS
+    if wants_async() or large:
+        return submit_job("ensemble", {"params": params, **options})
+
+    try:
+        with phase("solve"):
+            result = run_ensemble(
+                params,
+                **options,
+                executor=compute_pool.executor(),
+                workers=compute_pool.workers,
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return simulation_response(result)
+
+
+@simulation_bp.route("/fit", methods=["POST"])
+@jwt_required()
+def fit_simulation():
+    data = request.get_json()
+
+    params = simulation_params(data)
+    if params["model"] not in MODEL_PARAMS:
+        return jsonify({"error": f"Unknown model: {params['model']}"}), 400
+    observed = data.get("observed")
+    if not isinstance(observed, list) or not observed:
+        return jsonify({"error": "observed must be a non-empty list"}), 400
+    if len(observed) > MAX_FIT_POINTS:
+        return jsonify({"error": f"observed is limited to {MAX_FIT_POINTS} points"}), 400
+
+    try:
+        options = {
+            "fit": list(data.get("fit", MODEL_PARAMS[params["model"]])),
+            "times": [float(t) for t in data.get("times", range(1, len(observed) + 1))],
+            "observed": [float(v) for v in observed],
+            "target": data.get("target", "I"),
+            "bounds": {
+                name: (float(bound[0]), float(bound[1]))
+                for name, bound in data.get("bounds", {}).items()
+            },
+            "starts": int(data.get("starts", DEFAULT_STARTS)),
+            "seed": int(data["seed"]) if data.get("seed") is not None else None,
         }
+    except (TypeError, ValueError, IndexError):
+        return jsonify({"error": "Invalid fit options"}), 400
+    if not 1 <= options["starts"] <= MAX_FIT_STARTS:
+        return jsonify({"error": f"starts must be between 1 and {MAX_FIT_STARTS}"}), 400
+
+    if wants_async():
+        return submit_job("fit", {"params": params, **options})
+
+    try:
+        with phase("solve"):
+            result = fit_parameters(params, **options, executor=compute_pool.executor())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return simulation_response(result)
+
+
+@simulation_bp.route("/sensitivity", methods=["POST"])
+@jwt_required()
+def sensitivity_simulation():
+    data = request.get_json()
+
+    params = simulation_params(data)
+    if params["model"] not in MODEL_PARAMS:
+        return jsonify({"error": f"Unknown model: {params['model']}"}), 400
+    try:
+        options = {
+            "method": data.get("method", "sobol"),
+            "ranges": {
+                name: (float(bound[0]), float(bound[1]))
+                for name, bound in data.get("parameters", {}).items()
+            },
+            "samples": int(data.get("samples", 1024)),
+            "outputs": list(data.get("outputs", OUTPUTS)),
+            "levels": int(data.get("levels", DEFAULT_LEVELS)),
+            "seed": int(data["seed"]) if data.get("seed") is not None else None,
+            "solver": data.get("solver", "odeint"),
+        }
+    except (TypeError, ValueError, IndexError, AttributeError):
+        return jsonify({"error": "Invalid sensitivity options"}), 400
+
+    dims = len(options["ranges"]) or len(MODEL_PARAMS[params["model"]])
+    evaluations = design_size(options["method"], dims, options["samples"])
+    if evaluations > MAX_SENSITIVITY_EVALUATIONS:
+        return jsonify(
+            {"error": f"Designs are limited to {MAX_SENSITIVITY_EVALUATIONS} model evaluations"}
+        ), 400
+    if params["days"] > MAX_SENSITIVITY_DAYS:
+        return jsonify({"error": f"Sensitivity runs are limited to {MAX_SENSITIVITY_DAYS} days"}), 400
+    work = evaluations * params["days"]
+    if work > MAX_SENSITIVITY_WORK:
+        return jsonify(
+            {"error": f"Designs are limited to {MAX_SENSITIVITY_WORK} evaluation days (evaluations x days)"}
+        ), 400
+
+    if wants_async() or work > MAX_SYNC_SENSITIVITY_WORK:
+        return submit_job("sensitivity", {"params": params, **options})
+
+    try:
+        with phase("solve"):
+            result = run_sensitivity(params, **options, executor=compute_pool.executor())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return simulation_response(result)
+
+
+@simulation_bp.route("/batch", methods=["POST"])
+@jwt_required()
+def batch_simulation():
+    data = request.get_json()
+    base = {
+        k: v
+        for k, v in data.items()
+        if k not in ("grid", "scenarios", "withStats", "solver")
+    }
+
+    if "grid" in data:
+        if not isinstance(data["grid"], dict) or not all(
+            isinstance(values, list) and values for values in data["grid"].values()
+        ):
+            return jsonify({"error": "grid must map parameter names to non-empty lists"}), 400
+        names = list(data["grid"])
+        if prod(len(data["grid"][name]) for name in names) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch is limited to {MAX_BATCH_SIZE} scenarios"}), 400
+        scenarios = [
+            dict(zip(names, values))
+            for values in product(*(data["grid"][name] for name in names))
+        ]
+    else:
+        scenarios = data.get("scenarios", [])
+        if not isinstance(scenarios, list) or not all(isinstance(s, dict) for s in scenarios):
+            return jsonify({"error": "scenarios must be a list of objects"}), 400
+
+    if not scenarios:
+        return jsonify({"error": "No scenarios provided"}), 400
+    if any(
+        s.get("structure") is not None or s.get("interventions") is not None
+        for s in [data, *scenarios]
+    ):
+        return jsonify({"error": "Structured models and interventions cannot be batched"}), 400
+    if len(scenarios) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch is limited to {MAX_BATCH_SIZE} scenarios"}), 400
+
+    solver = data.get("solver", "odeint")
+    try:
+        with phase("solve"):
+            result = run_simulation_batch(
+                [simulation_params({**base, **s}) for s in scenarios],
+                with_stats=bool(data.get("withStats", True)),
+                solver=solver,
+                solver_stats=solver_stats("batch", solver),
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with phase("serialize"):
+        return jsonify(result)
+
+
+@simulation_bp.route("/cache", methods=["GET"])
+@jwt_required()
+def cache_stats():
+    return jsonify(simulation_cache.info())
+
+
+@simulation_bp.route("/jobs/<string:job_id>", methods=["GET"])
+@jwt_required()
+def get_job(job_id):
+    job = job_queue.get(job_id, current_user.id)
+
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+
+    return job_response(job)
+
+
+@simulation_bp.route("/jobs/<string:job_id>/file", methods=["GET"])
+@jwt_required()
+def get_job_file(job_id):
+    job = job_queue.get(job_id, current_user.id)
+
+    if job is None or job["kind"] not in FILE_JOBS:
+        return jsonify({"error": "Not found"}), 404
+    if job["result"] is None:
+        return jsonify({"error": f"Job is {job['status']}"}), 409
+
+    if job["kind"] == "report":
+        simulation = job["params"]["simulation"]
+        response = Response(
+            job["result"],
+            mimetype="application/pdf",
+            headers={
+                "Content-Disposition": f"attachment; filename={report_filename(simulation['model'])}"
+            },
+        )
+        response.set_etag(report_key(simulation["id"]))
+        return response
+
+    simulations = [payload["simulation"] for payload in job["params"]["payloads"]]
+    return Response(
+        report_archive([(s["model"], s["id"], job["result"][s["id"]]) for s in simulations]),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=simulation-reports.zip"},
     )
 
 
+@simulation_bp.route("/jobs/<string:job_id>", methods=["DELETE"])
+@jwt_required()
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id, current_user.id)
+
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+
+    return job_response(job)
+
+
+def job_response(job):
+    if job["kind"] in FILE_JOBS and job["result"] is not None:
+        job["result"] = {"file": url_for("simulation.get_job_file", job_id=job["id"])}
+    return jsonify(job)
+
+
+HISTORY_COLUMNS = (
+    Simulation.id,
+    Simulation.model,
+    Simulation.created_at,
+    Simulation.days,
+    Simulation.N,
+    Simulation.final_susceptible,
+    Simulation.final_recovered,
+    Simulation.max_infected,
+    Simulation.peak_day,
+    Simulation.r0.label("r0"),
+    Simulation.hit.label("hit"),
+)
+
+
+def encode_cursor(row):
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, sim_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), sim_id
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+@simulation_bp.route("/history", methods=["GET"])
+@jwt_required()
+def get_history():
+    # Keyset pagination over (user_id, created_at, id): pass back next_cursor
+    # as ?cursor= for the following page. ?page= still works (with OFFSET)
+    # for page-number UIs. Only the listed columns are selected, r0/hit are
+    # computed in SQL, and the total is counted only in page mode or with
+    # ?count=1.
+    page_size = min(max(request.args.get("page_size", 10, type=int), 1), MAX_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    page = None if cursor else request.args.get("page", type=int)
+    with_count = request.args.get("count", "1" if page else "0") == "1"
+
+    owned = Simulation.user_id == current_user.id
+    total = None
+    if with_count:
+        total = db.session.query(func.count(Simulation.id)).filter(owned).scalar()
+
+    query = db.session.query(*HISTORY_COLUMNS).filter(owned)
+
+    if cursor:
+        try:
+            created_at, sim_id = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        query = query.filter(
+            tuple_(Simulation.created_at, Simulation.id) < (created_at, sim_id)
+        )
+    query = query.order_by(Simulation.created_at.desc(), Simulation.id.desc())
+    if page:
+        query = query.offset((page - 1) * page_size)
+
+    rows = query.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    response = {
+        "simulations": [
+            {
+                "id": s.id,
+                "model": s.model,
+                "created_at": s.created_at.isoformat(),
+                "days": s.days,
+                "n": s.N,
+                "final_susceptible": round(s.final_susceptible),
+                "final_recovered": round(s.final_recovered),
+                "max_infected": round(s.max_infected),
+                "peak_day": s.peak_day,
+                "r0": float(s.r0),
+                "hit": float(s.hit),
+            }
+            for s in rows
+        ],
+        "page_size": page_size,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+    }
+    if page:
+        response["page"] = page
+    if total is not None:
+        response["total"] = total
+    return jsonify(response)
+
+
+@simulation_bp.route("/analytics", methods=["GET"])
+@jwt_required()
+def get_analytics():
+    # Dashboard aggregates over the user's whole history (optionally one
+    # model): runs per model, outcome distributions and binned
+    # parameter-vs-outcome means, read from the incrementally maintained
+    # simulation_aggregate rows.
+    model = request.args.get("model")
+    if model is not None:
+        try:
+            get_model(model)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(user_analytics(current_user.id, model))
+
+
+EXPORT_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+IMPORT_MIMETYPES = (*EXPORT_MIMETYPES.values(), "application/json")
+
+
+@simulation_bp.route("/export", methods=["GET"])
+@jwt_required()
+def export_simulations():
+    fmt = request.args.get("format", "ndjson")
+    try:
+        chunks = export_history(
+            current_user.id, fmt, bool(request.args.get("trajectories"))
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=simulations.{fmt}"},
+    )
+
+
+@simulation_bp.route("/import", methods=["POST"])
+@jwt_required()
+def import_simulations():
+    mimetype = request.mimetype
+    if mimetype not in IMPORT_MIMETYPES:
+        return jsonify(
+            {"error": f"Unsupported import type, use one of: {', '.join(IMPORT_MIMETYPES)}"}
+        ), 415
+    if mimetype == EXPORT_MIMETYPES["parquet"] and (
+        request.content_length or 0
+    ) > MAX_PARQUET_IMPORT_BYTES:
+        return jsonify(
+            {"error": f"Parquet uploads are limited to {MAX_PARQUET_IMPORT_BYTES // 2**20} MB"}
+        ), 413
+    try:
+        if mimetype == EXPORT_MIMETYPES["parquet"]:
+            records = parse_parquet(request.stream, MAX_PARQUET_IMPORT_BYTES)
+        elif mimetype == "application/json":
+            records = enumerate(request.get_json(), 1)
+        else:
+            # LimitedStream reads lines unbuffered; buffer it for speed.
+            lines = io.BufferedReader(request.stream, IMPORT_BUFFER)
+            if mimetype == EXPORT_MIMETYPES["csv"]:
+                records = parse_csv(io.TextIOWrapper(lines, encoding="utf-8", newline=""))
+            else:
+                records = parse_ndjson(lines)
+        imported = import_history(records, current_user.id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"imported": imported}), 201
+
+
 @simulation_bp.route("/<string:sim_id>", methods=["GET"])
 @jwt_required()
 def get_simulation(sim_id):
@@ -145,7 +759,108 @@ def get_simulation(sim_id):
     if not sim:
         return jsonify({"error": "Not found"}), 404
 
-    return jsonify(sim.to_dict())
+    binary = wants_binary()
+    if not binary and not request.args.get("trajectory"):
+        return jsonify(sim.to_dict())
+
+    compartments = request.args.get("compartments")
+    compartments = compartments.split(",") + ["time"] if compartments else None
+    trajectory = SimulationTrajectory.load(sim.id, compartments)
+    if trajectory is None:
+        with phase("solve"):
+            trajectory = cached_run_simulation(
+                **sim.run_params(),
+                with_stats=False,
+                solver_stats=solver_stats(sim.model),
+            )
+        if compartments:
+            trajectory = {k: v for k, v in trajectory.items() if k in compartments}
+
+    if binary:
+        return simulation_response({**trajectory, **sim.to_dict()})
+    return jsonify({**sim.to_dict(), "trajectory": trajectory})
+
+
+@simulation_bp.route("/<string:sim_id>/report", methods=["GET"])
+@jwt_required()
+def get_report(sim_id):
+    # PDF report cached under the simulation id and template version; saved
+    # runs never change, so the same key doubles as the ETag and is checked
+    # before anything is looked up or rendered. Reports not cached yet are
+    # rendered by a job (202 with its id), downloaded from /jobs/<id>/file.
+    sim = Simulation.query.filter_by(id=sim_id, user_id=current_user.id).first()
+
+    if not sim:
+        return jsonify({"error": "Not found"}), 404
+
+    key = report_key(sim.id)
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+        response.set_etag(key)
+        return response
+
+    pdf = simulation_cache.get(key)
+    if pdf is None:
+        try:
+            payload = report_payload(sim)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return submit_job(
+            "report", payload, lambda job_id, pdf: cache_reports(job_id, {sim_id: pdf})
+        )
+
+    response = Response(
+        pdf,
+        mimetype="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename={report_filename(sim.model)}"},
+    )
+    response.set_etag(key)
+    return response
+
+
+@simulation_bp.route("/reports", methods=["POST"])
+@jwt_required()
+def get_reports():
+    # A ZIP with one report per selected simulation. When they are all
+    # cached it is returned right away, otherwise a job renders them.
+    simulation_ids = list(dict.fromkeys((request.json or {}).get("simulation_ids", [])))
+
+    if not simulation_ids:
+        return jsonify({"error": "No simulation IDs provided"}), 400
+    if len(simulation_ids) > MAX_REPORT_BATCH:
+        return jsonify({"error": f"Reports are limited to {MAX_REPORT_BATCH} simulations"}), 400
+
+    found = {
+        s.id: s
+        for s in Simulation.query.filter(
+            Simulation.id.in_(simulation_ids), Simulation.user_id == current_user.id
+        )
+    }
+
+    if not found:
+        return jsonify({"error": "Simulations not found"}), 404
+
+    simulations = [found[i] for i in simulation_ids if i in found]
+    reports = [(s.model, s.id, simulation_cache.get(report_key(s.id))) for s in simulations]
+    if any(pdf is None for _, _, pdf in reports):
+        try:
+            payloads = [report_payload(s) for s in simulations]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return submit_job("reports", {"payloads": payloads}, cache_reports)
+
+    return Response(
+        report_archive(reports),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=simulation-reports.zip"},
+    )
+
+
+def cache_reports(job_id, reports):
+    # Rendered reports also go into the simulation cache, so the next
+    # request for them is answered directly.
+    for simulation_id, pdf in reports.items():
+        simulation_cache.put(report_key(simulation_id), pdf)
 
 
 @simulation_bp.route("/<string:sim_id>", methods=["DELETE"])
@@ -156,6 +871,7 @@ def delete_simulation(sim_id):
     if simulation is None:
         abort(404, description="Simulation not found")
 
+    record_simulation(simulation, -1)
     db.session.delete(simulation)
     db.session.commit()
 
@@ -165,46 +881,95 @@ def delete_simulation(sim_id):
 @simulation_bp.route("/compare", methods=["POST"])
 @jwt_required()
 def compare_simulations():
-    try:
-        simulation_ids = request.json.get("simulation_ids", [])
+    data = request.json or {}
+    simulation_ids = data.get("simulation_ids", [])
 
-        if not simulation_ids:
-            return jsonify({"error": "No simulation IDs provided"}), 400
+    if not simulation_ids:
+        return jsonify({"error": "No simulation IDs provided"}), 400
+    # Request order, without repeats; the first ID is the default reference.
+    simulation_ids = list(dict.fromkeys(simulation_ids))
+    if len(simulation_ids) > MAX_COMPARE_IDS:
+        return jsonify({"error": f"Comparison is limited to {MAX_COMPARE_IDS} simulations"}), 400
 
-        simulations = Simulation.query.filter(
-            Simulation.id.in_(simulation_ids), Simulation.user_id == current_user.id
-        ).all()
+    found = Simulation.query.filter(
+        Simulation.id.in_(simulation_ids), Simulation.user_id == current_user.id
+    ).all()
 
-        if not simulations:
-            return jsonify({"error": "Simulations not found"}), 404
+    if not found:
+        return jsonify({"error": "Simulations not found"}), 404
 
-        response_data = [
-            {
-                "id": s.id,
-                "model": s.model,
-                "created_at": s.created_at.isoformat(),
-                "days": s.days,
-                "n": s.N,
-                "max_infected": round(s.max_infected),
-                "peak_day": s.peak_day,
-                "final_susceptible": round(s.final_susceptible),
-                "final_recovered": round(s.final_recovered),
-                "r0": s.r0,
-                "hit": s.hit,
-                "sigma": s.sigma,
-                "delta": s.delta,
-                "v_rate": s.v_rate,
-                "h_rate": s.h_rate,
-                "mu": s.mu,
-                "initialS": s.initialS,
-                "initialI": s.initialI,
-                "beta": s.beta,
-                "gamma": s.gamma
-            }
-            for s in simulations
-        ]
+    by_id = {s.id: s for s in found}
+    simulations = [by_id[i] for i in simulation_ids if i in by_id]
 
+    response_data = [
+        {
+            "id": s.id,
+            "model": s.model,
+            "created_at": s.created_at.isoformat(),
+            "days": s.days,
+            "n": s.N,
+            "max_infected": round(s.max_infected),
+            "peak_day": s.peak_day,
+            "final_susceptible": round(s.final_susceptible),
+            "final_recovered": round(s.final_recovered),
+            "r0": s.r0,
+            "hit": s.hit,
+            "sigma": s.sigma,
+            "delta": s.delta,
+            "v_rate": s.v_rate,
+            "h_rate": s.h_rate,
+            "mu": s.mu,
+            "initialS": s.initialS,
+            "initialI": s.initialI,
+            "beta": s.beta,
+            "gamma": s.gamma
+        }
+        for s in simulations
+    ]
+
+    if not data.get("trajectories"):
         return jsonify({"simulations": response_data})
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    # Aligned trajectories on one grid (daily up to the longest run unless
+    # `points` says otherwise), plus difference metrics against `reference`.
+    try:
+        compartments = data.get("compartments")
+        if compartments is not None and (
+            not isinstance(compartments, list) or not compartments
+        ):
+            raise ValueError("compartments must be a non-empty list")
+        points = data.get("points")
+        if points is not None:
+            points = int(points)
+            if not 2 <= points <= MAX_COMPARE_POINTS:
+                raise ValueError(f"points must be between 2 and {MAX_COMPARE_POINTS}")
+        else:
+            points = min(max(s.days for s in simulations) + 1, MAX_COMPARE_POINTS)
+        threshold = data.get("threshold")
+        threshold = None if threshold is None else float(threshold)
+        reference = data.get("reference", simulations[0].id)
+        if reference not in by_id:
+            raise ValueError("reference must be one of the compared simulations")
+        series = len(compartments) if compartments else max(
+            len(get_model(s.model).compartments) for s in simulations
+        )
+        if len(simulations) * points * series > MAX_COMPARE_VALUES:
+            raise ValueError(
+                f"Comparison is limited to {MAX_COMPARE_VALUES} values; "
+                "request fewer points or compartments"
+            )
+
+        with phase("solve"):
+            comparison = compare_trajectories(
+                simulations,
+                compartments=compartments,
+                points=points,
+                threshold=threshold,
+                reference=simulations.index(by_id[reference]),
+                solver_stats=solver_stats("compare"),
+            )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    with phase("serialize"):
+        return jsonify({"simulations": response_data, "comparison": comparison})
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from simulation_utils import MODEL_PARAMS, run_simulation
+
+
+def cache_key(params, with_stats=True, solver="odeint"):
+    # Only the parameters the model actually reads take part in the key, so
+    # e.g. an SIR run with a different (ignored) delta still hits the cache.
+    model = params.get("model", "sir")
+    if model not in MODEL_PARAMS:
+        raise ValueError(f"Unknown model: {model}")
+
+    normalized = {
+        "model": model,
+        "days": int(params.get("days", 100)),
+        "n": int(params.get("n", 100)),
+        "initialS": int(params.get("initialS", 99)),
+        "initialI": int(params.get("initialI", 1)),
+        "with_stats": bool(with_stats),
+        "solver": solver,
+        **{name: float(params[name]) for name in MODEL_PARAMS[model] if name in params},
+    }
+    for name in ("structure", "interventions"):
+        if params.get(name) is not None:
+            normalized[name] = params[name]
+    if params.get("t_eval") is not None:
+        normalized["t_eval"] = [float(x) for x in params["t_eval"]]
+    elif params.get("max_points") is not None:
+        normalized["max_points"] = int(params["max_points"])
+        normalized["downsample_method"] = params.get("downsample_method", "lttb")
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class SimulationCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, path=None, max_disk_entries=10000):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.configure(max_bytes, path, max_disk_entries)
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get("SIMULATION_CACHE_MAX_BYTES", self.max_bytes),
+            app.config.get("SIMULATION_CACHE_PATH"),
+            app.config.get("SIMULATION_CACHE_MAX_DISK_ENTRIES", self.max_disk_entries),
+        )
+
+    def configure(self, max_bytes, path=None, max_disk_entries=10000):
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self.max_disk_entries = int(max_disk_entries)
+            self.path = path
+            self._entries.clear()
+            self._bytes = 0
+            self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+            self._disk = None
+            if path:
+                self._disk = sqlite3.connect(path, check_same_thread=False)
+                self._disk.execute(
+                    "CREATE TABLE IF NOT EXISTS simulation_cache "
+                    "(key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._disk.commit()
+
+    def get(self, key):
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return pickle.loads(blob)
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value FROM simulation_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._disk.execute(
+                        "UPDATE simulation_cache SET accessed_at = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    self._disk.commit()
+                    self.counters["disk_hits"] += 1
+                    self._remember(key, row[0])
+                    return pickle.loads(row[0])
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, blob)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO simulation_cache VALUES (?, ?, ?)",
+                    (key, blob, time.time()),
+                )
+                self._disk.execute(
+                    "DELETE FROM simulation_cache WHERE key NOT IN "
+                    "(SELECT key FROM simulation_cache ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_disk_entries,),
+                )
+                self._disk.commit()
+
+    def _remember(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key))
+        self._entries[key] = blob
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.counters["evictions"] += 1
+
+    def info(self):
+        with self._lock:
+            info = {
+                **self.counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "persistent": self._disk is not None,
+            }
+            if self._disk is not None:
+                info["disk_entries"] = self._disk.execute(
+                    "SELECT COUNT(*) FROM simulation_cache"
+                ).fetchone()[0]
+            return info
+
+
+simulation_cache = SimulationCache()
+
+
+def cached_run_simulation(with_stats=True, solver="odeint", solver_stats=None, **params):
+    key = cache_key(params, with_stats, solver)
+    result = simulation_cache.get(key)
+    if result is None:
+        result = run_simulation(
+            **params, with_stats=with_stats, solver=solver, solver_stats=solver_stats
+        )
+        simulation_cache.put(key, result)
+    elif solver_stats is not None:
+        solver_stats["cached"] = True
+    return result
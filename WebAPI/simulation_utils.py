@@ -1,116 +1,475 @@
 import numpy as np
-from sir_models import seihr_model, seiqr_model, seir_model, seirv_model, sir_model
 from scipy.integrate import odeint
+import sir_models  # registers the built-in models
+from model_registry import MODEL_PARAMS, get_model
+from solvers import KERNELS, RK4_SUBSTEPS, integrate, record_stats, rk4_solve
+from downsampling import MIN_POINTS, downsample, take_points
+from metapopulation import StructuredModel
+from interventions import integrate_interventions
 
+PROGRESS_WINDOWS = 20
+MIN_WINDOW = 1000
+STREAM_FIRST_WINDOW = 32
+STREAM_WINDOW = 4096
 
-def simulate_raw(model_func, y0, t, args, compartments):
-    result = odeint(model_func, y0, t, args=args)
-    unpacked = result.T
+
+def iter_windows(
+    model_func,
+    y0,
+    t,
+    args,
+    solver="odeint",
+    window=None,
+    first_window=None,
+    stats=None,
+):
+    # Integrates the time grid in consecutive windows, each one starting from
+    # the last state of the previous window. With first_window the windows
+    # start small and double up to `window`, so the first rows come back fast.
+    window = window or max(MIN_WINDOW, -(-len(t) // PROGRESS_WINDOWS))
+    size = min(first_window or window, window)
+    y = np.asarray(y0, dtype=float)
+    start = 0
+    while start < len(t):
+        stop = min(start + size, len(t))
+        if start == 0:
+            rows = integrate(model_func, y, t[:stop], args, solver, stats)
+        else:
+            rows = integrate(
+                model_func, y, t[start - 1 : stop], args, solver, stats
+            )[1:]
+        y = rows[-1]
+        yield start, stop, rows
+        start = stop
+        size = min(size * 2, window)
+
+
+def simulate_raw(
+    model_func,
+    y0,
+    t,
+    args,
+    compartments,
+    solver="odeint",
+    progress=None,
+    stats=None,
+):
+    # `stats`, when given, is filled with the solver's nfev/steps/njev.
+    if progress is None:
+        result = integrate(model_func, y0, t, args, solver, stats)
+    else:
+        result = np.empty((len(t), len(compartments)))
+        windows = iter_windows(model_func, y0, t, args, solver, stats=stats)
+        for start, stop, rows in windows:
+            result[start:stop] = rows
+            progress(stop / len(t))
+    unpacked = np.ascontiguousarray(result.T)
     return {
-        "time": t.tolist(),
-        **{comp: unpacked[i].tolist() for i, comp in enumerate(compartments)},
+        "time": t,
+        **{comp: unpacked[i] for i, comp in enumerate(compartments)},
     }
 
 
-def simulate_stats(
-    model_func, y0, t, args, compartments, beta, gamma, extra_outputs=None
+def simulate_decimated(
+    model_func,
+    y0,
+    t,
+    args,
+    compartments,
+    max_points,
+    method="lttb",
+    solver="odeint",
+    progress=None,
+    stats=None,
 ):
-    raw = simulate_raw(model_func, y0, t, args, compartments)
+    # simulate_raw for a point budget: every window is decimated as soon as
+    # it is solved, keeping about twice its share of `max_points`, so only
+    # one window of the grid is held at a time. Each window keeps its
+    # endpoints and its infection peak, so the peak and the final values of
+    # the candidates are those of the full grid; run_simulation takes its
+    # statistics from them and then decimates them to the budget.
+    kept = []
+    for start, stop, rows in iter_windows(model_func, y0, t, args, solver, stats=stats):
+        unpacked = np.ascontiguousarray(rows.T)
+        window = {
+            "time": t[start:stop],
+            **{comp: unpacked[i] for i, comp in enumerate(compartments)},
+        }
+        share = max(MIN_POINTS[method], -(-2 * max_points * (stop - start) // len(t)))
+        kept.append(downsample(window, share, method))
+        if progress is not None:
+            progress(stop / len(t))
+    return {name: np.concatenate([w[name] for w in kept]) for name in kept[0]}
+
+
+def simulate_interventions(
+    model, config, t, interventions, solver="odeint", progress=None, stats=None
+):
+    # Same columns as simulate_raw, plus the events that fired.
+    if solver != "odeint":
+        raise ValueError("Interventions are only supported by the odeint solver")
+    result, events = integrate_interventions(
+        model,
+        config["y0"],
+        t,
+        config["args"][:-1],
+        config["args"][-1],
+        interventions,
+        progress,
+        stats,
+    )
+    unpacked = np.ascontiguousarray(result.T)
+    raw = {
+        "time": t,
+        **{comp: unpacked[i] for i, comp in enumerate(config["compartments"])},
+    }
+    return raw, events
 
+
+def simulate_stats(model_func, y0, t, args, compartments, spec, solver="odeint"):
+    raw = simulate_raw(model_func, y0, t, args, compartments, solver)
+    stats = trajectory_stats(raw, t, spec, args)
+    return {**raw, **stats}
+
+
+def trajectory_stats(raw, t, spec, args):
     S = raw.get("S")
     I = raw.get("I")
     R = raw.get("R")
     peak_day = int(t[np.argmax(I)])
-    max_infected = max(I)
-
-    if (model_func == seihr_model or model_func == seiqr_model) and args[3] is not None: # SEIQR & SEIHR
-        r0 = beta / (gamma + args[3])
-    else:
-        r0 = beta / gamma
+    max_infected = float(np.max(I))
+    r0 = spec.r0(args[:-1])
 
     stats = {
         "max_infected": max_infected,
         "peak_day": peak_day,
         "r0": round(r0, 4),
         "hit": round((r0 - 1) / r0, 4),
-        "final_susceptible": S[-1],
-        "final_recovered": R[-1],
+        "final_susceptible": float(S[-1]),
+        "final_recovered": float(R[-1]),
     }
+    stats.update(
+        {name: float(value) for name, value in spec.extra_outputs(raw).items()}
+    )
+    return stats
 
-    if extra_outputs:
-        stats.update(extra_outputs(raw))
 
-    return {**raw, **stats}
+def stacked_rhs(model_func, n_comp):
+    # The state is laid out scenario-major, (K, n_comp) flattened, so the
+    # Jacobian is block diagonal and odeint can treat it as banded.
+    # The in-place kernel writes straight into the transposed view of the
+    # output, so no per-call list of rows has to be stacked.
+    kernel = KERNELS[model_func]
+
+    def rhs(y, t, *args):
+        out = np.empty_like(y)
+        kernel(y.reshape(-1, n_comp).T, out.reshape(-1, n_comp).T, *args)
+        return out
+
+    return rhs
+
+
+def simulate_batch(
+    model_func, y0, t, args, compartments, solver="odeint", stats=None
+):
+    n_comp = len(compartments)
+    y0 = np.asarray(y0, dtype=float)
+    if solver == "rk4":
+        record_stats(stats, 4 * RK4_SUBSTEPS * (len(t) - 1), RK4_SUBSTEPS * (len(t) - 1))
+        # (T, n_comp, K) -> (n_comp, K, T)
+        unpacked = rk4_solve(model_func, y0.T, t, args).transpose(1, 2, 0)
+        return {comp: unpacked[i] for i, comp in enumerate(compartments)}
+    if solver != "odeint":
+        raise ValueError(f"Unknown solver: {solver}")
+
+    result, info = odeint(
+        stacked_rhs(model_func, n_comp),
+        y0.ravel(),
+        t,
+        args=args,
+        ml=n_comp - 1,
+        mu=n_comp - 1,
+        full_output=True,
+    )
+    if len(t) > 1:
+        record_stats(stats, info["nfe"][-1], info["nst"][-1], info["nje"][-1])
+    # (T, K * n_comp) -> (n_comp, K, T)
+    unpacked = np.ascontiguousarray(
+        result.reshape(len(t), -1, n_comp).transpose(2, 1, 0)
+    )
+    return {comp: unpacked[i] for i, comp in enumerate(compartments)}
+
+
+def curve_stats(t, compartments, spec):
+    # Per-curve statistics along the last (time) axis, for any number of
+    # leading axes: scenarios of a batch, or regions x age groups.
+    S = compartments["S"]
+    I = compartments["I"]
+    R = compartments["R"]
+    stats = {
+        "max_infected": I.max(axis=-1),
+        "peak_day": t[I.argmax(axis=-1)].astype(int),
+        "final_susceptible": S[..., -1],
+        "final_recovered": R[..., -1],
+    }
+    stats.update(spec.extra_outputs(compartments))
+    return stats
+
+
+def batch_stats(spec, t, args, compartments):
+    r0 = spec.r0(args[:-1])
+    return {
+        **curve_stats(t, compartments, spec),
+        "r0": np.round(r0, 4),
+        "hit": np.round((r0 - 1) / r0, 4),
+    }
+
+
+def simulate_structured(
+    model,
+    structure,
+    grid,
+    t,
+    with_stats=True,
+    solver="odeint",
+    progress=None,
+    stats=None,
+    **rates,
+):
+    # Age x region run: the trajectories are the totals over all groups,
+    # statistics come per group, per region and per age group as well.
+    system = StructuredModel(model, structure)
+    spec = system.spec
+    rates = spec.rates(rates)
+    result = system.integrate(rates, grid, solver, progress, stats)
+    # (T, n_comp * M * K) -> (n_comp, M, K, T)
+    unpacked = result.reshape(len(grid), -1, system.regions, system.ages).transpose(
+        1, 2, 3, 0
+    )
+    groups = dict(zip(spec.compartments, unpacked))
+    raw = {
+        "time": grid,
+        **{comp: np.ascontiguousarray(v.sum(axis=(0, 1))) for comp, v in groups.items()},
+    }
+    if not with_stats:
+        return raw, {}
+
+    daily = np.isin(grid, t)
+    totals = take_points(raw, daily)
+    groups = {comp: v[..., daily] for comp, v in groups.items()}
+    r0 = system.r0(rates)
+    summary = {
+        **{name: value.item() for name, value in curve_stats(t, totals, spec).items()},
+        "r0": round(r0, 4),
+        "hit": round((r0 - 1) / r0, 4),
+        "groups": {
+            "regions": structure["regions"],
+            "age_groups": structure["ageGroups"],
+            "by_group": curve_stats(t, groups, spec),
+            "by_region": curve_stats(
+                t, {comp: v.sum(axis=1) for comp, v in groups.items()}, spec
+            ),
+            "by_age": curve_stats(
+                t, {comp: v.sum(axis=0) for comp, v in groups.items()}, spec
+            ),
+        },
+    }
+    return raw, summary
+
+
+def model_config(model="sir", n=100, initialS=99, initialI=1, **rates):
+    # Rates the model does not use are ignored and missing ones take their
+    # declared defaults. The model itself is compiled once, at registration;
+    # this only assembles the arguments.
+    spec = get_model(model)
+    y0 = [0] * len(spec.compartments)
+    y0[0] = initialS
+    y0[spec.seed] = initialI
+    return {
+        "func": spec.model,
+        "y0": y0,
+        "args": spec.rates(rates) + (n,),
+        "compartments": spec.compartments,
+        "spec": spec,
+    }
+
+
+def params_config(params):
+    # model_config for a full parameter dict such as simulation_params().
+    return model_config(**{k: v for k, v in params.items() if k != "days"})
 
 
 def run_simulation(
     model="sir",
-    beta=0.3,
-    gamma=0.1,
-    sigma=0.2,
-    delta=0.1,
-    v_rate=0.05,
-    h_rate=0.05,
-    mu=0.02,
     days=100,
     n=100,
     initialS=99,
     initialI=1,
     with_stats=True,
+    solver="odeint",
+    max_points=None,
+    t_eval=None,
+    downsample_method="lttb",
+    progress=None,
+    solver_stats=None,
+    structure=None,
+    interventions=None,
+    **rates,
 ):
 
     t = np.linspace(0, days, days)
+    # Requested output times are merged into the daily grid so that the
+    # statistics are still taken on exactly the same points as before.
+    if t_eval is not None:
+        t_eval = np.clip(np.asarray(t_eval, dtype=float), 0, days)
+    grid = t if t_eval is None else np.union1d(t, t_eval)
 
-    models = {
-        "sir": {
-            "func": sir_model,
-            "y0": [initialS, initialI, 0],
-            "args": (beta, gamma, n),
-            "compartments": ["S", "I", "R"],
-        },
-        "seir": {
-            "func": seir_model,
-            "y0": [initialS, initialI, 0, 0],
-            "args": (beta, sigma, gamma, n),
-            "compartments": ["S", "E", "I", "R"],
-        },
-        "seiqr": {
-            "func": seiqr_model,
-            "y0": [initialS, initialI, 0, 0, 0],
-            "args": (beta, sigma, gamma, delta, mu, n),
-            "compartments": ["S", "E", "I", "Q", "R"],
-        },
-        "seirv": {
-            "func": seirv_model,
-            "y0": [initialS, initialI, 0, 0, 0],
-            "args": (beta, sigma, gamma, v_rate, n),
-            "compartments": ["S", "E", "I", "R", "V"],
-            "extra": lambda d: {"final_vaccinated": d["V"][-1]},
-        },
-        "seihr": {
-            "func": seihr_model,
-            "y0": [initialS, initialI, 0, 0, 0],
-            "args": (beta, sigma, gamma, h_rate, mu, n),
-            "compartments": ["S", "E", "I", "H", "R"],
-        },
-    }
-
-    if model not in models:
-        raise ValueError(f"Unknown model: {model}")
-
-    config = models[model]
-    if with_stats:
-        return simulate_stats(
-            config["func"],
-            config["y0"],
-            t,
-            config["args"],
-            config["compartments"],
-            beta=beta,
-            gamma=gamma,
-            extra_outputs=config.get("extra"),
+    events = None
+    if structure is not None:
+        if interventions is not None:
+            raise ValueError("Interventions are not supported for structured models")
+        # n/initialS/initialI come from the structure's own population.
+        raw, stats = simulate_structured(
+            model, structure, grid, t, with_stats, solver, progress, solver_stats, **rates
         )
     else:
-        return simulate_raw(
-            config["func"], config["y0"], t, config["args"], config["compartments"]
+        config = model_config(model, n, initialS, initialI, **rates)
+        if interventions is not None:
+            raw, events = simulate_interventions(
+                model, config, grid, interventions, solver, progress, solver_stats
+            )
+        elif max_points is not None and t_eval is None:
+            raw = simulate_decimated(
+                config["func"],
+                config["y0"],
+                grid,
+                config["args"],
+                config["compartments"],
+                max_points,
+                downsample_method,
+                solver,
+                progress,
+                solver_stats,
+            )
+        else:
+            raw = simulate_raw(
+                config["func"],
+                config["y0"],
+                grid,
+                config["args"],
+                config["compartments"],
+                solver,
+                progress,
+                solver_stats,
+            )
+
+        stats = {}
+        if with_stats:
+            daily = raw if t_eval is None else take_points(raw, np.isin(grid, t))
+            stats = trajectory_stats(daily, daily["time"], config["spec"], config["args"])
+
+    if t_eval is not None:
+        raw = take_points(raw, np.searchsorted(grid, t_eval))
+    elif max_points is not None:
+        raw = downsample(raw, max_points, downsample_method)
+
+    if events is not None:
+        stats["events"] = events
+    return {**raw, **stats}
+
+
+def stream_simulation(
+    model="sir",
+    days=100,
+    n=100,
+    initialS=99,
+    initialI=1,
+    solver="odeint",
+    window=STREAM_WINDOW,
+    **rates,
+):
+    # Same grid and models as run_simulation, but yields one columnar chunk
+    # per window; only the current window is ever held in memory.
+    t = np.linspace(0, days, days)
+    config = model_config(model, n, initialS, initialI, **rates)
+    compartments = config["compartments"]
+    windows = iter_windows(
+        config["func"],
+        config["y0"],
+        t,
+        config["args"],
+        solver,
+        window=window,
+        first_window=STREAM_FIRST_WINDOW,
+    )
+    for start, stop, rows in windows:
+        unpacked = np.ascontiguousarray(rows.T)
+        yield {
+            "start": start,
+            "time": t[start:stop],
+            **{comp: unpacked[i] for i, comp in enumerate(compartments)},
+        }
+
+
+def run_simulation_batch(scenarios, with_stats=True, solver="odeint", solver_stats=None):
+    # Scenarios sharing a model and a time grid are integrated together as a
+    # single stacked system; each group comes back as one columnar block.
+    groups = {}
+    for index, params in enumerate(scenarios):
+        key = (params.get("model", "sir"), int(params.get("days", 100)))
+        groups.setdefault(key, []).append(index)
+
+    results = []
+    for (model, days), indices in groups.items():
+        t = np.linspace(0, days, days)
+        params = [
+            {k: v for k, v in scenarios[i].items() if k not in ("model", "days")}
+            for i in indices
+        ]
+        configs = [model_config(model, **p) for p in params]
+        config = configs[0]
+        y0 = np.array([c["y0"] for c in configs], dtype=float)
+        args = tuple(
+            np.array(column, dtype=float)
+            for column in zip(*(c["args"] for c in configs))
+        )
+
+        compartments = simulate_batch(
+            config["func"], y0, t, args, config["compartments"], solver, solver_stats
+        )
+
+        group = {
+            "model": model,
+            "days": days,
+            "indices": indices,
+            "parameters": {
+                name: [p.get(name) for p in params]
+                for name in sorted({name for p in params for name in p})
+            },
+            "time": t,
+            **compartments,
+        }
+
+        if with_stats:
+            stats = batch_stats(config["spec"], t, args, compartments)
+            group.update(stats)
+
+        results.append(group)
+
+    return {"count": len(scenarios), "results": results}
+
+
+def solver_deviation(solver, **params):
+    # Largest absolute difference from the odeint reference across all
+    # compartments, relative to the population size, for every model.
+    n = params.get("n", 100)
+    deviation = {}
+    for model in MODEL_PARAMS:
+        reference = run_simulation(model, **params, with_stats=False)
+        candidate = run_simulation(model, **params, with_stats=False, solver=solver)
+        deviation[model] = max(
+            float(np.max(np.abs(np.subtract(candidate[comp], reference[comp])))) / n
+            for comp in reference
+            if comp != "time"
         )
+    return deviation
@@ -1,45 +1,77 @@
-def sir_model(y, t, beta, gamma, N):
-    S, I, R = y
-    dSdt = -beta * S * I / N
-    dIdt = beta * S * I / N - gamma * I
-    dRdt = gamma * I
-    return [dSdt, dIdt, dRdt]
-
-
-def seir_model(y, t, beta, sigma, gamma, N):
-    S, E, I, R = y
-    dSdt = -beta * S * I / N
-    dEdt = beta * S * I / N - sigma * E
-    dIdt = sigma * E - gamma * I
-    dRdt = gamma * I
-    return [dSdt, dEdt, dIdt, dRdt]
-
-
-def seiqr_model(y, t, beta, sigma, gamma, delta, mu_q, N):
-    S, E, I, Q, R = y
-    dSdt = -beta * S * I / N
-    dEdt = beta * S * I / N - sigma * E
-    dIdt = sigma * E - gamma * I - delta * I
-    dQdt = delta * I - mu_q * Q
-    dRdt = gamma * I + mu_q * Q
-    return [dSdt, dEdt, dIdt, dQdt, dRdt]
-
-
-def seirv_model(y, t, beta, sigma, gamma, v_rate, N):
-    S, E, I, R, V = y
-    dSdt = -beta * S * I / N - v_rate * S
-    dEdt = beta * S * I / N - sigma * E
-    dIdt = sigma * E - gamma * I
-    dRdt = gamma * I
-    dVdt = v_rate * S
-    return [dSdt, dEdt, dIdt, dRdt, dVdt]
-
-
-def seihr_model(y, t, beta, sigma, gamma, h_rate, mu, N):
-    S, E, I, H, R = y
-    dSdt = -beta * S * I / N
-    dEdt = beta * S * I / N - sigma * E
-    dIdt = sigma * E - gamma * I - h_rate * I
-    dHdt = h_rate * I - mu * H
-    dRdt = gamma * I + mu * H
-    return [dSdt, dEdt, dIdt, dHdt, dRdt]
+from model_registry import Flow, ModelSpec, Parameter, register
+
+# Built-in models. Adding a model only takes a spec here: the RHS, kernel,
+# Jacobian and R0 are generated from its flows, and it becomes available to
+# every endpoint through the registry.
+
+BETA = Parameter("beta", 0.3)
+GAMMA = Parameter("gamma", 0.1)
+SIGMA = Parameter("sigma", 0.2)
+DELTA = Parameter("delta", 0.1)
+V_RATE = Parameter("v_rate", 0.05, "vRate")
+H_RATE = Parameter("h_rate", 0.05, "hRate")
+MU = Parameter("mu", 0.02)
+
+INFECTION = Flow("S", "E", "beta", "I")
+INCUBATION = Flow("E", "I", "sigma")
+RECOVERY = Flow("I", "R", "gamma")
+
+SIR = register(
+    ModelSpec(
+        "sir",
+        ["S", "I", "R"],
+        [BETA, GAMMA],
+        [Flow("S", "I", "beta", "I"), RECOVERY],
+    )
+)
+
+SEIR = register(
+    ModelSpec(
+        "seir",
+        ["S", "E", "I", "R"],
+        [BETA, SIGMA, GAMMA],
+        [INFECTION, INCUBATION, RECOVERY],
+    )
+)
+
+SEIQR = register(
+    ModelSpec(
+        "seiqr",
+        ["S", "E", "I", "Q", "R"],
+        [BETA, SIGMA, GAMMA, DELTA, MU],
+        [
+            INFECTION,
+            INCUBATION,
+            RECOVERY,
+            Flow("I", "Q", "delta"),
+            Flow("Q", "R", "mu"),
+        ],
+        isolated=["Q"],
+    )
+)
+
+SEIRV = register(
+    ModelSpec(
+        "seirv",
+        ["S", "E", "I", "R", "V"],
+        [BETA, SIGMA, GAMMA, V_RATE],
+        [INFECTION, INCUBATION, RECOVERY, Flow("S", "V", "v_rate")],
+        final_outputs={"final_vaccinated": "V"},
+    )
+)
+
+SEIHR = register(
+    ModelSpec(
+        "seihr",
+        ["S", "E", "I", "H", "R"],
+        [BETA, SIGMA, GAMMA, H_RATE, MU],
+        [
+            INFECTION,
+            INCUBATION,
+            RECOVERY,
+            Flow("I", "H", "h_rate"),
+            Flow("H", "R", "mu"),
+        ],
+        isolated=["H"],
+    )
+)
@@ -0,0 +1,93 @@
+import numpy as np
+from scipy.integrate import odeint
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+SOLVERS = ("odeint", "rk4")
+RK4_SUBSTEPS = 4
+# Largest deviation from odeint, as a fraction of the population, that the
+# rk4 backend is allowed to show on the default time grid.
+RK4_TOLERANCE = 1e-4
+
+
+def rk4_integrate(rhs, y, t, args, substeps, out):
+    k1 = np.empty_like(y)
+    k2 = np.empty_like(y)
+    k3 = np.empty_like(y)
+    k4 = np.empty_like(y)
+    stage = np.empty_like(y)
+
+    out[0] = y
+    for i in range(1, t.shape[0]):
+        h = (t[i] - t[i - 1]) / substeps
+        for _ in range(substeps):
+            rhs(y, k1, *args)
+            np.multiply(k1, 0.5 * h, stage)
+            np.add(stage, y, stage)
+            rhs(stage, k2, *args)
+            np.multiply(k2, 0.5 * h, stage)
+            np.add(stage, y, stage)
+            rhs(stage, k3, *args)
+            np.multiply(k3, h, stage)
+            np.add(stage, y, stage)
+            rhs(stage, k4, *args)
+
+            np.add(k2, k3, k2)
+            np.multiply(k2, 2.0, k2)
+            np.add(k1, k2, k1)
+            np.add(k1, k4, k1)
+            np.multiply(k1, h / 6.0, k1)
+            np.add(y, k1, y)
+        out[i] = y
+
+
+# model function -> in-place kernel / analytic Jacobian. Filled by the model
+# registry as models are compiled; kernels write into a preallocated `out`
+# and accept scalars or (K,) rows for batches.
+KERNELS = {}
+JACOBIANS = {}
+
+if njit is not None:
+    rk4_integrate = njit(cache=True)(rk4_integrate)
+
+
+def rk4_solve(model_func, y0, t, args, substeps=RK4_SUBSTEPS):
+    # y0 is (n_comp,) for a single run or (n_comp, K) for a stacked batch;
+    # the result is (T, n_comp) or (T, n_comp, K) respectively.
+    y = np.array(y0, dtype=float)
+    out = np.empty((len(t),) + y.shape)
+    args = tuple(np.asarray(a, dtype=float) if np.ndim(a) else float(a) for a in args)
+    rk4_integrate(KERNELS[model_func], y, np.asarray(t, dtype=float), args, substeps, out)
+    return out
+
+
+def record_stats(stats, nfev, steps, njev=0):
+    # Accumulates into a caller-supplied dict, so windowed solves add up.
+    if stats is not None:
+        stats["nfev"] = stats.get("nfev", 0) + int(nfev)
+        stats["steps"] = stats.get("steps", 0) + int(steps)
+        stats["njev"] = stats.get("njev", 0) + int(njev)
+
+
+def integrate(model_func, y0, t, args, solver="odeint", stats=None):
+    if solver == "odeint":
+        if stats is None:
+            return odeint(model_func, y0, t, args=args, Dfun=JACOBIANS.get(model_func))
+        result, info = odeint(
+            model_func,
+            y0,
+            t,
+            args=args,
+            Dfun=JACOBIANS.get(model_func),
+            full_output=True,
+        )
+        if len(t) > 1:
+            record_stats(stats, info["nfe"][-1], info["nst"][-1], info["nje"][-1])
+        return result
+    if solver == "rk4":
+        record_stats(stats, 4 * RK4_SUBSTEPS * (len(t) - 1), RK4_SUBSTEPS * (len(t) - 1))
+        return rk4_solve(model_func, y0, t, args)
+    raise ValueError(f"Unknown solver: {solver}")
@@ -0,0 +1,295 @@
+import math
+import secrets
+from concurrent.futures import as_completed
+import numpy as np
+from simulation_utils import params_config
+
+METHODS = ("tau", "gillespie")
+TAU_STEPS_PER_DAY = 10
+BLOCK_SIZE = 64
+# Histogram bins per day and compartment. Partial summaries are pickled
+# between processes, so this (with the ensemble day limit) bounds their size.
+QUANTILE_BINS = 128
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+
+
+def model_reactions(spec, rates, n):
+    # Reactions grouped by source compartment: source -> [(dest, rate,
+    # catalyst)], where a per-individual hazard is rate * x[catalyst] (the
+    # mass-action infection term) or just rate when catalyst is None.
+    groups = {}
+    for p, source, dest, catalyst in spec.flows:
+        if catalyst >= 0:
+            groups.setdefault(source, []).append((dest, rates[p] / n, catalyst))
+        else:
+            groups.setdefault(source, []).append((dest, rates[p], None))
+    return list(groups.items())
+
+
+def tau_leap_block(reactions, y0, days, replicates, rng, steps_per_day):
+    # Binomial tau-leaping for a block of replicates at once: every source
+    # compartment loses Binomial(x, 1 - exp(-h * tau)) individuals, split
+    # between its destinations in proportion to their hazards. Counts can
+    # never go negative, unlike Poisson leaping.
+    tau = 1.0 / steps_per_day
+    x = np.repeat(np.asarray(y0, dtype=np.int64)[:, None], replicates, axis=1)
+    out = np.empty((len(y0), replicates, days + 1), dtype=np.int64)
+    out[:, :, 0] = x
+
+    for day in range(1, days + 1):
+        for _ in range(steps_per_day):
+            delta = np.zeros_like(x)
+            for source, options in reactions:
+                hazards = [
+                    rate * x[catalyst] if catalyst is not None else np.full(replicates, rate)
+                    for _, rate, catalyst in options
+                ]
+                total = sum(hazards)
+                leaving = rng.binomial(x[source], -np.expm1(-total * tau))
+                delta[source] -= leaving
+                remaining_hazard = total
+                for (dest, _, _), hazard in zip(options[:-1], hazards[:-1]):
+                    share = np.divide(
+                        hazard,
+                        remaining_hazard,
+                        out=np.zeros(replicates),
+                        where=remaining_hazard > 0,
+                    )
+                    moved = rng.binomial(leaving, np.clip(share, 0, 1))
+                    delta[dest] += moved
+                    leaving = leaving - moved
+                    remaining_hazard = remaining_hazard - hazard
+                delta[options[-1][0]] += leaving
+            x += delta
+        out[:, :, day] = x
+    return out
+
+
+def gillespie_replicate(reactions, y0, days, rng):
+    flat = [
+        (source, dest, rate, catalyst)
+        for source, options in reactions
+        for dest, rate, catalyst in options
+    ]
+    x = [int(v) for v in y0]
+    out = np.empty((len(x), days + 1), dtype=np.int64)
+    t = 0.0
+    day = 0
+    uniforms = rng.random(4096)
+    used = 0
+
+    while day <= days:
+        propensities = [
+            rate * x[source] * (x[catalyst] if catalyst is not None else 1)
+            for source, _, rate, catalyst in flat
+        ]
+        total = math.fsum(propensities)
+        if total <= 0:
+            out[:, day:] = np.asarray(x)[:, None]
+            break
+
+        if used + 2 > len(uniforms):
+            uniforms = rng.random(4096)
+            used = 0
+        t -= math.log(1.0 - uniforms[used]) / total
+        pick = uniforms[used + 1] * total
+        used += 2
+
+        while day <= days and day < t:
+            out[:, day] = x
+            day += 1
+
+        for (source, dest, _, _), propensity in zip(flat, propensities):
+            pick -= propensity
+            if pick < 0:
+                break
+        x[source] -= 1
+        x[dest] += 1
+    return out
+
+
+def simulate_block(reactions, y0, days, replicates, rng, method, steps_per_day):
+    if method == "tau":
+        return tau_leap_block(reactions, y0, days, replicates, rng, steps_per_day)
+    if method == "gillespie":
+        runs = [gillespie_replicate(reactions, y0, days, rng) for _ in range(replicates)]
+        return np.stack(runs, axis=1)
+    raise ValueError(f"Unknown stochastic method: {method}")
+
+
+def histogram_edges(n, bins=QUANTILE_BINS):
+    # Small populations get one bin per integer count; larger ones use bins
+    # spaced on a square-root scale, so low counts keep a fine resolution.
+    if n + 1 <= bins:
+        return np.arange(n + 2, dtype=float)
+    return np.linspace(0.0, math.sqrt(n + 1), bins + 1) ** 2
+
+
+class EnsembleSummary:
+    # Streaming reductions over replicates. Only running sums, per-day
+    # histograms and peak-day counts are kept, and two summaries can be
+    # merged, so blocks from different workers are folded in as they finish.
+    def __init__(self, compartments, days, n):
+        self.compartments = compartments
+        self.days = days
+        self.edges = histogram_edges(n)
+        bins = len(self.edges) - 1
+        self.count = 0
+        self.sums = {c: np.zeros(days + 1, dtype=np.int64) for c in compartments}
+        self.sumsq = {c: np.zeros(days + 1) for c in compartments}
+        # Counts never exceed the number of replicates.
+        self.histograms = {
+            c: np.zeros((days + 1, bins), dtype=np.int32) for c in compartments
+        }
+        self.peak_days = np.zeros(days + 1, dtype=np.int64)
+        self.peak_sizes = []
+
+    def add(self, trajectories):
+        bins = len(self.edges) - 1
+        offsets = np.arange(self.days + 1) * bins
+        for i, compartment in enumerate(self.compartments):
+            values = trajectories[i]
+            self.sums[compartment] += values.sum(axis=0)
+            self.sumsq[compartment] += np.square(values, dtype=float).sum(axis=0)
+            binned = np.clip(
+                np.searchsorted(self.edges, values, side="right") - 1, 0, bins - 1
+            )
+            self.histograms[compartment] += np.bincount(
+                (binned + offsets).ravel(), minlength=(self.days + 1) * bins
+            ).reshape(self.days + 1, bins)
+
+        infected = trajectories[self.compartments.index("I")]
+        self.peak_days += np.bincount(infected.argmax(axis=1), minlength=self.days + 1)
+        self.peak_sizes.append(infected.max(axis=1))
+        self.count += trajectories.shape[1]
+
+    def merge(self, other):
+        for compartment in self.compartments:
+            self.sums[compartment] += other.sums[compartment]
+            self.sumsq[compartment] += other.sumsq[compartment]
+            self.histograms[compartment] += other.histograms[compartment]
+        self.peak_days += other.peak_days
+        self.peak_sizes.extend(other.peak_sizes)
+        self.count += other.count
+
+    def quantile(self, compartment, q):
+        histogram = self.histograms[compartment]
+        cumulative = np.cumsum(histogram, axis=1)
+        target = q * self.count
+        bin_index = np.minimum(
+            (cumulative < target).sum(axis=1), histogram.shape[1] - 1
+        )
+        rows = np.arange(len(histogram))
+        before = cumulative[rows, bin_index] - histogram[rows, bin_index]
+        inside = np.maximum(histogram[rows, bin_index], 1)
+        low = self.edges[bin_index]
+        width = self.edges[bin_index + 1] - low
+        fraction = np.clip((target - before) / inside, 0, 1)
+        return low + np.where(width > 1, width * fraction, 0)
+
+    def result(self, quantiles=DEFAULT_QUANTILES):
+        result = {"time": np.arange(self.days + 1, dtype=float)}
+        for compartment in self.compartments:
+            mean = self.sums[compartment] / self.count
+            variance = np.maximum(self.sumsq[compartment] / self.count - mean**2, 0)
+            result[f"{compartment}_mean"] = mean
+            result[f"{compartment}_std"] = np.sqrt(variance)
+            for q in quantiles:
+                result[f"{compartment}_q{q * 100:g}"] = self.quantile(compartment, q)
+
+        peak_sizes = np.concatenate(self.peak_sizes)
+        peak_day = np.repeat(np.arange(self.days + 1), self.peak_days)
+        result.update(
+            {
+                "peak_day_distribution": self.peak_days / self.count,
+                "replicates": self.count,
+                "mean_peak_day": float(peak_day.mean()),
+                "peak_day_quantiles": {
+                    f"q{q * 100:g}": float(np.quantile(peak_day, q)) for q in quantiles
+                },
+                "mean_max_infected": float(peak_sizes.mean()),
+                "max_infected_quantiles": {
+                    f"q{q * 100:g}": float(np.quantile(peak_sizes, q))
+                    for q in quantiles
+                },
+            }
+        )
+        return result
+
+
+def ensemble_setup(params):
+    config = params_config(params)
+    compartments = config["compartments"]
+    reactions = model_reactions(config["spec"], config["args"][:-1], params["n"])
+    return compartments, reactions, [int(v) for v in config["y0"]]
+
+
+def run_blocks(params, blocks, method, steps_per_day, progress=None):
+    # blocks: [(SeedSequence, replicates)]. Runs in a pool worker (or inline)
+    # and returns one partial summary for all of its blocks.
+    compartments, reactions, y0 = ensemble_setup(params)
+    summary = EnsembleSummary(compartments, params["days"], params["n"])
+    for i, (seed, replicates) in enumerate(blocks):
+        rng = np.random.default_rng(seed)
+        summary.add(
+            simulate_block(
+                reactions, y0, params["days"], replicates, rng, method, steps_per_day
+            )
+        )
+        if progress is not None:
+            progress((i + 1) / len(blocks))
+    return summary
+
+
+def ensemble_blocks(replicates, seed):
+    # One child SeedSequence per fixed-size block: the streams are
+    # independent, and a given seed reproduces the same ensemble whatever the
+    # number of workers. Unseeded runs draw a seed that fits in JSON, so it
+    # can be reported back and the ensemble replayed.
+    if seed is None:
+        seed = secrets.randbits(63)
+    sequence = np.random.SeedSequence(seed)
+    sizes = [BLOCK_SIZE] * (replicates // BLOCK_SIZE)
+    if replicates % BLOCK_SIZE:
+        sizes.append(replicates % BLOCK_SIZE)
+    return sequence.entropy, list(zip(sequence.spawn(len(sizes)), sizes))
+
+
+def run_ensemble(
+    params,
+    replicates=100,
+    seed=None,
+    method="tau",
+    steps_per_day=TAU_STEPS_PER_DAY,
+    quantiles=DEFAULT_QUANTILES,
+    executor=None,
+    workers=1,
+    progress=None,
+):
+    if method not in METHODS:
+        raise ValueError(f"Unknown stochastic method: {method}")
+    if replicates < 1 or steps_per_day < 1:
+        raise ValueError("replicates and stepsPerDay must be positive")
+    if any(not 0 <= q <= 1 for q in quantiles):
+        raise ValueError("quantiles must be between 0 and 1")
+
+    compartments, _, _ = ensemble_setup(params)
+    entropy, blocks = ensemble_blocks(replicates, seed)
+
+    if executor is None:
+        summary = run_blocks(params, blocks, method, steps_per_day, progress)
+    else:
+        summary = EnsembleSummary(compartments, params["days"], params["n"])
+        tasks = [blocks[i :: workers] for i in range(min(workers, len(blocks)))]
+        futures = [
+            executor.submit(run_blocks, params, task, method, steps_per_day)
+            for task in tasks
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            summary.merge(future.result())
+            if progress is not None:
+                progress(done / len(futures))
+
+    result = summary.result(quantiles)
+    result.update({"seed": entropy, "method": method})
+    return result
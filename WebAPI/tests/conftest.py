@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db
+from simulation_cache import simulation_cache
+
+RUN = {"model": "sir", "days": 100, "n": 1000, "initialS": 990, "initialI": 10}
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'app.db'}",
+            "JOB_STORE_PATH": str(tmp_path / "jobs.db"),
+        }
+    )
+    with app.app_context():
+        db.create_all()
+    yield app
+    simulation_cache.configure(simulation_cache.max_bytes)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth(client):
+    tokens = client.post("/auth/register", json={"email": "a@b.c", "password": "x"}).get_json()
+    return {"Authorization": f"Bearer {tokens['access']}"}
@@ -0,0 +1,23 @@
+import simulation
+from conftest import RUN
+
+
+def test_small_agent_runs_are_synchronous(client, auth):
+    response = client.post("/simulation/agents", json={**RUN, "seed": 1}, headers=auth)
+    assert response.status_code == 200
+
+
+def test_large_agent_runs_are_queued(client, auth, monkeypatch):
+    monkeypatch.setattr(simulation, "MAX_SYNC_AGENT_STEPS", 1000)
+    response = client.post("/simulation/agents", json={**RUN, "seed": 1}, headers=auth)
+    assert response.status_code == 202
+    assert "job_id" in response.get_json()
+
+
+def test_agent_work_is_capped(client, auth):
+    response = client.post(
+        "/simulation/agents",
+        json={**RUN, "n": 1000000, "initialS": 999990, "days": 1000},
+        headers=auth,
+    )
+    assert response.status_code == 400
@@ -0,0 +1,101 @@
+import pytest
+from analytics import rebuild_analytics
+from conftest import RUN
+
+BETAS = [0.2, 0.3, 0.45]
+
+
+def analytics(client, auth, model=None):
+    query = f"?model={model}" if model else ""
+    response = client.get(f"/simulation/analytics{query}", headers=auth)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def history(client, auth):
+    return client.get("/simulation/history?page_size=100", headers=auth).get_json()["simulations"]
+
+
+def assert_close(actual, expected):
+    # Deleting a run subtracts its sums again, which leaves rounding error.
+    if isinstance(expected, dict):
+        assert actual.keys() == expected.keys()
+        for key in expected:
+            assert_close(actual[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected)
+        for a, e in zip(actual, expected):
+            assert_close(a, e)
+    elif isinstance(expected, float):
+        assert actual == pytest.approx(expected, rel=1e-9, abs=1e-6)
+    else:
+        assert actual == expected
+
+
+def assert_matches_rebuild(app, client, auth):
+    # The incrementally maintained rows must equal a full recomputation.
+    incremental = analytics(client, auth)
+    with app.app_context():
+        rebuild_analytics()
+    assert_close(analytics(client, auth), incremental)
+    return incremental
+
+
+def test_post_updates_counts_and_moments(app, client, auth):
+    for beta in BETAS:
+        client.post("/simulation", json={**RUN, "beta": beta}, headers=auth)
+    client.post("/simulation", json={**RUN, "model": "seir"}, headers=auth)
+
+    result = assert_matches_rebuild(app, client, auth)
+    assert result["runs"] == 4
+    assert result["models"] == {"sir": 3, "seir": 1}
+    r0 = result["distributions"]["r0"]
+    assert r0["count"] == 4
+    assert sum(r0["counts"]) == 4
+    stored = [row["r0"] for row in history(client, auth)]
+    assert r0["mean"] == pytest.approx(sum(stored) / len(stored))
+    assert sum(result["scatter"]["beta"]["peak_day"]["count"]) == 4
+
+    sir = analytics(client, auth, "sir")
+    assert sir["runs"] == 3
+    assert sir["distributions"]["r0"]["mean"] == pytest.approx(sum(BETAS) / 0.1 / 3)
+
+
+def test_delete_takes_the_run_back_out(app, client, auth):
+    for beta in BETAS:
+        client.post("/simulation", json={**RUN, "beta": beta}, headers=auth)
+    removed = next(row for row in history(client, auth) if row["r0"] == 4.5)
+    assert client.delete(f"/simulation/{removed['id']}", headers=auth).status_code == 200
+
+    result = assert_matches_rebuild(app, client, auth)
+    assert result["models"] == {"sir": 2}
+    assert result["distributions"]["r0"]["mean"] == pytest.approx(2.5)
+    for row in history(client, auth):
+        client.delete(f"/simulation/{row['id']}", headers=auth)
+    result = analytics(client, auth)
+    assert result["runs"] == 0
+    assert result["distributions"]["r0"]["counts"] == []
+    assert result["scatter"] == {}
+
+
+def test_import_adds_to_the_aggregates(app, client, auth):
+    for beta in BETAS:
+        client.post("/simulation", json={**RUN, "beta": beta}, headers=auth)
+    before = analytics(client, auth)
+    data = client.get("/simulation/export?format=ndjson", headers=auth)
+    response = client.post(
+        "/simulation/import",
+        data=data.data,
+        headers={**auth, "Content-Type": data.mimetype},
+    )
+    assert response.status_code == 201
+
+    result = assert_matches_rebuild(app, client, auth)
+    assert result["runs"] == 2 * before["runs"]
+    r0 = result["distributions"]["r0"]
+    assert r0["counts"] == [2 * count for count in before["distributions"]["r0"]["counts"]]
+    assert r0["mean"] == pytest.approx(before["distributions"]["r0"]["mean"])
+
+
+def test_unknown_model_is_rejected(client, auth):
+    assert client.get("/simulation/analytics?model=bogus", headers=auth).status_code == 400
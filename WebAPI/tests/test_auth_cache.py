@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+from auth_cache import TokenRevocations
+from models import TokenBlocklist, db
+
+
+def add_row(jti, created_at, expires_at=None, row_id=None):
+    db.session.add(
+        TokenBlocklist(id=row_id, jti=jti, created_at=created_at, expires_at=expires_at)
+    )
+    db.session.commit()
+
+
+def test_late_committed_rows_are_picked_up(app):
+    revocations = TokenRevocations(refresh=0)
+    with app.app_context():
+        add_row("first", datetime.utcnow(), row_id=5)
+        assert not revocations.is_revoked("late")
+        # A lower id and an earlier created_at than what the last sync saw,
+        # as with a transaction that commits out of order.
+        add_row("late", datetime.utcnow() - timedelta(seconds=10), row_id=2)
+        assert revocations.is_revoked("late")
+
+
+def test_token_checks_do_not_purge(app):
+    revocations = TokenRevocations(refresh=0, rebuild=0)
+    expired = datetime.utcnow() - timedelta(days=1)
+    with app.app_context():
+        add_row("expired", expired, expires_at=expired)
+        revocations.is_revoked("other")
+        assert TokenBlocklist.query.count() == 1
+        assert TokenBlocklist.purge_expired() == 1
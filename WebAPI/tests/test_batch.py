@@ -0,0 +1,31 @@
+import pytest
+from conftest import RUN
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"grid": {"beta": 0.3}},
+        {"grid": {"beta": []}},
+        {"grid": {"beta": "0.3"}},
+        {"grid": [0.3]},
+        {"scenarios": {"beta": 0.3}},
+        {"scenarios": [0.3]},
+        {"grid": {"beta": [0.3]}, "solver": "bogus"},
+    ],
+)
+def test_invalid_batches_are_rejected(client, auth, body):
+    response = client.post("/simulation/batch", json={**RUN, **body}, headers=auth)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+@pytest.mark.parametrize("solver", ["odeint", "rk4"])
+def test_grid_batch_runs(client, auth, solver):
+    response = client.post(
+        "/simulation/batch",
+        json={**RUN, "grid": {"beta": [0.2, 0.3], "gamma": [0.1]}, "solver": solver},
+        headers=auth,
+    )
+    assert response.status_code == 200
+    assert response.get_json()["count"] == 2
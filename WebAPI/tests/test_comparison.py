@@ -0,0 +1,51 @@
+import numpy as np
+from conftest import RUN
+
+
+def post_runs(client, auth, betas):
+    for beta in betas:
+        response = client.post("/simulation", json={**RUN, "beta": beta, "gamma": 0.1}, headers=auth)
+        assert response.status_code == 200
+    history = client.get("/simulation/history", headers=auth).get_json()["simulations"]
+    return [s["id"] for s in reversed(history)]
+
+
+def test_compare_just_posted_runs(client, auth):
+    # Both trajectories come from the cached POST results, which also hold
+    # scalar stats.
+    ids = post_runs(client, auth, [0.3, 0.4])
+    response = client.post(
+        "/simulation/compare",
+        json={"simulation_ids": ids, "trajectories": True, "threshold": 100},
+        headers=auth,
+    )
+    assert response.status_code == 200, response.get_json()
+    comparison = response.get_json()["comparison"]
+    assert set(comparison["sources"].values()) == {"cached"}
+    assert sorted(comparison["series"]) == ["I", "R", "S"]
+    infected = comparison["metrics"]["I"]
+    assert infected["peak_shift"][0] == 0
+    assert infected["peak_shift"][1] < 0
+    assert infected["area_between"][1] > 0
+
+
+def test_compare_recomputed_matches_cached(client, auth):
+    from simulation_cache import simulation_cache
+
+    ids = post_runs(client, auth, [0.3, 0.35])
+    body = {"simulation_ids": ids, "trajectories": True}
+    cached = client.post("/simulation/compare", json=body, headers=auth).get_json()["comparison"]
+    simulation_cache.configure(simulation_cache.max_bytes)
+    computed = client.post("/simulation/compare", json=body, headers=auth).get_json()["comparison"]
+    assert set(computed["sources"].values()) == {"computed"}
+    np.testing.assert_allclose(computed["series"]["I"], cached["series"]["I"], rtol=1e-6)
+
+
+def test_compare_rejects_unknown_compartment(client, auth):
+    ids = post_runs(client, auth, [0.3])
+    response = client.post(
+        "/simulation/compare",
+        json={"simulation_ids": ids, "trajectories": True, "compartments": ["E"]},
+        headers=auth,
+    )
+    assert response.status_code == 400
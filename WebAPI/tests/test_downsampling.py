@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from conftest import RUN
+from simulation_utils import run_simulation
+
+LONG = {"model": "sir", "days": 20000, "n": 1000, "initialS": 999, "initialI": 1, "beta": 0.05, "gamma": 0.02}
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_windowed_decimation_keeps_peak_and_final_values(method):
+    full = run_simulation(**LONG)
+    decimated = run_simulation(**LONG, max_points=500, downsample_method=method)
+
+    assert len(decimated["time"]) <= 500
+    assert decimated["peak_day"] == full["peak_day"]
+    for name in ("max_infected", "final_susceptible", "final_recovered"):
+        assert decimated[name] == pytest.approx(full[name], rel=1e-4)
+    assert decimated["I"].max() == pytest.approx(full["I"].max(), rel=1e-4)
+    assert decimated["time"][-1] == full["time"][-1]
+    assert np.all(np.diff(decimated["time"]) > 0)
+
+
+@pytest.mark.parametrize("max_points, method", [(2, "lttb"), (3, "minmax"), (100, "bogus")])
+def test_too_few_points_are_rejected(client, auth, max_points, method):
+    response = client.post(
+        "/simulation",
+        json={**RUN, "maxPoints": max_points, "downsample": method},
+        headers=auth,
+    )
+    assert response.status_code == 400
@@ -0,0 +1,60 @@
+import pickle
+import pytest
+import numpy as np
+import simulation
+from conftest import RUN
+from simulation import MAX_ENSEMBLE_DAYS
+from stochastic import EnsembleSummary, run_blocks, ensemble_blocks
+
+
+def test_ensemble_days_are_capped(client, auth):
+    response = client.post(
+        "/simulation/ensemble",
+        json={**RUN, "days": MAX_ENSEMBLE_DAYS + 1, "replicates": 2},
+        headers=auth,
+    )
+    assert response.status_code == 400
+
+
+def test_partial_summary_stays_small():
+    summary = EnsembleSummary(["S", "E", "I", "R"], MAX_ENSEMBLE_DAYS, 10**9)
+    assert len(pickle.dumps(summary)) < 3 * 2**20
+
+
+def test_quantiles_track_the_replicates():
+    params = {**RUN, "beta": 0.3, "gamma": 0.1}
+    _, blocks = ensemble_blocks(256, seed=7)
+    summary = run_blocks(params, blocks, "tau", 10)
+    result = summary.result((0.5,))
+    # The histogram median stays close to the mean of a unimodal ensemble
+    # of this size; it is a sanity bound, not an exact check.
+    error = np.abs(result["I_q50"] - result["I_mean"]).max()
+    assert error < 0.1 * params["n"]
+
+
+def test_steps_per_day_is_capped(client, auth):
+    response = client.post(
+        "/simulation/ensemble", json={**RUN, "replicates": 2, "stepsPerDay": 1000}, headers=auth
+    )
+    assert response.status_code == 400
+
+
+def test_small_ensembles_run_in_the_request(client, auth):
+    response = client.post("/simulation/ensemble", json={**RUN, "replicates": 4}, headers=auth)
+    assert response.status_code == 200
+    assert response.get_json()["replicates"] == 4
+
+
+@pytest.mark.parametrize(
+    "body, limit",
+    [
+        ({"replicates": 10, "days": 100}, "MAX_SYNC_TAU_STEPS"),
+        ({"replicates": 10, "method": "gillespie"}, "MAX_SYNC_GILLESPIE_EVENTS"),
+    ],
+    ids=["tau", "gillespie"],
+)
+def test_large_ensembles_are_queued(client, auth, monkeypatch, body, limit):
+    # 10 replicates x 100 days x 10 steps, and 10 x n=1000, are just over.
+    monkeypatch.setattr(simulation, limit, 9999)
+    response = client.post("/simulation/ensemble", json={**RUN, **body}, headers=auth)
+    assert response.status_code == 202
@@ -0,0 +1,56 @@
+import pytest
+from conftest import RUN
+from simulation_utils import run_simulation
+
+TRUE = {"beta": 0.42, "gamma": 0.13}
+
+
+def observed(times):
+    result = run_simulation("sir", 100, 1000, 990, 10, t_eval=times, **TRUE)
+    return result["I"].tolist()
+
+
+def test_fit_recovers_known_rates(client, auth):
+    times = list(range(1, 61))
+    response = client.post(
+        "/simulation/fit",
+        json={**RUN, "observed": observed(times), "times": times, "starts": 3, "seed": 1},
+        headers=auth,
+    )
+    assert response.status_code == 200
+    result = response.get_json()
+    for name, value in TRUE.items():
+        assert result["parameters"][name] == pytest.approx(value, rel=1e-4)
+        low, high = result["confidence_intervals"][name]
+        assert low <= result["parameters"][name] <= high
+    assert result["rmse"] < 1e-2
+
+
+def test_fit_holds_unfitted_rates(client, auth):
+    times = list(range(1, 61))
+    response = client.post(
+        "/simulation/fit",
+        json={
+            **RUN,
+            "gamma": TRUE["gamma"],
+            "observed": observed(times),
+            "times": times,
+            "fit": ["beta"],
+            "starts": 2,
+            "seed": 1,
+        },
+        headers=auth,
+    )
+    assert response.status_code == 200
+    assert set(response.get_json()["parameters"]) == {"beta"}
+    assert response.get_json()["parameters"]["beta"] == pytest.approx(TRUE["beta"], rel=1e-4)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [{"observed": []}, {"starts": 0}, {"bounds": {"beta": [1, 0.5]}}, {"fit": ["sigma"]}],
+)
+def test_fit_rejects_invalid_requests(client, auth, change):
+    body = {**RUN, "observed": [1, 2, 3], **change}
+    response = client.post("/simulation/fit", json=body, headers=auth)
+    assert response.status_code == 400
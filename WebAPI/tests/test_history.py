@@ -0,0 +1,64 @@
+from datetime import datetime
+import pytest
+from conftest import RUN
+from models import Simulation, db
+
+
+@pytest.fixture
+def saved(app, client, auth):
+    # Seven runs, five of them sharing one created_at, so the cursor has to
+    # fall back on the id to order them.
+    for beta in (0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5):
+        client.post("/simulation", json={**RUN, "beta": beta}, headers=auth)
+    with app.app_context():
+        ids = [s.id for s in Simulation.query.order_by(Simulation.id)]
+        Simulation.query.filter(Simulation.id.in_(ids[:5])).update(
+            {"created_at": datetime(2024, 1, 1)}, synchronize_session=False
+        )
+        db.session.commit()
+        ordered = Simulation.query.order_by(
+            Simulation.created_at.desc(), Simulation.id.desc()
+        )
+        return [s.id for s in ordered]
+
+
+def history(client, auth, query):
+    response = client.get(f"/simulation/history?{query}", headers=auth)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 7])
+def test_cursor_pages_have_no_gaps_or_duplicates(client, auth, saved, page_size):
+    seen = []
+    query = f"page_size={page_size}"
+    while True:
+        page = history(client, auth, query)
+        assert len(page["simulations"]) <= page_size
+        assert "total" not in page
+        seen += [s["id"] for s in page["simulations"]]
+        if page["next_cursor"] is None:
+            break
+        query = f"page_size={page_size}&cursor={page['next_cursor']}"
+    assert seen == saved
+
+
+def test_page_mode_uses_offsets(client, auth, saved):
+    pages = [history(client, auth, f"page={page}&page_size=3") for page in (1, 2, 3, 4)]
+    assert [page["page"] for page in pages] == [1, 2, 3, 4]
+    assert all(page["total"] == 7 for page in pages)
+    assert [s["id"] for page in pages for s in page["simulations"]] == saved
+    assert pages[3]["simulations"] == []
+    assert history(client, auth, "page=1&page_size=3&count=0").get("total") is None
+
+
+@pytest.mark.parametrize(
+    "query, size", [("page_size=0", 1), ("page_size=1000", 100), ("page_size=ten", 10), ("", 10)]
+)
+def test_page_size_is_clamped(client, auth, query, size):
+    assert history(client, auth, query)["page_size"] == size
+
+
+def test_invalid_cursor_is_rejected(client, auth):
+    response = client.get("/simulation/history?cursor=not-a-cursor", headers=auth)
+    assert response.status_code == 400
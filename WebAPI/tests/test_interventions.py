@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from conftest import RUN
+from interventions import RateSchedule, parse_interventions
+from model_registry import get_model
+from simulation_utils import run_simulation
+
+BASE = ("sir", 100, 1000, 990, 10)
+STEP = {"schedules": [{"parameter": "beta", "kind": "step", "times": [20], "values": [0.1]}]}
+LOCKDOWN = {"events": [{"compartment": "I", "above": 100, "scale": {"beta": 0.5}}]}
+
+
+def test_empty_schedule_matches_plain_run():
+    plain = run_simulation(*BASE)
+    empty = run_simulation(*BASE, interventions=parse_interventions({}, "sir"))
+    assert empty["events"] == []
+    for compartment in ("S", "I", "R"):
+        np.testing.assert_allclose(empty[compartment], plain[compartment], rtol=1e-6, atol=1e-5)
+
+
+def test_step_schedule_changes_rate_at_its_time():
+    spec = get_model("sir")
+    schedule = RateSchedule(spec, spec.rates({}), parse_interventions(STEP, "sir")["schedules"])
+    assert schedule(np.nextafter(20.0, 0))[0] == 0.3
+    assert schedule(20.0)[0] == 0.1
+    assert schedule(99.0)[0] == 0.1
+    assert schedule(99.0)[1] == spec.rates({})[1]
+
+    times = [10, 19.5, 20.5, 30]
+    plain = run_simulation(*BASE, t_eval=times)
+    stepped = run_simulation(
+        *BASE, t_eval=times, interventions=parse_interventions(STEP, "sir")
+    )
+    np.testing.assert_allclose(stepped["I"][:2], plain["I"][:2], rtol=1e-6)
+    assert np.all(stepped["I"][2:] < plain["I"][2:])
+
+
+def test_threshold_event_fires_once_at_crossing():
+    result = run_simulation(*BASE, interventions=parse_interventions(LOCKDOWN, "sir"))
+    assert len(result["events"]) == 1
+    event = result["events"][0]
+    assert event["name"] == "event 0"
+    # Up to the event the run is the plain one, so I crosses 100 there.
+    crossing = run_simulation(*BASE, t_eval=[event["time"]])
+    assert crossing["I"][0] == pytest.approx(100, rel=1e-6)
+    plain = run_simulation(*BASE)
+    assert result["max_infected"] < plain["max_infected"]
+
+
+def test_events_are_saved_with_the_simulation(client, auth):
+    response = client.post(
+        "/simulation", json={**RUN, "interventions": LOCKDOWN}, headers=auth
+    )
+    assert response.status_code == 200
+    assert [e["name"] for e in response.get_json()["events"]] == ["event 0"]
+
+
+@pytest.mark.parametrize(
+    "interventions, message",
+    [
+        ([], "must be an object"),
+        ({"schedules": [{"parameter": "beta", "kind": "cubic", "times": [1], "values": [1]}]}, "kind"),
+        ({"schedules": [{"parameter": "beta", "times": [1, 2], "values": [1]}]}, "one value each"),
+        ({"schedules": [{"parameter": "beta", "times": [2, 1], "values": [1, 1]}]}, "increasing"),
+        ({"schedules": [{"parameter": "beta", "times": [1], "values": [-1]}]}, "non-negative"),
+        ({"schedules": [{"parameter": "sigma", "times": [1], "values": [1]}]}, "no parameter sigma"),
+        ({"schedules": [STEP["schedules"][0]] * 2}, "only one schedule"),
+        ({"events": [{"compartment": "E", "above": 1, "scale": {"beta": 0.5}}]}, "no compartment E"),
+        ({"events": [{"compartment": "I", "above": 1, "below": 2, "scale": {"beta": 0.5}}]}, "exactly one"),
+        ({"events": [{"compartment": "I", "above": "x", "scale": {"beta": 0.5}}]}, "must be numbers"),
+        ({"events": [{"compartment": "I", "above": 1}]}, "scale or set"),
+        ({"events": [{"compartment": "I", "above": 1, "set": {"gamma": "x"}}]}, "map parameters"),
+    ],
+)
+def test_parse_interventions_rejects(interventions, message):
+    with pytest.raises(ValueError, match=message):
+        parse_interventions(interventions, "sir")
+
+
+def test_invalid_interventions_are_a_bad_request(client, auth):
+    response = client.post(
+        "/simulation/view", json={**RUN, "interventions": {"events": [{}]}}, headers=auth
+    )
+    assert response.status_code == 400
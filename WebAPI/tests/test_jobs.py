@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+import time
+import pytest
+from jobs import JobQueue, QueueFull, UserLimitReached, connect
+from conftest import RUN
+
+
+def insert_job(path, job_id, status, owner=None, user_id="u"):
+    with connect(path) as connection:
+        connection.execute(
+            "INSERT INTO jobs (id, user_id, kind, status, params, created_at, owner) "
+            "VALUES (?, ?, 'simulation', ?, '{}', ?, ?)",
+            (job_id, user_id, status, time.time(), owner),
+        )
+
+
+def statuses(path):
+    with connect(path) as connection:
+        return dict(connection.execute("SELECT id, status FROM jobs").fetchall())
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def queue(app):
+    queue = JobQueue()
+    queue.init_app(app)
+    return queue
+
+
+def test_orphaned_jobs_fail_at_startup(app, tmp_path):
+    path = str(tmp_path / "jobs.db")
+    insert_job(path, "stale-running", "running")
+    insert_job(path, "stale-queued", "queued")
+    insert_job(path, "finished", "done")
+
+    queue = JobQueue()
+    queue.init_app(app)
+    assert queue.active_count("u") == 0
+    assert statuses(path) == {
+        "stale-running": "failed",
+        "stale-queued": "failed",
+        "finished": "done",
+    }
+
+
+def test_jobs_of_exited_workers_stop_counting(queue, dead_pid):
+    # The parent process stands in for another, live web worker.
+    for i in range(4):
+        insert_job(queue.path, f"dead-{i}", "running", owner=dead_pid)
+    insert_job(queue.path, "other-worker", "queued", owner=os.getppid())
+    assert queue.active_count("u") == 1
+
+    queue.submit("u", "simulation", RUN)
+    jobs = statuses(queue.path)
+    assert all(jobs[f"dead-{i}"] == "failed" for i in range(4))
+    assert jobs["other-worker"] == "queued"
+
+
+def test_user_limit_spans_workers(queue):
+    for i in range(queue.user_limit):
+        insert_job(queue.path, f"other-{i}", "running", owner=os.getppid())
+    with pytest.raises(UserLimitReached):
+        queue.submit("u", "simulation", RUN)
+
+
+def test_queue_size_spans_workers(queue):
+    queue.queue_size = 2
+    insert_job(queue.path, "a", "queued", owner=os.getppid(), user_id="v")
+    insert_job(queue.path, "b", "queued", owner=os.getppid(), user_id="w")
+    with pytest.raises(QueueFull):
+        queue.submit("u", "simulation", RUN)
+
+
+def test_child_exit_fails_the_workers_jobs(queue):
+    insert_job(queue.path, "exited", "running", owner=12345)
+    insert_job(queue.path, "other", "running", owner=os.getppid())
+    queue.fail_owner(12345)
+    assert statuses(queue.path) == {"exited": "failed", "other": "running"}
+
+
+def test_failing_on_done_marks_job_failed(app):
+    queue = JobQueue()
+    queue.init_app(app)
+
+    def on_done(job_id, result):
+        raise RuntimeError("database is gone")
+
+    job_id = queue.submit("u", "simulation", RUN, on_done)
+    for _ in range(200):
+        job = queue.get(job_id, "u")
+        if job["status"] == "failed":
+            break
+        time.sleep(0.05)
+    assert job["status"] == "failed"
+    assert job["error"] == "database is gone"
+
+
+@pytest.mark.parametrize("flag", ["0", "false", ""])
+def test_async_flag_off_runs_synchronously(client, auth, flag):
+    response = client.post(f"/simulation?async={flag}", json=RUN, headers=auth)
+    assert response.status_code == 200
+    assert "I" in response.get_json()
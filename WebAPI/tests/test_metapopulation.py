@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from conftest import RUN
+from metapopulation import parse_structure
+from simulation_utils import run_simulation
+
+MOBILITY = [[0, 0.1, 0], [0.05, 0, 0.2], [0, 0, 0]]
+REGIONS = {"population": [[400], [300], [300]]}
+
+
+def test_single_group_matches_base_model():
+    base = run_simulation("sir", 100, 1000, 990, 10)
+    structure = parse_structure({"population": [[1000]]}, 10)
+    structured = run_simulation("sir", 100, structure=structure)
+    # BDF at rtol 1e-6 against odeint; the difference is solver error only.
+    for compartment in ("S", "I", "R"):
+        np.testing.assert_allclose(structured[compartment], base[compartment], atol=5e-3)
+    assert structured["r0"] == pytest.approx(base["r0"])
+
+
+def test_dense_and_sparse_mobility_agree():
+    rows, cols = np.nonzero(MOBILITY)
+    triplets = {
+        "rows": rows.tolist(),
+        "cols": cols.tolist(),
+        "values": [MOBILITY[r][c] for r, c in zip(rows, cols)],
+    }
+    dense = parse_structure({**REGIONS, "mobility": MOBILITY}, 10)
+    sparse = parse_structure({**REGIONS, "mobility": triplets}, 10)
+    assert dense == sparse
+    first = run_simulation("seir", 100, structure=dense)
+    second = run_simulation("seir", 100, structure=sparse)
+    for compartment in ("S", "E", "I", "R"):
+        np.testing.assert_array_equal(first[compartment], second[compartment])
+
+
+@pytest.mark.parametrize(
+    "structure, message",
+    [
+        ([[1000]], "must be an object"),
+        ({"population": [1000]}, "regions x age groups"),
+        ({"population": [[0]]}, "must not be empty"),
+        ({"population": [[-1, 5]], "contacts": [[1, 0], [0, 1]]}, "non-negative"),
+        ({"population": [[500, 500]]}, "contacts are required"),
+        ({"population": [[500, 500]], "contacts": [[1]]}, "2x2"),
+        ({"population": [[10]], "initialInfected": [[20]]}, "cannot exceed"),
+        ({"population": [[10], [10]], "regions": ["a"]}, "must name all 2"),
+        ({"population": [[10], [10]], "mobility": [[0, 1.5], [0, 0]]}, "at most 1"),
+        ({"population": [[10], [10]], "mobility": {"rows": [0], "cols": [2], "values": [0.1]}}, "refer to regions"),
+        ({"population": [[10], [10]], "mobility": {"rows": [0], "cols": [1]}}, "equal-length"),
+    ],
+)
+def test_parse_structure_rejects(structure, message):
+    with pytest.raises(ValueError, match=message):
+        parse_structure(structure, 1)
+
+
+def test_invalid_structure_is_a_bad_request(client, auth):
+    response = client.post(
+        "/simulation/view", json={**RUN, "structure": {"population": [[0]]}}, headers=auth
+    )
+    assert response.status_code == 400
+    assert "must not be empty" in response.get_json()["error"]
@@ -0,0 +1,13 @@
+from conftest import RUN
+
+
+def test_unknown_model_and_solver_are_not_labels(client, auth):
+    client.post("/simulation", json={**RUN, "model": "zzz_bogus_1"}, headers=auth)
+    client.post("/simulation", json={**RUN, "solver": "bogus_solver_x"}, headers=auth)
+    client.post("/simulation", json=RUN, headers=auth)
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert "zzz_bogus_1" not in body
+    assert "bogus_solver_x" not in body
+    assert 'epidemica_solver_runs_total{model="sir",solver="odeint"' in body
+    assert 'epidemica_solver_runs_total{model="sir",solver="other"' in body
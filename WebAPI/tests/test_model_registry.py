@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import simulation_utils  # noqa: F401  (registers the built-in models)
+from model_registry import MODEL_PARAMS, ModelSpec, get_model
+from solvers import JACOBIANS
+
+SIR = dict(
+    name="custom",
+    compartments=["S", "I", "R"],
+    parameters=[("beta", 0.3), ("gamma", 0.1)],
+    flows=[("S", "I", "beta", "I"), ("I", "R", "gamma")],
+)
+
+
+@pytest.mark.parametrize(
+    "model, expected",
+    [
+        ("sir", lambda p: p["beta"] / p["gamma"]),
+        ("seir", lambda p: p["beta"] / p["gamma"]),
+        ("seirv", lambda p: p["beta"] / p["gamma"]),
+        ("seiqr", lambda p: p["beta"] / (p["gamma"] + p["delta"])),
+        ("seihr", lambda p: p["beta"] / (p["gamma"] + p["h_rate"])),
+    ],
+)
+def test_r0_matches_closed_form(model, expected):
+    compiled = get_model(model)
+    for params in ({}, {"beta": 0.45, "gamma": 0.07, "delta": 0.2, "h_rate": 0.03}):
+        rates = compiled.rates(params)
+        named = dict(zip(compiled.parameters, rates))
+        assert compiled.r0(rates) == pytest.approx(expected(named), rel=1e-12)
+
+
+def test_r0_broadcasts_over_scenarios():
+    compiled = get_model("sir")
+    beta = np.array([0.2, 0.3, 0.5])
+    np.testing.assert_allclose(compiled.r0((beta, 0.1)), beta / 0.1)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"flows": [("S", "I", "beta", "I"), ("I", "R", "omega")]},
+        {"flows": [("S", "I", "beta", "I"), ("I", "D", "gamma")]},
+        {"flows": [("S", "I", "beta", "X"), ("I", "R", "gamma")]},
+        {"flows": [("S", "I", "beta"), ("I", "R", "gamma")]},
+        {"compartments": ["S", "I"], "flows": [("S", "I", "beta", "I")]},
+        {"parameters": [("beta", 0.3)], "flows": [("S", "I", "beta", "I")]},
+        {"seed": "E"},
+    ],
+    ids=[
+        "unknown-rate",
+        "unknown-dest",
+        "unknown-catalyst",
+        "no-infection",
+        "missing-compartment",
+        "missing-parameter",
+        "unknown-seed",
+    ],
+)
+def test_invalid_specs_are_rejected(change):
+    with pytest.raises(ValueError):
+        ModelSpec(**{**SIR, **change})
+
+
+def test_unknown_model_is_rejected():
+    with pytest.raises(ValueError, match="Unknown model"):
+        get_model("bogus")
+
+
+@pytest.mark.parametrize("model", sorted(MODEL_PARAMS))
+def test_jacobian_matches_finite_differences(model):
+    compiled = get_model(model)
+    rates = compiled.rates({})
+    n = 1000.0
+    rng = np.random.default_rng(7)
+    y = rng.uniform(10, 300, len(compiled.compartments))
+    analytic = np.asarray(JACOBIANS[compiled.model](y, 0.0, *rates, n), dtype=float)
+
+    step = 1e-4
+    numeric = np.empty_like(analytic)
+    for column in range(len(y)):
+        up, down = y.copy(), y.copy()
+        up[column] += step
+        down[column] -= step
+        numeric[:, column] = (
+            np.asarray(compiled.model(up, 0.0, *rates, n))
+            - np.asarray(compiled.model(down, 0.0, *rates, n))
+        ) / (2 * step)
+    np.testing.assert_allclose(analytic, numeric, rtol=1e-6, atol=1e-8)
@@ -0,0 +1,73 @@
+import io
+import time
+import zipfile
+from conftest import RUN
+from reports import report_key
+
+
+def saved_ids(client, auth, count):
+    for beta in (0.2, 0.3, 0.4)[:count]:
+        client.post("/simulation", json={**RUN, "beta": beta}, headers=auth)
+    history = client.get("/simulation/history", headers=auth).get_json()
+    return [item["id"] for item in history["simulations"]]
+
+
+def finished(client, auth, response):
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    for _ in range(400):
+        job = client.get(f"/simulation/jobs/{job_id}", headers=auth).get_json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done", job
+    return client.get(job["result"]["file"], headers=auth)
+
+
+def eventually(request, status=200):
+    # The render's on_done callback fills the cache just after the job is
+    # marked done.
+    for _ in range(100):
+        response = request()
+        if response.status_code == status:
+            return response
+        time.sleep(0.05)
+    return response
+
+
+def test_report_renders_in_a_job_then_comes_from_the_cache(client, auth):
+    (sim_id,) = saved_ids(client, auth, 1)
+    url = f"/simulation/{sim_id}/report"
+
+    download = finished(client, auth, client.get(url, headers=auth))
+    assert download.mimetype == "application/pdf"
+    assert download.data.startswith(b"%PDF")
+
+    cached = eventually(lambda: client.get(url, headers=auth))
+    assert cached.status_code == 200
+    assert cached.data == download.data
+
+    etag = {"If-None-Match": f'"{report_key(sim_id)}"'}
+    assert client.get(url, headers={**auth, **etag}).status_code == 304
+
+
+def test_matching_etag_skips_the_render(client, auth):
+    (sim_id,) = saved_ids(client, auth, 1)
+    response = client.get(
+        f"/simulation/{sim_id}/report",
+        headers={**auth, "If-None-Match": f'"{report_key(sim_id)}"'},
+    )
+    assert response.status_code == 304
+
+
+def test_report_batch_renders_in_a_job(client, auth):
+    ids = saved_ids(client, auth, 2)
+    request = lambda: client.post("/simulation/reports", json={"simulation_ids": ids}, headers=auth)
+
+    download = finished(client, auth, request())
+    assert download.mimetype == "application/zip"
+    assert len(zipfile.ZipFile(io.BytesIO(download.data)).namelist()) == 2
+
+    cached = eventually(request)
+    assert cached.status_code == 200
+    assert cached.data == download.data
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import sensitivity
+import simulation
+from conftest import RUN
+
+SMALL = {**RUN, "samples": 16, "parameters": {"beta": [0.2, 0.4], "gamma": [0.05, 0.15]}, "seed": 3}
+
+
+def test_small_designs_run_in_the_request(client, auth):
+    response = client.post("/simulation/sensitivity", json=SMALL, headers=auth)
+    assert response.status_code == 200
+
+
+def test_large_designs_are_queued(client, auth, monkeypatch):
+    # 16 samples x (2 + 2) x 100 days.
+    monkeypatch.setattr(simulation, "MAX_SYNC_SENSITIVITY_WORK", 6399)
+    response = client.post("/simulation/sensitivity", json=SMALL, headers=auth)
+    assert response.status_code == 202
+
+
+@pytest.mark.parametrize(
+    "body",
+    [{"days": 3651}, {"days": 3650, "samples": 16384}],
+    ids=["days", "work"],
+)
+def test_long_designs_are_rejected(client, auth, body):
+    response = client.post("/simulation/sensitivity", json={**SMALL, **body}, headers=auth)
+    assert response.status_code == 400
+
+
+def test_long_horizons_use_smaller_chunks(monkeypatch):
+    params = {**RUN, "beta": 0.3, "gamma": 0.1}
+    samples = np.random.default_rng(0).uniform([0.2, 0.05], [0.4, 0.15], (10, 2))
+    args = (params, ["beta", "gamma"], samples, ["peak_day", "max_infected"], "odeint")
+    expected = sensitivity.evaluate_design(*args)
+
+    sizes = []
+    evaluate_chunk = sensitivity.evaluate_chunk
+    monkeypatch.setattr(
+        sensitivity,
+        "evaluate_chunk",
+        lambda params, names, chunk, *rest: sizes.append(len(chunk))
+        or evaluate_chunk(params, names, chunk, *rest),
+    )
+    monkeypatch.setattr(sensitivity, "CHUNK_POINTS", 3 * RUN["days"])
+    np.testing.assert_allclose(sensitivity.evaluate_design(*args), expected)
+    assert sizes == [3, 3, 3, 1]
@@ -0,0 +1,110 @@
+import json
+import struct
+import numpy as np
+import pytest
+from flask import jsonify
+from conftest import RUN
+from serialization import encode_binary
+
+
+def decode_binary(body):
+    (size,) = struct.unpack_from("<I", body)
+    header = json.loads(body[4 : 4 + size])
+    offset = 4 + size + (-(4 + size) % 8)
+    values = np.frombuffer(body, dtype=header["dtype"], offset=offset)
+    return header, values.reshape(len(header["columns"]), header["length"])
+
+
+@pytest.mark.parametrize(
+    "mimetype, dtype",
+    [("application/octet-stream", "<f8"), ("application/vnd.epidemica.float32", "<f4")],
+)
+def test_binary_response_matches_json(client, auth, mimetype, dtype):
+    expected = client.post("/simulation/view", json=RUN, headers=auth).get_json()
+    response = client.post(
+        "/simulation/view", json=RUN, headers={**auth, "Accept": mimetype}
+    )
+    assert response.mimetype == mimetype
+    assert response.content_length == len(response.data)
+
+    header, columns = decode_binary(response.data)
+    assert header["dtype"] == dtype
+    for name, values in zip(header["columns"], columns):
+        np.testing.assert_allclose(values, expected[name], rtol=1e-6)
+
+
+def test_float64_columns_are_not_copied():
+    column = np.linspace(0, 1, 10)
+    pieces = encode_binary({"time": column})
+    assert np.shares_memory(np.frombuffer(pieces[-1], dtype="<f8"), column)
+
+
+@pytest.mark.parametrize(
+    "args, kwargs, expected",
+    [((), {}, None), ((1,), {}, 1), ((1, 2), {}, [1, 2]), ((), {"a": 1}, {"a": 1})],
+)
+def test_jsonify_arguments(app, args, kwargs, expected):
+    with app.app_context():
+        assert jsonify(*args, **kwargs).get_json() == expected
+
+
+def stream(client, auth, accept, **body):
+    response = client.post(
+        "/simulation/view/stream",
+        json={**RUN, **body},
+        headers={**auth, "Accept": accept},
+    )
+    assert response.status_code == 200
+    return response
+
+
+def joined(chunks):
+    return {
+        name: np.concatenate([chunk[name] for chunk in chunks])
+        for name in ("time", "S", "I", "R")
+    }
+
+
+def test_ndjson_stream_matches_view(client, auth):
+    expected = client.post("/simulation/view", json=RUN, headers=auth).get_json()
+    response = stream(client, auth, "application/x-ndjson", window=30)
+    assert response.mimetype == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in response.data.splitlines()]
+    assert lines[-1] == {"done": True}
+    chunks = lines[:-1]
+    assert len(chunks) > 1
+    sizes = [len(chunk["time"]) for chunk in chunks]
+    assert [chunk["start"] for chunk in chunks] == [sum(sizes[:i]) for i in range(len(sizes))]
+    for name, values in joined(chunks).items():
+        np.testing.assert_allclose(values, expected[name], rtol=1e-6)
+
+
+def test_event_stream_matches_ndjson(client, auth):
+    response = stream(client, auth, "application/x-ndjson")
+    ndjson = [json.loads(line) for line in response.data.splitlines()]
+    response = stream(client, auth, "text/event-stream")
+    assert response.mimetype == "text/event-stream"
+
+    events = []
+    for block in response.data.decode().strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    assert [name for name, _ in events] == ["window"] * (len(events) - 1) + ["end"]
+    assert [payload for _, payload in events] == ndjson
+
+
+@pytest.mark.parametrize(
+    "body, message",
+    [
+        ({"solver": "euler"}, "Unknown solver"),
+        ({"window": "big"}, "integer"),
+        ({"window": None}, "integer"),
+        ({"window": 0}, "positive"),
+        ({"model": "bogus"}, "Unknown model"),
+    ],
+)
+def test_stream_rejects_invalid_requests(client, auth, body, message):
+    response = client.post("/simulation/view/stream", json={**RUN, **body}, headers=auth)
+    assert response.status_code == 400
+    assert message in response.get_json()["error"]
@@ -0,0 +1,101 @@
+import pickle
+from types import SimpleNamespace
+import pytest
+import simulation_cache as simulation_cache_module
+from flask import Flask
+from conftest import RUN
+from simulation_cache import SimulationCache, cache_key, simulation_cache
+
+
+def blob_size(value):
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def test_key_is_canonical():
+    params = {**RUN, "beta": 0.3, "gamma": 0.1}
+    assert cache_key(params) == cache_key(
+        {**params, "days": "100", "beta": "0.3", "gamma": 0.1000}
+    )
+    assert cache_key(params) == cache_key(dict(reversed(list(params.items()))))
+    # SIR never reads sigma or delta.
+    assert cache_key(params) == cache_key({**params, "sigma": 0.9, "delta": 0.4})
+    assert cache_key(params) != cache_key({**params, "beta": 0.31})
+    assert cache_key(params) != cache_key({**params, "model": "seir"})
+    assert cache_key(params) != cache_key(params, solver="rk4")
+    with pytest.raises(ValueError):
+        cache_key({"model": "bogus"})
+
+
+def test_repeated_and_ignored_params_hit(client, auth):
+    info = simulation_cache.info
+    client.post("/simulation/view", json=RUN, headers=auth)
+    assert (info()["hits"], info()["misses"]) == (0, 1)
+    client.post("/simulation/view", json=RUN, headers=auth)
+    client.post("/simulation/view", json={**RUN, "delta": 0.7, "vRate": 0.2}, headers=auth)
+    assert (info()["hits"], info()["misses"]) == (2, 1)
+    client.post("/simulation/view", json={**RUN, "beta": 0.4}, headers=auth)
+    assert (info()["hits"], info()["misses"]) == (2, 2)
+
+
+def test_least_recently_used_entries_are_evicted():
+    value = list(range(100))
+    cache = SimulationCache(max_bytes=2 * blob_size(value))
+    cache.put("a", value)
+    cache.put("b", value)
+    assert cache.get("a") == value
+    cache.put("c", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value
+    assert cache.get("c") == value
+    info = cache.info()
+    assert info["entries"] == 2
+    assert info["bytes"] == 2 * blob_size(value) <= info["max_bytes"]
+    assert info["evictions"] == 1
+
+
+def test_entries_over_the_budget_are_not_kept():
+    cache = SimulationCache(max_bytes=64)
+    cache.put("big", list(range(1000)))
+    assert cache.get("big") is None
+    assert cache.info()["bytes"] == 0
+
+
+def test_disk_tier_survives_reconfiguration(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SimulationCache(path=path)
+    cache.put("key", {"I": [1, 2, 3]})
+
+    # As in a freshly forked worker: the memory tier starts empty.
+    cache.configure(cache.max_bytes, path)
+    assert cache.info()["entries"] == 0
+    assert cache.get("key") == {"I": [1, 2, 3]}
+    assert cache.info()["disk_hits"] == 1
+    assert cache.get("key") == {"I": [1, 2, 3]}
+    assert cache.info()["hits"] == 1
+
+
+def test_disk_tier_survives_init_app(tmp_path):
+    app = Flask(__name__)
+    app.config["SIMULATION_CACHE_PATH"] = str(tmp_path / "cache.db")
+    first, second = SimulationCache(), SimulationCache()
+    first.init_app(app)
+    first.put("key", "value")
+
+    second.init_app(app)
+    first.init_app(app)
+    assert second.get("key") == "value"
+    assert first.get("key") == "value"
+    assert first.info()["persistent"]
+
+
+def test_disk_tier_keeps_the_most_recent_entries(tmp_path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(simulation_cache_module, "time", SimpleNamespace(time=lambda: next(clock)))
+    cache = SimulationCache(path=str(tmp_path / "cache.db"), max_disk_entries=2)
+    for key in "abc":
+        cache.put(key, key)
+    cache.configure(cache.max_bytes, cache.path, cache.max_disk_entries)
+    assert cache.info()["disk_entries"] == 2
+    assert cache.get("a") is None
+    assert cache.get("c") == "c"
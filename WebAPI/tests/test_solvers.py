@@ -0,0 +1,29 @@
+import pytest
+import solvers
+from simulation_utils import MODEL_PARAMS, solver_deviation
+
+
+@pytest.fixture(params=["python", "numba"])
+def backend(request, monkeypatch):
+    # Without numba the kernels are plain Python already; with it, the
+    # "python" run swaps the compiled functions for their sources.
+    if request.param == "numba":
+        if solvers.njit is None:
+            pytest.skip("numba is not installed")
+    elif solvers.njit is not None:
+        monkeypatch.setattr(solvers, "rk4_integrate", solvers.rk4_integrate.py_func)
+        for model_func, kernel in list(solvers.KERNELS.items()):
+            monkeypatch.setitem(solvers.KERNELS, model_func, kernel.py_func)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{}, {"days": 365, "n": 100000, "initialS": 99990, "initialI": 10}],
+    ids=["default", "year"],
+)
+def test_rk4_stays_within_tolerance(backend, params):
+    deviation = solver_deviation("rk4", **params)
+    assert set(deviation) == set(MODEL_PARAMS)
+    for model, value in deviation.items():
+        assert value < solvers.RK4_TOLERANCE, model
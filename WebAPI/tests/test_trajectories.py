@@ -0,0 +1,28 @@
+from sqlalchemy import event
+from conftest import RUN
+from models import Simulation, SimulationTrajectory, db
+
+
+def count_queries(app):
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_stored_trajectories_load_in_one_query(app, client, auth):
+    for beta in (0.2, 0.3):
+        client.post("/simulation", json={**RUN, "beta": beta, "storeTrajectory": True}, headers=auth)
+    with app.app_context():
+        ids = [s.id for s in Simulation.query]
+        statements = count_queries(app)
+
+        loaded = SimulationTrajectory.load_many(ids)
+        assert len(statements) == 1
+        assert set(loaded) == set(ids)
+        assert all(len(columns["I"]) == RUN["days"] for columns in loaded.values())
+
+        db.session.expunge_all()
+        statements.clear()
+        assert len(SimulationTrajectory.load(ids[0])["S"]) == RUN["days"]
+        assert len(statements) == 1